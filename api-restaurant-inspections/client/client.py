@@ -1,9 +1,13 @@
 import json
 import argparse
+import math
 import sys
+import threading
+import time
 import requests
-from requests.exceptions import ConnectionError, ConnectTimeout
+from requests.exceptions import RequestException
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from os import path
 
 
@@ -167,6 +171,114 @@ def run_script(script_file, cfg):
     print("Done")
 
 
+# Keep-alive session of the current benchmark thread
+bench_local = threading.local()
+
+
+def bench_session():
+    if not hasattr(bench_local, "session"):
+        bench_local.session = requests.Session()
+    return bench_local.session
+
+
+# Nearest-rank percentile of a sorted list
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    rank = max(math.ceil(pct / 100.0 * len(sorted_values)), 1)
+    return sorted_values[rank - 1]
+
+
+# Time a single request, returns (endpoint, latency in seconds, ok)
+def timed_request(method, endpoint, url, body, expected):
+    start = time.perf_counter()
+    try:
+        if method == "POST":
+            r = bench_session().post(url, json=body)
+        else:
+            r = bench_session().get(url)
+        ok = r.status_code in expected
+    except RequestException:
+        # Refused, timed out or cut off: an error of the run, not its end
+        ok = False
+    return endpoint, time.perf_counter() - start, ok
+
+
+# Build the list of requests of a test file
+def bench_requests(server, test_file_path):
+    with open(test_file_path, 'r') as test_file:
+        script = json.load(test_file)
+    response = script["response"]
+    if not isinstance(response, list):
+        response = [response]
+    reqs = []
+    if "post_path" in script:
+        post_url = "%s%s" % (server, script["post_path"])
+        endpoint = "POST /%s" % script["post_path"]
+        for v in script["values"]:
+            reqs.append(("POST", endpoint, post_url, v, response))
+    elif "get_path" in script:
+        get_urlbase = "%s%s" % (server, script["get_path"])
+        endpoint = "GET /%s" % script["get_path"]
+        for v in script["tests"]:
+            if "inputs" in v:
+                get_url = "%s/%s" % (get_urlbase, str(v["inputs"]))
+            else:
+                get_url = get_urlbase
+            reqs.append(("GET", endpoint, get_url, None, response))
+    return reqs
+
+
+# Print throughput and latency percentiles per endpoint
+def print_bench_report(latencies, errors, wall_times):
+    print("%-40s %7s %6s %9s %9s %9s %9s %9s" % ("endpoint", "count", "errors",
+          "req/s", "p50 ms", "p95 ms", "p99 ms", "max ms"))
+    for endpoint in sorted(latencies):
+        values = sorted(latencies[endpoint])
+        wall = wall_times[endpoint]
+        print("%-40s %7d %6d %9.1f %9.2f %9.2f %9.2f %9.2f" % (
+              endpoint, len(values), errors[endpoint],
+              len(values) / wall if wall else 0,
+              percentile(values, 50) * 1000, percentile(values, 95) * 1000,
+              percentile(values, 99) * 1000, values[-1] * 1000))
+
+
+# Replay the script with cfg.concurrency parallel clients. URL steps (create,
+# txn, clean, ...) run one at a time as in run_script; the requests of each
+# test file are spread over the thread pool. Responses are only checked
+# against the expected status codes.
+def run_bench(script_file, cfg):
+    print("Benchmarking script %s with concurrency %s"
+          % (script_file, cfg.concurrency))
+    server = "http://%s:%s/" % (cfg.server, cfg.port)
+    script_dir = path.dirname(script_file)
+    latencies = defaultdict(list)
+    errors = defaultdict(int)
+    wall_times = defaultdict(float)
+    with open(script_file, 'r') as file_in:
+        json_script = json.load(file_in)
+    with ThreadPoolExecutor(cfg.concurrency) as executor:
+        for script in json_script:
+            if "url" in script:
+                reqs = [("GET", "GET /%s" % script["url"].split("/")[0],
+                         "%s%s" % (server, script["url"]), None,
+                         [script["response"]])]
+            else:
+                reqs = bench_requests(server,
+                                      path.join(script_dir, script["file"]))
+            start = time.perf_counter()
+            results = list(executor.map(lambda req: timed_request(*req), reqs))
+            wall = time.perf_counter() - start
+            for endpoint, latency, ok in results:
+                latencies[endpoint].append(latency)
+                if not ok:
+                    errors[endpoint] += 1
+            for endpoint in set(req[1] for req in reqs):
+                wall_times[endpoint] += wall
+    print_bench_report(latencies, errors, wall_times)
+    print("Done")
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("-f", "--file", dest="file", help="Input json script file", required=True)
@@ -175,11 +287,19 @@ if __name__ == "__main__":
     parser.add_argument("-i", "--indent", help="indent compare output (default False)", default=False, action="store_true")
     parser.add_argument("-n", "--nofailfast", help="No fail fast (stop test on first failure)", default=False, action="store_true")
     parser.add_argument("-o", "--out", help="Write out test results to file", )
+    parser.add_argument("-b", "--bench", help="Benchmark mode: replay the script concurrently and report "
+                        "throughput and latency percentiles per endpoint (default False)", default=False,
+                        action="store_true")
+    parser.add_argument("-c", "--concurrency", help="Parallel clients in benchmark mode (default 8)", default=8,
+                        type=int)
 
 
     config = parser.parse_args()
     try:
         validate_script(config.file)
-        run_script(config.file, config)
+        if config.bench:
+            run_bench(config.file, config)
+        else:
+            run_script(config.file, config)
     except LoaderError as e:
         print("LoaderError: %s" % e.message)
@@ -0,0 +1,228 @@
+import argparse
+import csv
+import json
+import random
+from os import path
+
+
+# Token swaps applied by the abbreviation perturbation (both directions)
+ABBREVIATIONS = {
+    "AVENUE": "AVE", "STREET": "ST", "ROAD": "RD", "BOULEVARD": "BLVD",
+    "DRIVE": "DR", "PLACE": "PL", "PARKWAY": "PKWY", "COURT": "CT",
+    "NORTH": "N", "SOUTH": "S", "EAST": "E", "WEST": "W",
+    "RESTAURANT": "REST", "COMPANY": "CO", "AND": "&",
+}
+ABBREVIATIONS.update({v: k for k, v in list(ABBREVIATIONS.items())})
+
+LETTERS = "ABCDEFGHIJKLMNOPQRSTUVWXYZ"
+
+# First inspection id handed out, well above the ids of the real datasets
+FIRST_INSPECTION_ID = 10000000
+
+
+"""
+Generates arbitrarily large dirty restaurant datasets, in the client file
+format, from the chiDirty records together with a ground truth file listing
+the entity (cluster) each inspection belongs to. Example, from this
+directory:
+
+    python3 generate.py -n 100000 -o synth100k.json
+
+writes synth100k.json and synth100k.truth.csv (inspection_id,cluster_id).
+"""
+
+
+class Generator:
+    '''
+    Builds new restaurant entities out of the name tokens, streets and zips
+    of the base records, and emits inspections that are either a new entity
+    or a (possibly perturbed) duplicate of an entity emitted before.
+    '''
+    def __init__(self, base, rng, dup_rate, typo_rate, abbrev_rate,
+                 missing_zip_rate, chain_rate, violations):
+        self.base = base
+        self.rng = rng
+        self.dup_rate = dup_rate
+        self.typo_rate = typo_rate
+        self.abbrev_rate = abbrev_rate
+        self.missing_zip_rate = missing_zip_rate
+        self.chain_rate = chain_rate
+        self.violations = violations
+        self.name_tokens = sorted(set(t for r in base
+                                      for t in r["name"].split()))
+        # Streets with the zip and coordinates of a record on them
+        self.streets = []
+        for r in base:
+            parts = r["address"].split()
+            if len(parts) > 1 and parts[0][:1].isdigit():
+                self.streets.append((" ".join(parts[1:]), r["zip"],
+                                     r["latitude"], r["longitude"]))
+        self.entities = []
+
+    def new_entity(self):
+        rng = self.rng
+        # Names are recombined tokens: the base records hold duplicates of
+        # their own, reusing them as is would blur the ground truth
+        if self.entities and rng.random() < self.chain_rate:
+            # Chain: same name as another entity, somewhere else
+            name = rng.choice(self.entities)["name"]
+        else:
+            name = " ".join(rng.choice(self.name_tokens)
+                            for _ in range(rng.randint(2, 3)))
+        street, zip_code, lat, lng = rng.choice(self.streets)
+        entity = {
+            "name": name,
+            "address": "%d %s" % (rng.randint(1, 9999), street),
+            "city": "CHICAGO",
+            "state": "IL",
+            "zip": zip_code,
+            "latitude": self.jitter(lat),
+            "longitude": self.jitter(lng),
+        }
+        self.entities.append(entity)
+        return len(self.entities) - 1, entity
+
+    def jitter(self, coordinate):
+        try:
+            return "%.11f" % (float(coordinate) + self.rng.uniform(-0.002,
+                                                                   0.002))
+        except (TypeError, ValueError):
+            return coordinate
+
+    def typo(self, text):
+        rng = self.rng
+        if len(text) < 2:
+            return text
+        i = rng.randrange(len(text) - 1)
+        op = rng.choice(["delete", "insert", "substitute", "transpose"])
+        if op == "delete":
+            return text[:i] + text[i + 1:]
+        if op == "insert":
+            return text[:i] + rng.choice(LETTERS) + text[i:]
+        if op == "substitute":
+            return text[:i] + rng.choice(LETTERS) + text[i + 1:]
+        return text[:i] + text[i + 1] + text[i] + text[i + 2:]
+
+    def abbreviate(self, text):
+        tokens = text.split()
+        swappable = [i for i, t in enumerate(tokens) if t in ABBREVIATIONS]
+        if not swappable:
+            return text
+        i = self.rng.choice(swappable)
+        tokens[i] = ABBREVIATIONS[tokens[i]]
+        return " ".join(tokens)
+
+    def perturb(self, entity):
+        rng = self.rng
+        dup = dict(entity)
+        for attr in ["name", "address"]:
+            if rng.random() < self.abbrev_rate:
+                dup[attr] = self.abbreviate(dup[attr])
+            if rng.random() < self.typo_rate:
+                dup[attr] = self.typo(dup[attr])
+        if rng.random() < self.missing_zip_rate:
+            dup["zip"] = ""
+        return dup
+
+    def record(self, number):
+        '''
+        Returns (cluster id, inspection record) of the number-th record.
+        '''
+        rng = self.rng
+        if self.entities and rng.random() < self.dup_rate:
+            cluster = rng.randrange(len(self.entities))
+            restaurant = self.perturb(self.entities[cluster])
+        else:
+            cluster, restaurant = self.new_entity()
+        template = rng.choice(self.base)
+        record = {
+            "inspection_id": str(FIRST_INSPECTION_ID + number),
+            "name": restaurant["name"],
+            "aka_name": restaurant["name"],
+            "facility_type": template.get("facility_type"),
+            "risk": template.get("risk"),
+            "address": restaurant["address"],
+            "city": restaurant["city"],
+            "state": restaurant["state"],
+            "zip": restaurant["zip"],
+            "date": template["date"],
+            "inspection_type": template.get("inspection_type"),
+            "results": template.get("results"),
+            "violations": template.get("violations", "")
+                          if self.violations else "",
+            "latitude": restaurant["latitude"],
+            "longitude": restaurant["longitude"],
+        }
+        return cluster, record
+
+
+def load_base(files):
+    base = []
+    for file_path in files:
+        with open(file_path, "r") as file_in:
+            script = json.load(file_in)
+        base.extend(script["values"] if isinstance(script, dict) else script)
+    return base
+
+
+def generate(gen, count, out_path, truth_path):
+    '''
+    Streams count records to out_path (client format) and the ground truth
+    to truth_path.
+    '''
+    with open(out_path, "w") as out, open(truth_path, "w", newline="") as tf:
+        truth = csv.writer(tf)
+        truth.writerow(["inspection_id", "cluster_id"])
+        out.write('{\n  "post_path": "inspections",\n'
+                  '  "response": [200,201],\n  "values": [\n')
+        for number in range(count):
+            cluster, record = gen.record(number)
+            if number:
+                out.write(",\n")
+            out.write("    " + json.dumps(record))
+            truth.writerow([record["inspection_id"], cluster])
+        out.write("\n  ]\n}\n")
+
+
+if __name__ == "__main__":
+    here = path.dirname(path.abspath(__file__))
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-i", "--input", nargs="+",
+                        help="Base chiDirty files (default ms3/chiDirty100.json)",
+                        default=[path.join(here, "ms3", "chiDirty100.json")])
+    parser.add_argument("-n", "--records", help="Records to generate "
+                        "(default 100000)", default=100000, type=int)
+    parser.add_argument("-o", "--out", help="Output file (default "
+                        "synth<records>.json)")
+    parser.add_argument("-t", "--truth", help="Ground truth file (default "
+                        "<out>.truth.csv)")
+    parser.add_argument("--dup-rate", help="Share of records duplicating "
+                        "an earlier entity (default 0.3)", default=0.3,
+                        type=float)
+    parser.add_argument("--typo-rate", help="Chance of a typo in the name "
+                        "and in the address of a duplicate (default 0.3)",
+                        default=0.3, type=float)
+    parser.add_argument("--abbrev-rate", help="Chance of an abbreviation "
+                        "swap in the name and in the address of a duplicate "
+                        "(default 0.3)", default=0.3, type=float)
+    parser.add_argument("--missing-zip-rate", help="Chance a duplicate "
+                        "loses its zip (default 0.05)", default=0.05,
+                        type=float)
+    parser.add_argument("--chain-rate", help="Chance a new entity reuses "
+                        "the name of another one (default 0.05)",
+                        default=0.05, type=float)
+    parser.add_argument("--violations", help="Keep the (long) violations "
+                        "text of the base records", default=False,
+                        action="store_true")
+    parser.add_argument("-s", "--seed", help="Random seed (default 30235)",
+                        default=30235, type=int)
+    args = parser.parse_args()
+
+    out_path = args.out or "synth%d.json" % args.records
+    truth_path = args.truth or path.splitext(out_path)[0] + ".truth.csv"
+    gen = Generator(load_base(args.input), random.Random(args.seed),
+                    args.dup_rate, args.typo_rate, args.abbrev_rate,
+                    args.missing_zip_rate, args.chain_rate, args.violations)
+    generate(gen, args.records, out_path, truth_path)
+    print("Wrote %s records of %s entities to %s, ground truth in %s"
+          % (args.records, len(gen.entities), out_path, truth_path))
@@ -0,0 +1,263 @@
+"""
+Repeatable benchmark of /clean: loads each dataset into a fresh database,
+cleans it several times in each mode (MODES) and writes a JSON report with
+wall time, pairs compared, peak memory and cluster counts. Run it from the
+server directory (like server.py):
+
+    python3 bench_clean.py -r 3 -o clean_bench.json
+
+Datasets made by data/generate.py come with a <dataset>.truth.csv ground
+truth, next to them; when it is there the report also has the pairwise
+precision and recall of the clusters found.
+"""
+import argparse  # Used for getting arguments for the benchmark
+import csv
+import json
+import logging  # Logging Library
+import platform
+import shutil
+import sqlite3  # Our DB
+import tempfile
+import time
+import tracemalloc
+from collections import Counter
+from datetime import datetime
+from os import path
+from db import DB  # our custom data access layer
+from loader import load_files
+from blocking import MULTI_PASS_STRATEGIES, parse_strategies
+from scoring import SIMILARITY_CACHE
+
+
+# Datasets used when none are given (the 1k set only if get.sh was run)
+DEFAULT_DATASETS = [
+    path.join("..", "data", "ms3", "chiDirty10.json"),
+    path.join("..", "data", "ms3", "chiDirty100.json"),
+    path.join("..", "data", "ms4", "chiDirty1k.json"),
+]
+
+# Cleaning modes compared: the blocking passes passed to DB.block_records
+# (None for no blocking). ms4 is the zip blocking of MS4 (the default of
+# -s), multi the multi-pass blocking of blocking.py, qgram the pass finding
+# the same matches as ms3 and lsh the MinHash LSH pass.
+MODES = {"ms3": None, "ms4": ["zip"], "multi": MULTI_PASS_STRATEGIES,
+         "qgram": ["qgram"], "lsh": ["lsh"]}
+
+
+# helper function that returns the blocking passes of a mode: one of MODES,
+# or a single pass such as lsh:20x5 (ValueError if it is neither)
+def mode_strategies(mode):
+    if mode in MODES:
+        return MODES[mode]
+    return parse_strategies(mode)
+
+
+
+def build_template(dataset, work_dir):
+    '''
+    Loads a dataset into a new database file that every run starts from.
+    '''
+    db_path = path.join(work_dir, path.basename(dataset) + ".db")
+    conn = sqlite3.connect(db_path)
+    DB(conn).create_script()
+    load_files(conn, [dataset], 10000, progress=False)
+    conn.close()
+    return db_path
+
+
+def truth_path(dataset):
+    return path.splitext(dataset)[0] + ".truth.csv"
+
+
+def load_truth(file_path):
+    '''
+    Reads a ground truth file into a dict inspection_id -> cluster_id.
+    '''
+    with open(file_path, "r", newline="") as file_in:
+        return {row["inspection_id"]: row["cluster_id"]
+                for row in csv.DictReader(file_in)}
+
+
+# helper function that counts the pairs within the groups of a Counter
+def count_pairs(counter):
+    return sum(n * (n - 1) // 2 for n in counter.values())
+
+
+def pair_quality(conn, truth):
+    '''
+    Pairwise precision and recall of the cleaned database against the ground
+    truth. Each inspection is predicted to be in the cluster of the primary
+    record its restaurant was linked to (or of its restaurant, if it was not
+    linked), and two inspections are a pair if they share a cluster.
+    '''
+    c = conn.cursor()
+    c.execute("""SELECT i.id, COALESCE(MIN(l.primary_rest_id), i.restaurant_id)
+              FROM ri_inspections i LEFT JOIN ri_linked l
+              ON l.original_rest_id = i.restaurant_id
+              GROUP BY i.id;""")
+    predicted = Counter()
+    actual = Counter()
+    both = Counter()
+    for inspection_id, cluster in c:
+        if inspection_id not in truth:
+            continue
+        predicted[cluster] += 1
+        actual[truth[inspection_id]] += 1
+        both[(cluster, truth[inspection_id])] += 1
+    found = count_pairs(predicted)
+    true = count_pairs(actual)
+    correct = count_pairs(both)
+    return {"precision": correct / found if found else 1.0,
+            "recall": correct / true if true else 1.0}
+
+
+def clean_once(template, work_dir, blocking, trace_memory=False, truth=None,
+               workers=0):
+    '''
+    Cleans a copy of the template database, with the blocking passes given
+    (None for no blocking) on workers processes. Returns the stats of the
+    run.
+    '''
+    db_path = path.join(work_dir, "run.db")
+    shutil.copyfile(template, db_path)
+    conn = sqlite3.connect(db_path)
+    db = DB(conn)
+    c = conn.cursor()
+    c.execute("SELECT COUNT(*), SUM(clean = 0) FROM ri_restaurants;")
+    records, dirty = c.fetchone()
+
+    # Every run starts with an empty similarity cache
+    SIMILARITY_CACHE.clear()
+    hits, misses = SIMILARITY_CACHE.hits, SIMILARITY_CACHE.misses
+    if trace_memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    clean_stats = db.block_records(blocking is not None, blocking, workers)
+    elapsed = time.perf_counter() - start
+    peak = None
+    if trace_memory:
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    c.execute("""SELECT COUNT(DISTINCT primary_rest_id), COUNT(*)
+              FROM ri_linked;""")
+    clusters, linked = c.fetchone()
+    stats = {"records": records, "dirty": dirty, "seconds": elapsed,
+             "pairs_compared": clean_stats["pairs_scored"],
+             "peak_memory_bytes": peak,
+             "clusters": clusters, "linked_records": linked,
+             "rejected": dict(db.rejected),
+             "cache_hits": SIMILARITY_CACHE.hits - hits,
+             "cache_misses": SIMILARITY_CACHE.misses - misses,
+             "phase_seconds": clean_stats["seconds"]}
+    if truth is not None:
+        stats.update(pair_quality(conn, truth))
+    conn.close()
+    return stats
+
+
+def run_benchmark(datasets, modes, runs, workers=0):
+    '''
+    Runs every mode on every dataset `runs` times (plus one run under
+    tracemalloc for the peak memory, which would skew the timings).
+    '''
+    results = []
+    work_dir = tempfile.mkdtemp(prefix="clean_bench_")
+    try:
+        for dataset in datasets:
+            template = build_template(dataset, work_dir)
+            truth = None
+            if path.exists(truth_path(dataset)):
+                truth = load_truth(truth_path(dataset))
+            for mode in modes:
+                strategies = mode_strategies(mode)
+                stats = [clean_once(template, work_dir, strategies, False,
+                                    truth, workers) for _ in range(runs)]
+                memory = clean_once(template, work_dir, strategies, True,
+                                    None, workers)
+                seconds = [s["seconds"] for s in stats]
+                result = {
+                    "dataset": path.basename(dataset),
+                    "mode": mode,
+                    "records": stats[0]["records"],
+                    "dirty": stats[0]["dirty"],
+                    "runs": runs,
+                    "workers": workers,
+                    "seconds": seconds,
+                    "mean_seconds": sum(seconds) / runs,
+                    "min_seconds": min(seconds),
+                    "pairs_compared": stats[0]["pairs_compared"],
+                    "peak_memory_bytes": memory["peak_memory_bytes"],
+                    "clusters": stats[0]["clusters"],
+                    "linked_records": stats[0]["linked_records"],
+                    "rejected": stats[0]["rejected"],
+                    "cache_hits": stats[0]["cache_hits"],
+                    "cache_misses": stats[0]["cache_misses"],
+                    "phase_seconds": stats[0]["phase_seconds"],
+                }
+                if truth is not None:
+                    result["precision"] = stats[0]["precision"]
+                    result["recall"] = stats[0]["recall"]
+                results.append(result)
+                print("%-24s %-5s %8d records %10.3fs mean %12d pairs "
+                      "%8.1f MiB %6d clusters" % (
+                      result["dataset"], mode, result["records"],
+                      result["mean_seconds"], result["pairs_compared"],
+                      result["peak_memory_bytes"] / 2 ** 20,
+                      result["clusters"]))
+                print("%-24s %-5s rejected %s, cache hits %d misses %d" % (
+                      result["dataset"], mode, " ".join(
+                          "%s %d" % (attr, n)
+                          for attr, n in result["rejected"].items()),
+                      result["cache_hits"], result["cache_misses"]))
+                print("%-24s %-5s seconds %s" % (
+                      result["dataset"], mode, " ".join(
+                          "%s %.3f" % (phase, seconds) for phase, seconds
+                          in result["phase_seconds"].items())))
+                if truth is not None:
+                    print("%-24s %-5s precision %.4f recall %.4f" % (
+                          result["dataset"], mode, result["precision"],
+                          result["recall"]))
+    finally:
+        shutil.rmtree(work_dir)
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("datasets", nargs="*",
+                        help="Inspection files to clean (default: the "
+                             "chiDirty 10, 100 and, if downloaded, 1k sets)")
+    parser.add_argument("-r", "--runs", help="Runs per dataset and mode "
+                        "(default 3)", default=3, type=int)
+    parser.add_argument("-m", "--modes", help="Cleaning modes to run, from "
+                        "ms3,ms4,multi,qgram,lsh or a single blocking pass "
+                        "such as lsh:20x5 (default all but the passes)",
+                        default="ms3,ms4,multi,qgram,lsh")
+    parser.add_argument("-w", "--workers", help="Worker processes of the "
+                        "blocking modes (default 0, none)", default=0,
+                        type=int)
+    parser.add_argument("-o", "--out", help="Write the JSON report to this "
+                        "file (default clean_bench.json)",
+                        default="clean_bench.json")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    datasets = args.datasets or [d for d in DEFAULT_DATASETS
+                                 if path.exists(d)]
+    modes = args.modes.split(",")
+    for mode in modes:
+        try:
+            mode_strategies(mode)
+        except ValueError as e:
+            parser.error("unknown mode %s: %s" % (mode, e))
+
+    report = {
+        "generated": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "results": run_benchmark(datasets, modes, args.runs, args.workers),
+    }
+    with open(args.out, "w") as out_file:
+        json.dump(report, out_file, indent=2)
+    print("Report written to %s" % args.out)
@@ -0,0 +1,538 @@
+import copy
+import random
+import re
+import zlib
+from collections import Counter
+from functools import lru_cache
+from math import ceil
+from scoring import (THRESHOLD, WEIGHTS, jaro_winkler_bound,
+                     min_similarity)
+
+
+# Street directions skipped by the street key (the generator and the city
+# data write them both ways, e.g. N and NORTH)
+DIRECTIONS = {"N", "S", "E", "W", "NORTH", "SOUTH", "EAST", "WEST"}
+
+SOUNDEX_CODES = {}
+for letters, digit in [("BFPV", "1"), ("CGJKQSXZ", "2"), ("DT", "3"),
+                       ("L", "4"), ("MN", "5"), ("R", "6")]:
+    for letter in letters:
+        SOUNDEX_CODES[letter] = digit
+
+# MinHash LSH: a signature of LSH_BANDS * LSH_ROWS hashes is cut into
+# LSH_BANDS bands of LSH_ROWS rows. More bands find more pairs (recall), more
+# rows fewer (candidate volume). On a 20k synthetic set 16x5 scores 171k pairs
+# at the recall of name,street,sorted (0.981, 326k pairs), 20x5 209k pairs at
+# 0.989, 12x4 306k pairs
+LSH_BANDS = 16
+LSH_ROWS = 5
+# Most hash functions (bands * rows) a pass set as lsh:BxR can have
+LSH_MAX_HASHES = 512
+# Shingle length (characters) and the prime of the hash functions
+LSH_SHINGLE = 3
+LSH_PRIME = 4294967291  # Largest prime under 2 ** 32
+
+
+"""
+Blocking for the cleaning: a blocking pass turns the restaurant records into
+candidate pairs (dirty record, other record), and only candidate pairs are
+scored. Several passes can be combined, the candidate pairs of all of them
+are unioned, so a duplicate missed by one key (a typo in the zip, a missing
+zip, a misspelled street) can still be found by another.
+
+Passes, by name:
+    zip     records with the same 5 digit zip
+    name    records whose names sound alike (Soundex of the whole name)
+    street  records with the same street number and the same first three
+            letters of the street name
+    sorted  sorted neighbourhood: records sorted by name, each one paired
+            with the next ones within a window
+    qgram   every pair that can reach the matching threshold (see QGramIndex),
+            the same matches as comparing every dirty record to every record
+    lsh     records whose name and address shingles collide in a band of
+            their MinHash signatures (see MinHashLSH); lsh:BxR sets B bands
+            of R rows instead of LSH_BANDS and LSH_ROWS, e.g. lsh:20x5
+
+Within the blocks of the zip, name and street passes, pairs are found with a
+QGramIndex too, so only pairs that can reach the threshold are scored.
+"""
+
+
+def soundex(text, length=4):
+    '''
+    American Soundex of the letters of text: the first letter followed by
+    the codes of the following consonants, padded with zeros to length.
+    '''
+    letters = [ch for ch in text.upper() if "A" <= ch <= "Z"]
+    if not letters:
+        return None
+    code = letters[0]
+    last = SOUNDEX_CODES.get(letters[0])
+    for ch in letters[1:]:
+        digit = SOUNDEX_CODES.get(ch)
+        if digit is not None and digit != last:
+            code += digit
+            if len(code) == length:
+                return code
+        # H and W do not separate two letters with the same code
+        if ch not in "HW":
+            last = digit
+    return code.ljust(length, "0")
+
+
+# helper function that returns the first 5 digits of a zip (None if it has
+# fewer)
+def zip_key(record):
+    digits = re.sub(r"\D", "", str(record.get("zip") or ""))
+    return digits[:5] if len(digits) >= 5 else None
+
+
+# helper function that returns the phonetic key of a name
+def name_key(record):
+    return soundex(record.get("name") or "", 6)
+
+
+# helper function that returns the street number and the start of the street
+# name of an address, e.g. "9292 CHE" for 9292 E CHESTNUT ST
+def street_key(record):
+    tokens = (record.get("address") or "").upper().split()
+    if len(tokens) < 2 or not tokens[0][:1].isdigit():
+        return None
+    street = [t for t in tokens[1:] if t not in DIRECTIONS]
+    if not street:
+        return None
+    return "%s %s" % (tokens[0], street[0][:3])
+
+
+# helper function that returns the sort key of the sorted neighbourhood pass
+def sort_key(record):
+    return re.sub(r"[^A-Z0-9]", "", (record.get("name") or "").upper())
+
+
+class QGramIndex:
+    '''
+    Finds the pairs of records that can still reach the matching threshold.
+
+    The address weighs so much that a pair reaches the threshold only if its
+    address similarity (Jaccard over characters) reaches min_similarity, 0.5
+    with the default weights. The addresses are indexed as sets of q-gram
+    tokens (a character and its occurrence number, e.g. the second "A", so
+    the set Jaccard equals the character multiset one), ordered rarest
+    first. Records are joined in order of size (PPJoin): each one looks up
+    the tokens of its prefix that any similar enough address must share a
+    token with (prefix filtering), among the records already indexed and
+    not too short (length filtering), drops those that can no longer share
+    enough tokens given the positions of the shared ones (positional
+    filtering), and verifies the rest on their actual address similarity
+    and on the lengths of their names.
+    '''
+    def __init__(self, threshold=THRESHOLD, weights=WEIGHTS):
+        self.threshold = threshold
+        self.weights = weights
+        self.min_address = min_similarity("address", threshold, weights)
+
+    def units(self, records, dirty):
+        '''
+        The index joins all the records, as a single unit of work.
+        '''
+        return [list(range(len(records)))]
+
+    def unit_pairs(self, records, dirty, positions):
+        return self.candidate_pairs(records, dirty, positions)
+
+    def candidate_pairs(self, records, dirty, positions=None):
+        '''
+        Yields the (i, j) pairs of positions (among positions, by default
+        all) that can reach the threshold, records[i] being dirty.
+        '''
+        if positions is None:
+            positions = range(len(records))
+        t = self.min_address
+        if t <= 0:
+            # Any address can match, nothing to filter on
+            yield from all_pairs(positions, dirty)
+            return
+        tokens = {}
+        token_sets = {}
+        empty = {}  # positions of the records with no address, by value
+        freq = Counter()
+        for p in positions:
+            address = records[p]["address"]
+            if not address:
+                empty.setdefault(address, []).append(p)
+                continue
+            tokens[p] = [(ch, n) for ch, count in Counter(address).items()
+                         for n in range(1, count + 1)]
+            token_sets[p] = frozenset(tokens[p])
+            freq.update(tokens[p])
+        for toks in tokens.values():
+            toks.sort(key=lambda tok: (freq[tok], tok))
+
+        # Tokens a pair needs to share for its Jaccard to reach t (at least
+        # t / (1 + t) of the sizes added), by the sizes added
+        max_size = max((len(toks) for toks in tokens.values()), default=0)
+        needed = [ceil(t / (1 + t) * total - 1e-9)
+                  for total in range(2 * max_size + 1)]
+        # token -> [(record, position of the token in it, record size)], in
+        # order of size; starts skips the records too short for the current
+        index = {}
+        starts = {}
+        for p in sorted(tokens, key=lambda p: (len(tokens[p]), p)):
+            toks = tokens[p]
+            size = len(toks)
+            min_size = t * size - 1e-9
+            overlaps = {}
+            for i in range(size - required(t, size) + 1):
+                postings = index.get(toks[i])
+                if postings is None:
+                    continue
+                start = starts[toks[i]]
+                while start < len(postings) and postings[start][2] < min_size:
+                    start += 1
+                starts[toks[i]] = start
+                rest = size - i
+                for q, j, size_q in postings[start:]:
+                    overlap = overlaps.get(q, 0)
+                    if overlap < 0:
+                        continue
+                    if (overlap + (rest if rest < size_q - j else size_q - j)
+                            >= needed[size + size_q]):
+                        overlaps[q] = overlap + 1
+                    else:
+                        overlaps[q] = -1
+            # Only the shorter prefix the longer records can need is indexed
+            for j in range(size - required(2 * t / (1 + t), size) + 1):
+                if toks[j] not in index:
+                    index[toks[j]] = []
+                    starts[toks[j]] = 0
+                index[toks[j]].append((p, j, size))
+            for q, overlap in overlaps.items():
+                if overlap <= 0 or not (dirty[p] or dirty[q]):
+                    continue
+                # Verify on the actual address similarity
+                shared = len(token_sets[p] & token_sets[q])
+                address_sim = shared / (size + len(tokens[q]) - shared)
+                if address_sim >= t - 1e-9 and self.feasible(
+                        records[p], records[q], address_sim):
+                    if dirty[p]:
+                        yield p, q
+                    if dirty[q]:
+                        yield q, p
+        # Equal (missing) addresses are fully similar
+        for group in empty.values():
+            for p, q in all_pairs(group, dirty):
+                if self.feasible(records[p], records[q], 1.0):
+                    yield p, q
+
+    def feasible(self, r, s, address_sim):
+        '''
+        False if the score of r and s is under the threshold whatever their
+        names are (given their lengths, a missing name counting as empty),
+        cities and states.
+        '''
+        weights = self.weights
+        bound = (jaro_winkler_bound(len(r["name"] or ""),
+                                    len(s["name"] or ""))
+                 * weights["name"] + address_sim * weights["address"]
+                 + weights["city"] + weights["state"])
+        return bound >= self.threshold - 1e-9
+
+
+# helper function that returns the tokens two token sets of which one has
+# size tokens must share for their Jaccard similarity to reach t
+def required(t, size):
+    return max(ceil(t * size - 1e-9), 1)
+
+
+# helper function that yields every pair of positions whose first one is dirty
+def all_pairs(positions, dirty):
+    for i in positions:
+        if dirty[i]:
+            for j in positions:
+                if i != j:
+                    yield i, j
+
+
+class KeyBlocking:
+    '''
+    Blocks records that share the same key. Records without a key (e.g. no
+    zip) are left out of this pass. Within a block, the pairs that can reach
+    the threshold are found with a QGramIndex.
+    '''
+    def __init__(self, key):
+        self.key = key
+        self.index = QGramIndex()
+
+    def keys(self, record):
+        '''
+        Returns the keys of a record in this pass: its key, if it has one.
+        '''
+        key = self.key(record)
+        return [] if key is None else [key]
+
+    def blocks(self, records):
+        '''
+        Returns the lists of positions of records sharing a key.
+        '''
+        blocks = {}
+        for i, record in enumerate(records):
+            for key in self.keys(record):
+                blocks.setdefault(key, []).append(i)
+        return list(blocks.values())
+
+    def units(self, records, dirty):
+        '''
+        Returns the independent units of work of the pass (lists of
+        positions in records): here the blocks that have a dirty record to
+        compare.
+        '''
+        return [block for block in self.blocks(records)
+                if len(block) > 1 and any(dirty[i] for i in block)]
+
+    def unit_pairs(self, records, dirty, positions):
+        '''
+        Yields the candidate pairs of a unit of work.
+        '''
+        return self.index.candidate_pairs(records, dirty, positions)
+
+    def candidate_pairs(self, records, dirty):
+        for unit in self.units(records, dirty):
+            yield from self.unit_pairs(records, dirty, unit)
+
+
+# helper function that returns the shingles (character q-grams) of a text,
+# tagged so a name and an address sharing characters do not collide
+def shingles(tag, text, q=LSH_SHINGLE):
+    if not text:
+        return []
+    if len(text) <= q:
+        return [tag + text]
+    return [tag + text[i:i + q] for i in range(len(text) - q + 1)]
+
+
+class MinHashLSH(KeyBlocking):
+    '''
+    Locality sensitive hashing of the names and addresses. The shingles of a
+    record (3 character pieces of its name and of its address) get a MinHash
+    signature of bands * rows hashes: for each hash function, the smallest
+    hash of the shingles. Two records agree on a hash with probability the
+    Jaccard similarity s of their shingle sets, so they share at least one
+    band key (all rows of a band equal) with probability
+    1 - (1 - s ** rows) ** bands: near certain for duplicates, rare for
+    unrelated records. The records sharing a band key form a block (a
+    bucket), so blocks stay small whatever the zip density, and a record
+    with a different zip or a typo still meets its duplicates.
+    '''
+    def __init__(self, bands=LSH_BANDS, rows=LSH_ROWS, seed=0):
+        super().__init__(None)
+        self.bands = bands
+        self.rows = rows
+        rng = random.Random(seed)
+        self.hashes = [(rng.randrange(1, LSH_PRIME), rng.randrange(LSH_PRIME))
+                       for _ in range(bands * rows)]
+
+    def hash_shingle(self, shingle, cache=None):
+        '''
+        Returns the hashes of a shingle, looked up in (and added to) the
+        cache dict if one is given.
+        '''
+        hashes = cache.get(shingle) if cache is not None else None
+        if hashes is None:
+            x = zlib.crc32(shingle.encode())
+            hashes = tuple((a * x + b) % LSH_PRIME for a, b in self.hashes)
+            if cache is not None:
+                cache[shingle] = hashes
+        return hashes
+
+    def signature(self, record, cache=None):
+        '''
+        MinHash signature of the name and address shingles of a record, None
+        if it has neither.
+        '''
+        pieces = set(shingles("N", record.get("name"))
+                     + shingles("A", record.get("address")))
+        if not pieces:
+            return None
+        hashes = [self.hash_shingle(piece, cache) for piece in pieces]
+        if len(hashes) == 1:
+            return hashes[0]
+        return tuple(map(min, *hashes))
+
+    def unit_pairs(self, records, dirty, positions):
+        '''
+        Yields every pair of a bucket: the buckets are small and a record
+        is in bands of them, so a QGramIndex per bucket would cost more
+        than the cascade scorer does on the pairs it filters out.
+        '''
+        return all_pairs(positions, dirty)
+
+    def blocks(self, records):
+        '''
+        Returns the buckets of the records. The hashes of every distinct
+        shingle are computed once for the records (chains and repeated
+        streets share most of their shingles) and dropped with them.
+        '''
+        cache = {}
+        blocks = {}
+        for i, record in enumerate(records):
+            for key in self.keys(record, cache):
+                blocks.setdefault(key, []).append(i)
+        return list(blocks.values())
+
+    def keys(self, record, cache=None):
+        '''
+        Returns the band keys of a record: (band, its rows of the signature).
+        '''
+        signature = self.signature(record, cache)
+        if signature is None:
+            return []
+        rows = self.rows
+        return [(band, signature[band * rows:(band + 1) * rows])
+                for band in range(self.bands)]
+
+
+class SortedNeighbourhood:
+    '''
+    Sorts the records by key and pairs every record with the window - 1
+    records that follow it, so near keys meet even if they are not equal.
+    '''
+    def __init__(self, key, window=10, chunk_size=5000):
+        self.key = key
+        self.window = window
+        self.chunk_size = chunk_size
+
+    def units(self, records, dirty):
+        '''
+        Cuts the sorted records into chunks, each overlapping the next one by
+        window - 1 records so no window is lost.
+        '''
+        order = sorted(range(len(records)),
+                       key=lambda i: (self.key(records[i]), i))
+        return [order[start:start + self.chunk_size + self.window - 1]
+                for start in range(0, len(order), self.chunk_size)]
+
+    def unit_pairs(self, records, dirty, positions):
+        '''
+        Yields the pairs within a window of the positions, taken as sorted.
+        '''
+        for pos, i in enumerate(positions):
+            for j in positions[pos + 1:pos + self.window]:
+                if dirty[i]:
+                    yield i, j
+                if dirty[j]:
+                    yield j, i
+
+    def candidate_pairs(self, records, dirty):
+        for unit in self.units(records, dirty):
+            yield from self.unit_pairs(records, dirty, unit)
+
+
+STRATEGIES = {
+    "zip": KeyBlocking(zip_key),
+    "name": KeyBlocking(name_key),
+    "street": KeyBlocking(street_key),
+    "sorted": SortedNeighbourhood(sort_key),
+    "qgram": QGramIndex(),
+    "lsh": MinHashLSH(),
+}
+
+# Passes used when blocking is on and none are given: the zip blocking of
+# MS4
+DEFAULT_STRATEGIES = ["zip"]
+
+# Multi-pass blocking, for a better recall than zip alone (duplicates with a
+# typo in the zip or no zip), opted into with -b name,street,sorted
+MULTI_PASS_STRATEGIES = ["name", "street", "sorted"]
+
+
+# Passes whose keys are kept in ri_block_keys, so an incremental clean can
+# look up the candidates of the dirty records: by equal key (not lsh, whose
+# bands would add 16 rows per restaurant to every insert)...
+KEY_PASSES = [name for name, strategy in STRATEGIES.items()
+              if isinstance(strategy, KeyBlocking)
+              and not isinstance(strategy, MinHashLSH)]
+# ... and by key order. The other passes read every record.
+SORTED_PASSES = [name for name, strategy in STRATEGIES.items()
+                 if isinstance(strategy, SortedNeighbourhood)]
+
+
+# helper function that returns the (pass, key) rows of ri_block_keys for a
+# record (a dict with name, address and zip)
+def block_keys(record):
+    keys = []
+    for name in KEY_PASSES:
+        keys.extend((name, key) for key in strategy(name).keys(record))
+    for name in SORTED_PASSES:
+        key = strategy(name).key(record)
+        if key is not None:
+            keys.append((name, key))
+    return keys
+
+
+# helper function that returns the pass name for a matching threshold and
+# weights other than the defaults: its QGramIndex filters on them
+def tuned_strategy(name, threshold=THRESHOLD, weights=WEIGHTS):
+    base = strategy(name)
+    if threshold == THRESHOLD and weights == WEIGHTS:
+        return base
+    if isinstance(base, QGramIndex):
+        return QGramIndex(threshold, weights)
+    tuned = copy.copy(base)
+    if isinstance(tuned, KeyBlocking):
+        tuned.index = QGramIndex(threshold, weights)
+    return tuned
+
+
+# helper function that returns the lsh pass of an lsh:BxR name (B bands of R
+# rows), raising ValueError on a malformed or too large one
+@lru_cache(maxsize=16)
+def lsh_strategy(params):
+    match = re.fullmatch(r"(\d+)x(\d+)", params)
+    if not match:
+        raise ValueError("Blocking strategy lsh:%s should be lsh:BxR, B "
+                         "bands of R rows (e.g. lsh:%sx%s)"
+                         % (params, LSH_BANDS, LSH_ROWS))
+    bands, rows = int(match.group(1)), int(match.group(2))
+    if not 0 < bands * rows <= LSH_MAX_HASHES:
+        raise ValueError("Blocking strategy lsh:%s needs between 1 and %s "
+                         "hashes (bands * rows)" % (params, LSH_MAX_HASHES))
+    return MinHashLSH(bands, rows)
+
+
+# Passes that take parameters after a colon, e.g. lsh:16x5
+CONFIGURABLE_STRATEGIES = {"lsh": lsh_strategy}
+
+
+# helper function that returns the blocking pass of a name: one of
+# STRATEGIES, or a configured pass such as lsh:16x5. Raises ValueError on an
+# unknown one
+def strategy(name):
+    if name in STRATEGIES:
+        return STRATEGIES[name]
+    base, _, params = name.partition(":")
+    if base not in CONFIGURABLE_STRATEGIES or not params:
+        raise ValueError("Unknown blocking strategy %s (expected one of "
+                         "%s, or lsh:BxR)" % (name, ", ".join(STRATEGIES)))
+    return CONFIGURABLE_STRATEGIES[base](params)
+
+
+# helper function that turns a comma separated list of pass names into a
+# list, raising ValueError on an unknown one
+def parse_strategies(text):
+    names = [name.strip() for name in text.split(",") if name.strip()]
+    for name in names:
+        strategy(name)
+    return names
+
+
+def candidate_pairs(records, strategies=None):
+    '''
+    Runs the blocking passes over records (dicts with a "clean" flag) and
+    returns the union of their candidate pairs, as a sorted list of (i, j)
+    positions in records with records[i] dirty.
+    '''
+    dirty = [not record["clean"] for record in records]
+    pairs = set()
+    for name in strategies or DEFAULT_STRATEGIES:
+        pairs.update(strategy(name).candidate_pairs(records, dirty))
+    return sorted(pairs)
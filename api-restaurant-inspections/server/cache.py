@@ -0,0 +1,104 @@
+from collections import OrderedDict
+import threading
+
+
+"""
+In-process caches shared by the request handlers.
+"""
+
+
+class LRUCache:
+    '''
+    Bounded mapping that evicts the least recently used entry once it holds
+    more than maxsize entries. Keeps hit/miss counters for the stats
+    endpoints.
+    '''
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.data = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.data)
+
+    def get(self, key, default=None):
+        with self.lock:
+            if key in self.data:
+                self.data.move_to_end(key)
+                self.hits += 1
+                return self.data[key]
+            self.misses += 1
+            return default
+
+    def put(self, key, value):
+        with self.lock:
+            self.data[key] = value
+            self.data.move_to_end(key)
+            while len(self.data) > self.maxsize:
+                self.data.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.data.clear()
+
+    def stats(self):
+        return {"size": len(self.data), "maxsize": self.maxsize,
+                "hits": self.hits, "misses": self.misses}
+
+
+class RestaurantCache(LRUCache):
+    '''
+    Maps (name, address) to a restaurant id. Ids of restaurants inserted by
+    a transaction that has not committed yet are kept apart, per connection
+    (the owner), so that an abort can drop them and other connections never
+    see rows that may be rolled back.
+    '''
+    def __init__(self, maxsize):
+        super().__init__(maxsize)
+        self.pending = {}
+
+    def lookup(self, key, owner):
+        with self.lock:
+            pending = self.pending.get(owner)
+            if pending and key in pending:
+                self.hits += 1
+                return pending[key]
+        return self.get(key)
+
+    def add(self, key, restaurant_id, owner):
+        with self.lock:
+            self.pending.setdefault(owner, {})[key] = restaurant_id
+
+    def commit(self, owner):
+        with self.lock:
+            pending = self.pending.pop(owner, {})
+        for key, restaurant_id in pending.items():
+            self.put(key, restaurant_id)
+
+    def rollback(self, owner):
+        with self.lock:
+            self.pending.pop(owner, None)
+
+    def savepoint(self, owner):
+        '''
+        Returns the keys owner has pending, for rollback_to().
+        '''
+        with self.lock:
+            return set(self.pending.get(owner, ()))
+
+    def rollback_to(self, owner, savepoint):
+        '''
+        Forgets the ids owner added since savepoint, keeping the earlier ones
+        that its transaction still holds.
+        '''
+        with self.lock:
+            pending = self.pending.get(owner, {})
+            for key in [key for key in pending if key not in savepoint]:
+                del pending[key]
+
+    def clear(self):
+        with self.lock:
+            self.data.clear()
+            self.pending.clear()
@@ -0,0 +1,55 @@
+"""
+Clustering of matched records for the cleaning.
+"""
+
+
+class UnionFind:
+    '''
+    Disjoint sets of record ids (union by size, path halving), so building
+    the clusters of n matched pairs takes near linear time and the clusters
+    are transitive: a matches b and b matches c puts a, b and c together.
+    '''
+    def __init__(self):
+        self.parent = {}
+        self.size = {}
+
+    def find(self, x):
+        '''
+        Returns the representative of the set of x (adding x if it is new).
+        '''
+        parent = self.parent
+        if x not in parent:
+            parent[x] = x
+            self.size[x] = 1
+            return x
+        while parent[x] != x:
+            parent[x] = parent[parent[x]]
+            x = parent[x]
+        return x
+
+    def union(self, x, y):
+        '''
+        Merges the sets of x and y. Returns the representative of the result.
+        '''
+        x = self.find(x)
+        y = self.find(y)
+        if x == y:
+            return x
+        if self.size[x] < self.size[y]:
+            x, y = y, x
+        self.parent[y] = x
+        self.size[x] += self.size[y]
+        return x
+
+    def clusters(self, min_size=2):
+        '''
+        Returns the sets with at least min_size ids, each as a list sorted by
+        id, ordered by their smallest id.
+        '''
+        groups = {}
+        for x in self.parent:
+            groups.setdefault(self.find(x), []).append(x)
+        clusters = [sorted(ids) for ids in groups.values()
+                    if len(ids) >= min_size]
+        clusters.sort(key=lambda ids: ids[0])
+        return clusters
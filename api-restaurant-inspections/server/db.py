@@ -1,9 +1,20 @@
-from os import path
+from os import path, listdir
 import logging # Logging Library
+import sqlite3
+from collections import Counter
 from errors import KeyNotFound, BadRequest, InspError
 from datetime import datetime
 import textdistance 
 from similarity.jarowinkler import JaroWinkler
+from scoring import THRESHOLD, WEIGHTS, score_pairs, score_rows
+from blocking import (DEFAULT_STRATEGIES, KEY_PASSES, SORTED_PASSES, STRATEGIES,
+                      block_keys)
+from parallel import task_scores, unit_pairs, worker_pool
+from clustering import UnionFind
+from stats import CleanStats
+from records import read_records
+from normalize import (normalize_address, normalize_city, normalize_name,
+                       normalized)
 
 
 # Utility factor to allow results to be used like a dictionary
@@ -21,6 +32,79 @@ def to_json_list(cursor):
     headers = [d[0] for d in cursor.description]
     return [dict(zip(headers, row)) for row in results]
 
+# The name scorer of find_similarity, shared by all the calls
+JARO_WINKLER = JaroWinkler()
+
+# Columns of ri_restaurants the cleaning reads, the normalized name, address
+# and city standing in for the raw ones. Rows inserted without them (raw SQL
+# through /web/query) are normalized as they are read
+CLEAN_COLUMNS = """id,
+                COALESCE(norm_name, normalize_name(name)) AS name,
+                COALESCE(norm_address, normalize_address(address)) AS address,
+                COALESCE(norm_city, normalize_city(city)) AS city,
+                state, zip, clean"""
+
+# Directory holding the numbered schema migrations (NNNN_description.sql)
+MIGRATIONS_DIR = path.join("schema", "migrations")
+
+# helper function that lists the migration scripts as (version, path) pairs,
+# in the order they have to be applied
+def migration_scripts():
+    scripts = []
+    for file_name in listdir(MIGRATIONS_DIR):
+        version = file_name.split("_", 1)[0]
+        if file_name.endswith(".sql") and version.isdigit():
+            scripts.append((int(version), path.join(MIGRATIONS_DIR, file_name)))
+    return sorted(scripts)
+
+# Data a migration cannot be applied over, as (what it is, query) per
+# version. The migration is refused, with the offending rows reported, when
+# the query returns any row: e.g. the UNIQUE (name, address) index of 0002
+# over restaurants stored twice (primary records added by an older /clean)
+MIGRATION_CHECKS = {
+    2: ("restaurants sharing a name and address (name, address, ids)",
+        """SELECT name, address, group_concat(id, ',') FROM ri_restaurants
+        WHERE address IS NOT NULL GROUP BY name, address
+        HAVING COUNT(*) > 1 ORDER BY MIN(id);"""),
+}
+
+# Offending rows listed when a migration is refused
+MIGRATION_CHECK_ROWS = 20
+
+# Opt-in merge of the restaurants that refuse migration 0002 (see
+# DB.merge_duplicates), run before it
+MERGE_SCRIPT = path.join("schema", "merge_duplicates.sql")
+MERGE_BEFORE = 2
+
+# helper function that converts the inspection date sent by the client
+# (MM/DD/YYYY) into the datetime stored in ri_inspections
+def to_inspection_date(date_str):
+    return datetime.strptime(date_str + " 00:00:00", "%m/%d/%Y %H:%M:%S")
+
+# helper function that splits a posted inspection record into its inspection
+# and restaurant attributes
+def split_inspection(postbody):
+    rest_keys = ["name", "facility_type", "address", "city", "state", "zip",
+                 "latitude", "longitude", "clean"]
+    restaurant = {key:value for key, value in postbody.items()
+                  if key in rest_keys}
+    insp_keys = ["inspection_id", "risk", "date", "inspection_type",
+                 "results", "violations", "restaurant_id"]
+    inspection = {key:value for key, value in postbody.items()
+                  if key in insp_keys}
+    return inspection, restaurant
+
+# helper function that checks a posted record has the attributes needed to
+# store it
+def valid_inspection(record):
+    if not isinstance(record, dict):
+        return False
+    try:
+        to_inspection_date(record["date"])
+    except (KeyError, TypeError, ValueError):
+        return False
+    return all(record.get(key) for key in ["inspection_id", "name", "address"])
+
 
 """
 Wraps a single connection to the database with higher-level functionality.
@@ -28,15 +112,25 @@ Wraps a single connection to the database with higher-level functionality.
 
 
 class DB:
-    def __init__(self, connection):
+    def __init__(self, connection, rest_cache=None):
         self.conn = connection
+        # Optional (name, address) -> id cache shared between connections
+        self.rest_cache = rest_cache
+        # Pairs the cascade scorer rejected during the cleans, by attribute
+        self.rejected = Counter()
+        # Timings and counters of the last clean (see stats.py)
+        self.stats = CleanStats(None)
+        # Normalization functions used by inserts and migrations
+        for function in [normalize_name, normalize_address, normalize_city]:
+            connection.create_function(function.__name__, 1, function,
+                                       deterministic=True)
 
     def execute_script(self, script_file):
         with open(script_file, "r") as script:
             c = self.conn.cursor()
             # Only using executescript for running a series of SQL commands.
             c.executescript(script.read())
-            self.conn.commit()
+            self.commit()
 
     def create_script(self):
         """
@@ -46,6 +140,105 @@ class DB:
         if not path.exists(script_file):
             raise InspError("Create Script not found")
         self.execute_script(script_file)
+        if self.rest_cache is not None:
+            self.rest_cache.clear()
+        self.migrate()
+
+    def schema_version(self):
+        """
+        Returns the schema version recorded in the database (0 when no
+        migration has been applied yet).
+        """
+        c = self.conn.cursor()
+        c.execute("PRAGMA user_version;")
+        return c.fetchone()[0]
+
+    def migrate(self, merge_duplicates=False):
+        """
+        Upgrades the database in place by applying, in order, every script
+        in schema/migrations numbered above the recorded schema version. Each
+        script runs in its own transaction together with the version bump.
+        A script whose check (MIGRATION_CHECKS) finds rows in its way is
+        refused, unless merge_duplicates allows merging the restaurants
+        stored twice first. Returns the resulting schema version.
+        """
+        if not path.exists(MIGRATIONS_DIR):
+            raise InspError("Migrations directory not found")
+        self.commit()
+        version = self.schema_version()
+        c = self.conn.cursor()
+        for number, script_file in migration_scripts():
+            if number <= version:
+                continue
+            if number == MERGE_BEFORE and merge_duplicates:
+                self.merge_duplicates()
+            self.check_migration(number, script_file)
+            logging.info("Applying migration %s" % script_file)
+            with open(script_file, "r") as script:
+                sql = script.read()
+            try:
+                c.executescript("BEGIN;\n%s\nPRAGMA user_version = %d;\nCOMMIT;"
+                                % (sql, number))
+            except sqlite3.Error as e:
+                self.conn.rollback()
+                raise InspError(f"Migration {script_file} failed: {e}")
+            version = number
+        return version
+
+    def check_migration(self, number, script_file):
+        """
+        Refuses the migration number when its check (MIGRATION_CHECKS) finds
+        rows it cannot be applied over. Nothing is changed: the rows are
+        reported, to be resolved before the migration is run again.
+        """
+        if number not in MIGRATION_CHECKS:
+            return
+        description, query = MIGRATION_CHECKS[number]
+        c = self.conn.cursor()
+        c.execute(query)
+        rows = c.fetchall()
+        if rows:
+            shown = "; ".join(str(row) for row in rows[:MIGRATION_CHECK_ROWS])
+            more = len(rows) - MIGRATION_CHECK_ROWS
+            if more > 0:
+                shown += "; and %s more" % more
+            hint = ""
+            if number == MERGE_BEFORE:
+                hint = (" Start with --merge-duplicates to merge each of them"
+                        " into its lowest id (kept in ri_merged_restaurants).")
+            raise InspError(f"Migration {script_file} refused, {len(rows)} "
+                            f"{description}: {shown}.{hint}")
+
+    def merge_duplicates(self):
+        """
+        Merges the restaurants stored more than once under the same name and
+        address into the lowest id with schema/merge_duplicates.sql, in one
+        transaction. The merged rows are recorded in ri_merged_restaurants
+        and the inspections they held in ri_merged_inspections. Returns the
+        number of restaurants merged.
+        """
+        if not path.exists(MERGE_SCRIPT):
+            raise InspError("Merge Script not found")
+        c = self.conn.cursor()
+        c.execute(MIGRATION_CHECKS[MERGE_BEFORE][1])
+        groups = c.fetchall()
+        if not groups:
+            return 0
+        with open(MERGE_SCRIPT, "r") as script:
+            sql = script.read()
+        self.commit()
+        try:
+            c.executescript("BEGIN;\n%s\nCOMMIT;" % sql)
+        except sqlite3.Error as e:
+            self.conn.rollback()
+            raise InspError(f"Merge {MERGE_SCRIPT} failed: {e}")
+        merged = 0
+        for name, address, ids in groups:
+            ids = sorted(int(rest_id) for rest_id in ids.split(","))
+            merged += len(ids) - 1
+            logging.warning("Merged restaurants %s (%s, %s) into %s"
+                            % (ids[1:], name, address, ids[0]))
+        return merged
 
     def seed_data(self):
         """
@@ -64,7 +257,9 @@ class DB:
         if not restaurant_id:
             raise InspError("No Restaurant Id", 404)
         c = self.conn.cursor()
-        query = """SELECT * FROM ri_restaurants WHERE id = :restaurant_id"""
+        query = """SELECT id, name, facility_type, address, city, state, zip,
+                latitude, longitude, clean FROM ri_restaurants
+                WHERE id = :restaurant_id"""
         c.execute(query, {"restaurant_id": restaurant_id})
         res = to_json_list(c)
         self.conn.commit()
@@ -132,16 +327,22 @@ class DB:
         associates it with the restaurant.
         """
         c = self.conn.cursor()
-        query = """SELECT id FROM ri_restaurants WHERE name = ? AND 
-                address = ?;"""
-        c.execute(query, [restaurant["name"], restaurant["address"]])
-        results = c.fetchall()
+        key = (restaurant["name"], restaurant["address"])
+        status = 200
+
+        #(1) Resolve the restaurant id from the cache first
+        rest_id = self.cached_restaurant_id(key)
 
-        #(1)Case where restaurant is not in the database
-        if len(results) == 0:
+        #(2) Case where the restaurant is not cached: insert it unless the
+        # (name, address) pair already exists
+        if rest_id is None:
             insert_rest = """INSERT INTO ri_restaurants (name, facility_type, 
-                          address, city, state, zip, latitude, longitude)
-                          VALUES (?, ?, ?, ?, ?, ?, ?, ?)"""
+                          address, city, state, zip, latitude, longitude,
+                          norm_name, norm_address, norm_city)
+                          VALUES (?1, ?2, ?3, ?4, ?5, ?6, ?7, ?8,
+                          normalize_name(?1), normalize_address(?3),
+                          normalize_city(?4))
+                          ON CONFLICT (name, address) DO NOTHING"""
             c.execute(insert_rest, [restaurant["name"],
                       restaurant["facility_type"], 
                       restaurant["address"],
@@ -150,62 +351,207 @@ class DB:
                       restaurant["zip"], 
                       restaurant["latitude"],
                       restaurant["longitude"]])
-        
-            #(1.1) Now that restaurant is in the database, get restaurant id
-            find_id = """SELECT id FROM ri_restaurants WHERE name = ? AND 
-                      address = ?;"""
-            c.execute(find_id, (restaurant["name"], restaurant["address"]))
-            results2 = to_json_list(c)[0]
-            new_rest_id = results2["id"]
-
-            # (1.2) Add inspection to the newly created restaurant
-            date_adj = inspection["date"] + " 00:00:00"
-            inspection["date"] = datetime.strptime(date_adj, 
-                                                   "%m/%d/%Y %H:%M:%S")
-            insert_insp = """INSERT INTO ri_inspections (id, risk, 
-                          inspection_date, inspection_type, results, 
-                          violations, restaurant_id) 
-                          VALUES (?, ?, ?, ?, ?, ?, ?)"""
-            c.execute(insert_insp, [inspection["inspection_id"], 
-                                    inspection["risk"],  
-                                    inspection["date"], 
-                                    inspection["inspection_type"],
-                                    inspection["results"],
-                                    inspection["violations"], 
-                                    new_rest_id])
-            return new_rest_id, 201
-
-        # (2) Case where the restaurant is already in the database
-        else:
-            #(2.1) Find if inspection is in the database
-            rest_id = results[0][0]
-            find_insp = """SELECT COUNT(1) FROM ri_inspections WHERE id = ?;"""
-            c.execute(find_insp, [inspection["inspection_id"]])
-            count_results = to_json_list(c)[0]
-            found = count_results["COUNT(1)"]
- 
-            #(2.2) Add inspection to existing restaurant
-            if found == 0:
-                date_adj = inspection["date"] + " 00:00:00"
-                inspection["date"] = datetime.strptime(date_adj,
-                                                       "%m/%d/%Y %H:%M:%S")
-                insert_insp = """INSERT INTO ri_inspections (id, risk, 
-                              inspection_date, inspection_type, results, 
-                              violations, restaurant_id) 
-                              VALUES (?, ?, ?, ?, ?, ?, ?)"""
-                c.execute(insert_insp, [inspection["inspection_id"], 
-                                    inspection["risk"],  
-                                    inspection["date"], 
-                                    inspection["inspection_type"],
-                                    inspection["results"],
-                                    inspection["violations"], 
-                                    rest_id])
-                return rest_id, 200
 
-            # (2.3) Case where both restaurant and inspection are 
-            # already in the database
+            #(2.1) Newly created restaurant, indexed for the next clean
+            if c.rowcount == 1:
+                rest_id = c.lastrowid
+                status = 201
+                self.add_block_keys([dict(restaurant, id=rest_id)])
+            #(2.2) Restaurant already in the database
+            else:
+                find_id = """SELECT id FROM ri_restaurants WHERE name = ? AND 
+                          address = ?;"""
+                c.execute(find_id, key)
+                rest_id = c.fetchone()[0]
+            self.cache_restaurant_id(key, rest_id)
+
+        #(3) Add the inspection. An inspection already in the database
+        # raises an IntegrityError, and the caller's rollback also drops a
+        # restaurant (2) just created for it
+        inspection["date"] = to_inspection_date(inspection["date"])
+        insert_insp = """INSERT INTO ri_inspections (id, risk, 
+                      inspection_date, inspection_type, results, 
+                      violations, restaurant_id) 
+                      VALUES (?, ?, ?, ?, ?, ?, ?)"""
+        c.execute(insert_insp, [inspection["inspection_id"], 
+                                inspection["risk"],  
+                                inspection["date"], 
+                                inspection["inspection_type"],
+                                inspection["results"],
+                                inspection["violations"], 
+                                rest_id])
+        return rest_id, status
+
+    def cached_restaurant_id(self, key):
+        """
+        Returns the cached id of the restaurant with the given (name, address)
+        or None.
+        """
+        if self.rest_cache is None or key[1] is None:
+            return None
+        return self.rest_cache.lookup(key, self.conn)
+
+    def cache_restaurant_id(self, key, rest_id):
+        """
+        Caches a restaurant id for this connection's open transaction. A NULL
+        address never matches another restaurant, so those are not cached.
+        """
+        if self.rest_cache is not None and key[1] is not None:
+            self.rest_cache.add(key, rest_id, self.conn)
+
+    def add_block_keys(self, records):
+        """
+        Adds the blocking keys of new restaurants (dicts with id, name,
+        address and zip) to ri_block_keys, where an incremental clean looks
+        up the candidates of the dirty records. Keys are computed from the
+        normalized values, like the ones the cleaning reads.
+        """
+        c = self.conn.cursor()
+        c.executemany("""INSERT OR IGNORE INTO ri_block_keys (restaurant_id,
+                      pass, key) VALUES (?, ?, ?)""",
+                      [(r["id"], name, key) for r in records
+                       for name, key in block_keys(normalized(r))])
+
+    def commit(self):
+        """
+        Commits the open transaction and publishes its cached restaurant ids.
+        """
+        self.conn.commit()
+        if self.rest_cache is not None:
+            self.rest_cache.commit(self.conn)
+
+    def rollback(self):
+        """
+        Rolls back the open transaction and forgets the restaurant ids it
+        cached, since those rows no longer exist.
+        """
+        self.conn.rollback()
+        if self.rest_cache is not None:
+            self.rest_cache.rollback(self.conn)
+
+    def add_inspections_batch(self, records):
+        """
+        Set-based version of add_inspection_for_restaurant for a whole batch
+        of (inspection, restaurant) pairs. Restaurants are resolved or created
+        with a handful of statements over a temp table, inspections are
+        inserted with a single executemany. Returns a list of
+        (restaurant_id, status) in the same order as records. An inspection
+        already in the database, or earlier in the batch, is not inserted
+        and gets (None, 409), and its restaurant is not created. The caller
+        is responsible for committing or rolling back.
+        """
+        c = self.conn.cursor()
+
+        # (0) Set aside the inspections that are already loaded or repeated
+        # (ids are stored as text, so 1 and "1" are the same inspection)
+        c.execute("""CREATE TEMP TABLE IF NOT EXISTS batch_insp (
+                  id varchar(16) PRIMARY KEY)""")
+        c.execute("DELETE FROM temp.batch_insp;")
+        c.executemany("INSERT OR IGNORE INTO temp.batch_insp VALUES (?);",
+                      [(inspection["inspection_id"],)
+                       for inspection, _ in records])
+        c.execute("""SELECT b.id FROM temp.batch_insp AS b
+                  JOIN ri_inspections AS i ON i.id = b.id;""")
+        seen = {row[0] for row in c.fetchall()}
+        duplicates = []
+        for inspection, _ in records:
+            inspection_id = str(inspection["inspection_id"])
+            duplicates.append(inspection_id in seen)
+            seen.add(inspection_id)
+        records = [record for record, duplicate in zip(records, duplicates)
+                   if not duplicate]
+
+        # (1) Stage the distinct (name, address) pairs of the batch
+        c.execute("""CREATE TEMP TABLE IF NOT EXISTS batch_rest (
+                  seq int PRIMARY KEY, name varchar(60), facility_type
+                  varchar(30), address varchar(60), city varchar(30),
+                  state char(2), zip char(5), latitude real, longitude real)""")
+        c.execute("DELETE FROM temp.batch_rest;")
+        staged = {}
+        record_seq = []
+        for inspection, restaurant in records:
+            key = (restaurant["name"], restaurant["address"])
+            if restaurant["address"] is None:
+                key += (len(record_seq),)
+            if key not in staged:
+                staged[key] = (len(staged), restaurant)
+            record_seq.append(staged[key][0])
+        c.executemany("""INSERT INTO temp.batch_rest VALUES
+                      (?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+                      [(seq, r["name"], r.get("facility_type"), r["address"],
+                        r.get("city"), r.get("state"), r.get("zip"),
+                        r.get("latitude"), r.get("longitude"))
+                       for seq, r in staged.values()])
+
+        # (2) Restaurants of the batch that already exist
+        match_query = """SELECT b.seq, MIN(r.id) FROM temp.batch_rest AS b
+                      JOIN ri_restaurants AS r ON r.name = b.name AND
+                      r.address = b.address GROUP BY b.seq;"""
+        c.execute(match_query)
+        existing = dict(c.fetchall())
+
+        # (3) Create the missing restaurants in one statement, then recover
+        # every id of the batch with a single join
+        insert_rest = """INSERT INTO ri_restaurants (name, facility_type,
+                      address, city, state, zip, latitude, longitude,
+                      norm_name, norm_address, norm_city)
+                      SELECT name, facility_type, address, city, state, zip,
+                      latitude, longitude, normalize_name(name),
+                      normalize_address(address), normalize_city(city)
+                      FROM temp.batch_rest AS b
+                      WHERE b.address IS NOT NULL AND NOT EXISTS (SELECT 1
+                      FROM ri_restaurants AS r WHERE r.name = b.name AND
+                      r.address = b.address) ORDER BY seq;"""
+        c.execute(insert_rest)
+        c.execute(match_query)
+        rest_ids = dict(c.fetchall())
+
+        # (3.1) A NULL address never matches an existing restaurant (same as
+        # the single-record path), so those rows are inserted one by one
+        for seq, r in staged.values():
+            if r["address"] is None:
+                c.execute("""INSERT INTO ri_restaurants (name, facility_type,
+                          address, city, state, zip, latitude, longitude,
+                          norm_name, norm_address, norm_city)
+                          SELECT name, facility_type, address, city, state,
+                          zip, latitude, longitude, normalize_name(name),
+                          normalize_address(address), normalize_city(city)
+                          FROM temp.batch_rest WHERE seq = ?;""", [seq])
+                rest_ids[seq] = c.lastrowid
+
+        for key, (seq, r) in staged.items():
+            self.cache_restaurant_id(key, rest_ids[seq])
+
+        # (3.2) Index the new restaurants for the next clean
+        self.add_block_keys([dict(r, id=rest_ids[seq])
+                             for seq, r in staged.values()
+                             if seq not in existing])
+
+        # (4) Insert all inspections at once
+        results = []
+        new_inspections = []
+        created = set()
+        for (inspection, restaurant), seq in zip(records, record_seq):
+            rest_id = rest_ids[seq]
+            if seq in existing or seq in created:
+                results.append((rest_id, 200))
             else:
-                return rest_id, 200
+                created.add(seq)
+                results.append((rest_id, 201))
+            new_inspections.append([inspection["inspection_id"],
+                                    inspection.get("risk"),
+                                    to_inspection_date(inspection["date"]),
+                                    inspection.get("inspection_type"),
+                                    inspection.get("results"),
+                                    inspection.get("violations"),
+                                    rest_id])
+        insert_insp = """INSERT INTO ri_inspections (id, risk,
+                      inspection_date, inspection_type, results, violations,
+                      restaurant_id) VALUES (?, ?, ?, ?, ?, ?, ?)"""
+        c.executemany(insert_insp, new_inspections)
+        inserted = iter(results)
+        return [(None, 409) if duplicate else next(inserted)
+                for duplicate in duplicates]
 
 
     def total_inspections(self):
@@ -289,52 +635,164 @@ class DB:
         return res
 
     
-    def block_records(self, is_blocking_on):
+    def block_records(self, is_blocking_on, strategies=None, workers=0):
         '''
-        If blocking set to True, creates blocks of the data based on ZIP code and 
-        cleans the records. If set to False, compares dirty records to all records 
-        in the ri_restaurants table to find matches and cleans records.
+        If blocking set to True, only compares the candidate pairs found by
+        the blocking passes in strategies (names from blocking.STRATEGIES,
+        by default blocking.DEFAULT_STRATEGIES) and cleans the records, on
+        a pool of workers processes if workers > 1. Unless qgram or lsh is
+        among the passes, only the dirty records and the records they can be
+        paired with are read (see incremental_records). If set to False,
+        compares dirty records to all records in the ri_restaurants table to
+        find matches and cleans records. Returns the stats of the clean (see
+        stats.CleanStats), which are logged too.
         '''
         c = self.conn.cursor()
+        blocking = None  # The MS3 clean has no blocking passes
+        if is_blocking_on is not False:
+            blocking = strategies = strategies or DEFAULT_STRATEGIES
+        self.stats = stats = CleanStats(blocking, workers)
+        rejected = Counter(self.rejected)
 
         if is_blocking_on is False:
-            # 1) Get all unclean records from database
-            query1 = """SELECT * FROM ri_restaurants WHERE clean = 0;"""
-            c.execute(query1)
-            dirty_restaurants = to_json_list(c)
-            # 2) Get all records from database
-            query2 = """SELECT * FROM ri_restaurants;"""
-            c.execute(query2)
-            all_restaurants = to_json_list(c)
+            with stats.phase("load"):
+                # 1) Get all records from database
+                query = f"""SELECT {CLEAN_COLUMNS} FROM ri_restaurants;"""
+                c.execute(query)
+                all_restaurants = read_records(c)
+                # 2) The unclean ones, shared with all_restaurants
+                dirty_restaurants = [res for res in all_restaurants
+                                     if not res.clean]
             # 3) Clean all records
             self.clean_up(dirty_restaurants, all_restaurants)
 
         else:
-            zip_query = """SELECT DISTINCT zip FROM ri_restaurants;"""
-            c.execute(zip_query) 
-            zip_list = to_json_list(c)
-
-            for zip_dict in zip_list:
-                zip_code = zip_dict.get("zip")
-                temp_query = f"""CREATE TEMP TABLE zip_block AS SELECT id, name,  
-                            address, city, state, zip, clean, SUBSTR(name, 1, 1) AS idx
-                            FROM ri_restaurants WHERE zip = {zip_code};"""           
-                c.execute(temp_query)
-                idx_query = """CREATE INDEX rest_idx ON zip_block (idx);"""
-                c.execute(idx_query)
-                # 1) Get all unclean records from temp table
-                get_clean = """SELECT * FROM zip_block WHERE clean = 0;"""
-                c.execute(get_clean)
-                dirty_restaurants = to_json_list(c)
-                # 2) Get all records from temp table
-                get_all = """SELECT * FROM zip_block;"""
-                c.execute(get_all)
-                all_restaurants = to_json_list(c)
-                # 3) Clean records by block
-                self.clean_up(dirty_restaurants, all_restaurants)
-                # 4) Drop temp table
-                drop_query = """DROP TABLE IF EXISTS zip_block;"""
-                c.execute(drop_query)
+            # 1) Get the attributes blocking and matching use, of the
+            # records the passes can pair with a dirty one
+            with stats.phase("load"):
+                records = self.clean_records(strategies)
+            with worker_pool(workers) as pool:
+                # 2) Union the candidate pairs of all blocking passes, found
+                # on the worker processes if there are any
+                with stats.phase("blocking"):
+                    pairs, blocks = self.block_pairs(records, strategies,
+                                                     pool=pool)
+                # 3) Clean the records matched among the candidates
+                self.clean_pairs(records, pairs, blocks=blocks, pool=pool)
+        stats.finish(self.rejected - rejected)
+        return stats.log()
+
+    def block_pairs(self, records, strategies, threshold=THRESHOLD,
+                    weights=WEIGHTS, pool=None):
+        '''
+        Unions the candidate pairs of the blocking passes in strategies like
+        blocking.candidate_pairs, one block (unit of work) at a time, adding
+        every block to self.stats with the time spent finding its pairs. A
+        pair found by several blocks is only kept in the first one, so it
+        is scored once. The passes filter the pairs on threshold and
+        weights, and run on the workers of pool if one is given. Returns the
+        pairs, block by block, and the index in self.stats.blocks of the
+        block of each.
+        '''
+        owners = {}
+        for name, unit, pairs, seconds in unit_pairs(
+                records, strategies, threshold, weights, pool):
+            block = len(self.stats.blocks)
+            found = len(owners)
+            for pair in pairs:
+                owners.setdefault(pair, block)
+            self.stats.add_block(name, len(unit), len(owners) - found, 0,
+                                 seconds)
+        return list(owners), list(owners.values())
+
+
+    def index_block_keys(self):
+        '''
+        Makes sure every restaurant has its keys in ri_block_keys, clean or
+        not: the ones that miss them (all of them in a database loaded
+        before the table existed, or after migration 0004 reset the keys)
+        get them.
+        '''
+        c = self.conn.cursor()
+        c.execute("""SELECT id, name, address, zip FROM ri_restaurants AS r
+                  WHERE NOT EXISTS (SELECT 1 FROM ri_block_keys AS k
+                  WHERE k.restaurant_id = r.id);""")
+        self.add_block_keys(to_json_list(c))
+
+    def clean_records(self, strategies, max_id=None):
+        '''
+        Returns the records (id, name, address, city, state, zip, clean)
+        the blocking passes in strategies need to pair the dirty records,
+        among the restaurants with an id up to max_id (by default all): all
+        of them for a pass without stored keys (qgram, lsh), otherwise see
+        incremental_records.
+        '''
+        c = self.conn.cursor()
+        if max_id is None:
+            c.execute("SELECT COALESCE(MAX(id), 0) FROM ri_restaurants;")
+            max_id = c.fetchone()[0]
+        if any(name not in KEY_PASSES + SORTED_PASSES for name in strategies):
+            query = f"""SELECT {CLEAN_COLUMNS} FROM ri_restaurants
+                    WHERE id <= ? ORDER BY id;"""
+            c.execute(query, [max_id])
+            return read_records(c)
+        return self.incremental_records(strategies, max_id)
+
+    def incremental_records(self, strategies, max_id):
+        '''
+        Returns the records (id, name, address, city, state, zip, clean)
+        blocking needs to pair the dirty records, looked up in ri_block_keys:
+        the dirty records, the records sharing a key of a key pass with one
+        of them and, for a sorted neighbourhood pass, the window - 1 records
+        before and after each of them in key order. A clean after a trickle
+        of new restaurants thus reads a handful of records, not the table.
+        The key passes give the same pairs as over the whole table, the
+        sorted neighbourhood pairs a dirty record with at least the
+        neighbours it has in the whole table. Restaurants with an id above
+        max_id are left out.
+        '''
+        c = self.conn.cursor()
+        self.index_block_keys()
+        c.execute("""CREATE TEMP TABLE IF NOT EXISTS clean_candidates (
+                  id int PRIMARY KEY);""")
+        c.execute("DELETE FROM temp.clean_candidates;")
+        # (1) The dirty records
+        c.execute("""INSERT INTO temp.clean_candidates SELECT id FROM
+                  ri_restaurants WHERE clean = 0 AND id <= ?;""", [max_id])
+        # (2) Records in the blocks of the dirty records
+        key_passes = [name for name in strategies if name in KEY_PASSES]
+        if key_passes:
+            marks = ", ".join("?" * len(key_passes))
+            c.execute(f"""INSERT OR IGNORE INTO temp.clean_candidates
+                      SELECT o.restaurant_id FROM temp.clean_candidates AS d
+                      JOIN ri_block_keys AS k ON k.restaurant_id = d.id AND
+                      k.pass IN ({marks}) JOIN ri_block_keys AS o ON
+                      o.pass = k.pass AND o.key = k.key
+                      WHERE o.restaurant_id <= ?;""", key_passes + [max_id])
+        # (3) Neighbours of the dirty records in key order
+        for name in strategies:
+            if name not in SORTED_PASSES:
+                continue
+            size = STRATEGIES[name].window - 1
+            c.execute("""SELECT k.key, k.restaurant_id FROM ri_block_keys AS k
+                      JOIN ri_restaurants AS r ON r.id = k.restaurant_id
+                      WHERE k.pass = ? AND r.clean = 0 AND r.id <= ?;""",
+                      [name, max_id])
+            neighbours = []
+            for key, rest_id in c.fetchall():
+                for sign, order in [("<", "DESC"), (">", "ASC")]:
+                    c.execute(f"""SELECT restaurant_id FROM ri_block_keys
+                              WHERE pass = ? AND (key, restaurant_id) {sign}
+                              (?, ?) AND restaurant_id <= ?
+                              ORDER BY key {order}, restaurant_id {order}
+                              LIMIT ?;""", [name, key, rest_id, max_id, size])
+                    neighbours.extend(c.fetchall())
+            c.executemany("""INSERT OR IGNORE INTO temp.clean_candidates
+                          VALUES (?);""", neighbours)
+        c.execute(f"""SELECT {CLEAN_COLUMNS} FROM ri_restaurants
+                  WHERE id IN (SELECT id FROM temp.clean_candidates)
+                  ORDER BY id;""")
+        return read_records(c)
 
 
     def clean_up(self, dirty, all_res, threshold=0.8):
@@ -342,77 +800,398 @@ class DB:
         Cleans up all dirty records and updates the ri_restaurants, ri_inspections
         and ri_linked tables, accordingly.
         '''
+        clusters = self.match_block(dirty, all_res, threshold)
+        with self.stats.phase("writing"):
+            return self.write_clusters(clusters, all_res)
+
+    def match_block(self, dirty, all_res, threshold=0.8, weights=WEIGHTS):
+        '''
+        Returns the clusters (lists of ids) of the dirty records matched
+        against every record of all_res with the weights and threshold.
+        '''
+        stats = self.stats
+        stats.counters.update(records=len(all_res), dirty=len(dirty))
+        # Every dirty record is scored against every other record
+        stats.count_pairs(len(dirty) * (len(all_res) - 1))
+        # Score every dirty record against every restaurant record, one row
+        # at a time, and cluster the matches as they come: records linked by
+        # a chain of matches end up in the same cluster
+        clusters = UnionFind()
+        with stats.phase("scoring"):
+            rows = self.score_block(dirty, all_res, threshold, weights)
+            for d, row in enumerate(rows):
+                matches = [(dirty[d]["id"], res["id"])
+                           for res, score in zip(all_res, row)
+                           if score and score >= threshold]
+                for rest_id, other_id in stats.count_pairs(0, matches):
+                    clusters.union(rest_id, other_id)
+        with stats.phase("clustering"):
+            return clusters.clusters()
+
+
+    def clean_pairs(self, records, pairs, threshold=0.8, blocks=None,
+                    pool=None):
+        '''
+        Cleans up the records matched among the candidate pairs ((i, j)
+        positions in records, records[i] being dirty), like clean_up. blocks
+        optionally gives the block of each pair in self.stats.blocks, whose
+        matches are then counted. The pairs are scored on the workers of
+        pool if one is given.
+        '''
+        clusters = self.match_pairs(records, pairs, threshold, blocks,
+                                    pool=pool)
+        with self.stats.phase("writing"):
+            return self.write_clusters(clusters, records)
+
+    def match_pairs(self, records, pairs, threshold=0.8, blocks=None,
+                    weights=WEIGHTS, pool=None):
+        '''
+        Returns the clusters (lists of ids) of the records matched among the
+        candidate pairs with the weights and threshold, like match_block,
+        scored on the workers of pool if one is given.
+        '''
+        stats = self.stats
+        stats.counters.update(
+            records=len(records),
+            dirty=sum(1 for record in records if not record["clean"]))
+        with stats.phase("scoring"):
+            if pool is None:
+                scores = self.score_pairs(records, pairs, threshold, weights)
+            else:
+                scores = [score for task in task_scores(
+                              records, pairs, threshold, weights,
+                              self.rejected, pool) for score in task]
+        with stats.phase("clustering"):
+            clusters = UnionFind()
+            for rest_id, other_id in self.count_matches(
+                    records, pairs, scores, threshold, blocks):
+                clusters.union(rest_id, other_id)
+            return clusters.clusters()
+
+    def count_matches(self, records, pairs, scores, threshold=THRESHOLD,
+                      blocks=None):
+        '''
+        Returns the pairs of ids matched among the scored candidate pairs,
+        once each, after counting them and the pairs scored in self.stats
+        (with the block of each pair, if blocks is given).
+        '''
+        matches = {}
+        for n, ((i, j), score) in enumerate(zip(pairs, scores)):
+            if score and score >= threshold:
+                block = None if blocks is None else blocks[n]
+                matches.setdefault(block, []).append((records[i]["id"],
+                                                      records[j]["id"]))
+        self.stats.count_pairs(len(pairs))
+        return [pair for block, block_matches in matches.items()
+                for pair in self.stats.count_pairs(0, block_matches, block)]
+
+    def preview_clean(self, strategies, weights=WEIGHTS, threshold=THRESHOLD,
+                      all_records=False):
+        '''
+        Dry run of a clean with the blocking passes in strategies (None to
+        compare every dirty record to every record, like the MS3 clean), the
+        weights and the threshold: finds the clusters it would make and
+        writes nothing, not even blocking keys. The records are read by a
+        single SELECT, a consistent snapshot of the whole table. With
+        all_records every record counts as dirty, so settings can be tried
+        again on data that was cleaned already. Returns the clusters (lists
+        of Records, largest first) and the stats of the run.
+        '''
         c = self.conn.cursor()
+        self.stats = stats = CleanStats(strategies)
+        rejected = Counter(self.rejected)
+        with stats.phase("load"):
+            c.execute(f"""SELECT {CLEAN_COLUMNS} FROM ri_restaurants
+                      ORDER BY id;""")
+            records = read_records(c)
+        if all_records:
+            for record in records:
+                record.clean = 0
+        if strategies is None:
+            dirty = [record for record in records if not record.clean]
+            clusters = self.match_block(dirty, records, threshold, weights)
+        else:
+            with stats.phase("blocking"):
+                pairs, blocks = self.block_pairs(records, strategies,
+                                                 threshold, weights)
+            clusters = self.match_pairs(records, pairs, threshold, blocks,
+                                        weights)
+        stats.counters["clusters"] = len(clusters)
+        stats.finish(self.rejected - rejected)
+        by_id = {record.id: record for record in records}
+        clusters = sorted(([by_id[rest_id] for rest_id in ids]
+                           for ids in clusters), key=len, reverse=True)
+        return clusters, stats.log()
 
-        # Iterate through every dirty record and compare to every restaurant record
-        matches = {} # Initialize dictionary of records matched to a dirty restaurant id
-        for dirty_res in dirty:
-            matches[dirty_res["id"]] = set()
-            for res in all_res:
-                # Apply similarity method to each pair of restaurants
-                score = self.find_similarity(dirty_res, res) 
-                if score:
-                    if score >= threshold:
-                        matches[dirty_res["id"]].add(res["id"])
-                # Update set of dirty records to clean
-                update_clean = "UPDATE ri_restaurants SET clean = 1 WHERE id = ?;"
-        # Temporary matched pairs (including separated matches and duplicates)
-        temp_matches = set() 
-        for k, v in matches.items():
-            for key, val in matches.items():
-                if key in v:
-                    new_v = matches.get(k)
-                    for value in val:
-                        new_v.add(value)
-                    matches[k] = new_v
-                    temp_matches.add(key)
-        # List of matched pairs without duplicates
-        final_match_list = []
-        for match in temp_matches:
-            removed_item = matches.pop(match)
-            if removed_item not in final_match_list:
-                final_match_list.append(removed_item)
-        # Iterate through list of matches to create lists of matched attributes
-        for match_sets in final_match_list: 
-            temp_list_of_names = []
-            temp_list_of_addresses = []
-            for ids in match_sets: 
-                for res in all_res:
-                    if res["id"] == ids:
-                        temp_list_of_names.append(res["name"])
-                        temp_list_of_addresses.append(res["address"])
-            # Find longest strings for name and address between first two records
-            # (to compose new primary restaurant record)
-            longest_name = max(temp_list_of_names[0], temp_list_of_names[1])
-            longest_address = max(temp_list_of_addresses)       
-            # Insert primary restaurant record into ri-restaurants table
-            insert_primary_rest = """INSERT INTO ri_restaurants (name, address)
-                                VALUES (?, ?)"""
-            c.execute(insert_primary_rest, [longest_name,
-                                            longest_address])
-            self.conn.commit()
-            primary_rest_id = c.lastrowid # Get primary restaurant record id
-            # Initialize dictionary of primary key mapped to list of linked restaurants
-            authoritative_key_dict = {} 
-            authoritative_key_dict[primary_rest_id] = match_sets
-
-            # Update set of newly created primary record to clean
-            update_clean = "UPDATE ri_restaurants SET clean = 1 WHERE id = ?;"
-            c.execute(update_clean, [primary_rest_id])  
-
-            for ids in match_sets: 
-                insert_match = """INSERT INTO ri_linked (primary_rest_id, 
-                            original_rest_id) VALUES (?, ?)"""
-                c.execute(insert_match, [primary_rest_id, ids])
-                self.conn.commit()
-                # Update ri_inspections table for all matched records                
-                update_insp = """UPDATE ri_inspections SET restaurant_id = ? 
-                            WHERE restaurant_id = ?;"""
-                c.execute(update_insp, [primary_rest_id, ids])
-                self.conn.commit()
 
+    def create_clean_job(self, strategies):
+        '''
+        Records a new background clean of the restaurants there are now with
+        the blocking passes in strategies. Returns the job id.
+        '''
+        c = self.conn.cursor()
+        c.execute("""INSERT INTO ri_clean_jobs (status, blocking, max_rest_id,
+                  started_at) SELECT 'running', ?, COALESCE(MAX(id), 0),
+                  datetime('now') FROM ri_restaurants;""",
+                  [",".join(strategies)])
+        self.conn.commit()
+        return c.lastrowid
+
+    def find_clean_job(self, job_id):
+        '''
+        Returns the progress of a background clean, with an estimate of the
+        seconds left from the time its scoring tasks took so far.
+        '''
+        c = self.conn.cursor()
+        c.execute("""SELECT id AS job_id, status, blocking, max_rest_id,
+                  tasks_total, tasks_done, blocks_total, blocks_done,
+                  pairs_scored, seconds, started_at, finished_at, error
+                  FROM ri_clean_jobs WHERE id = ?;""", [job_id])
+        res = to_json_list(c)
+        self.conn.commit()
+        if len(res) == 0:
+            raise KeyError(f"Clean job {job_id} was not found.")
+        job = res[0]
+        job["eta_seconds"] = None
+        if job["status"] == "running" and job["tasks_done"]:
+            job["eta_seconds"] = (job["seconds"] / job["tasks_done"]
+                                  * (job["tasks_total"] - job["tasks_done"]))
+        return job
+
+    def running_clean_jobs(self):
+        '''
+        Returns the ids of the background cleans that have not finished (e.g.
+        interrupted by a restart).
+        '''
+        c = self.conn.cursor()
+        c.execute("""SELECT id FROM ri_clean_jobs WHERE status = 'running'
+                  ORDER BY id;""")
+        return [row[0] for row in c.fetchall()]
+
+    def plan_clean_job(self, job_id, plan, tasks_total, blocks_total):
+        '''
+        Records the scoring tasks of a job (plan identifies them). Returns
+        how many were already checkpointed, which are only kept if the job
+        had the same plan before.
+        '''
+        c = self.conn.cursor()
+        c.execute("SELECT plan, tasks_done FROM ri_clean_jobs WHERE id = ?;",
+                  [job_id])
+        old_plan, tasks_done = c.fetchone()
+        if old_plan != plan:
+            c.execute("DELETE FROM ri_clean_matches WHERE job_id = ?;",
+                      [job_id])
+            c.execute("""UPDATE ri_clean_jobs SET plan = ?, tasks_total = ?,
+                      blocks_total = ?, tasks_done = 0, blocks_done = 0,
+                      pairs_scored = 0, seconds = 0 WHERE id = ?;""",
+                      [plan, tasks_total, blocks_total, job_id])
+            tasks_done = 0
+        self.conn.commit()
+        return tasks_done
+
+    def checkpoint_clean_job(self, job_id, matches, blocks, scored, seconds):
+        '''
+        Saves the matched pairs of the next scoring task of a job, with its
+        progress (the blocks whose pairs are all scored), in one
+        transaction.
+        '''
+        c = self.conn.cursor()
+        c.executemany("INSERT INTO ri_clean_matches VALUES (?, ?, ?);",
+                      [(job_id, rest_id, other_id)
+                       for rest_id, other_id in matches])
+        c.execute("""UPDATE ri_clean_jobs SET tasks_done = tasks_done + 1,
+                  blocks_done = blocks_done + ?, pairs_scored = pairs_scored
+                  + ?, seconds = seconds + ? WHERE id = ?;""",
+                  [blocks, scored, seconds, job_id])
+        self.conn.commit()
+
+    def clean_job_matches(self, job_id):
+        '''
+        Returns the matched pairs a job has checkpointed.
+        '''
+        c = self.conn.cursor()
+        c.execute("""SELECT rest_id, other_id FROM ri_clean_matches
+                  WHERE job_id = ?;""", [job_id])
+        return c.fetchall()
+
+    def finish_clean_job(self, job_id, status, error=None):
+        '''
+        Marks a job done or failed and drops its checkpoints.
+        '''
+        c = self.conn.cursor()
+        c.execute("DELETE FROM ri_clean_matches WHERE job_id = ?;", [job_id])
+        c.execute("""UPDATE ri_clean_jobs SET status = ?, error = ?,
+                  finished_at = datetime('now') WHERE id = ?;""",
+                  [status, error, job_id])
+        self.conn.commit()
+
+
+    def write_clusters(self, clusters, all_res):
+        '''
+        Links every cluster of matched ids to a primary restaurant in
+        ri_linked and ri_inspections, and marks the clusters and the dirty
+        records of all_res clean. A cluster that holds an already linked
+        record keeps its primary, otherwise a new primary is created (or
+        the record with its name and address is reused, and stays linked to
+        itself). The cluster of every record is staged in a temp table,
+        then applied with a few set-based statements, all in a single
+        transaction.
+        '''
+        stats = self.stats
+        stats.counters["clusters"] += len(clusters)
+        c = self.conn.cursor()
+        # Pending inserts are committed first, as the clean always did
+        self.conn.commit()
+        try:
+            # (1) Stage the cluster of every matched record, and the dirty
+            # records without a match (no cluster)
+            c.execute("""CREATE TEMP TABLE IF NOT EXISTS clean_stage (
+                      rest_id int PRIMARY KEY, cluster int);""")
+            c.execute("""CREATE TEMP TABLE IF NOT EXISTS clean_primary (
+                      cluster int PRIMARY KEY, primary_rest_id int,
+                      reused int);""")
+            c.execute("DELETE FROM temp.clean_stage;")
+            c.execute("DELETE FROM temp.clean_primary;")
+            c.executemany("INSERT INTO temp.clean_stage VALUES (?, ?);",
+                          [(ids, n) for n, match_sets in enumerate(clusters)
+                           for ids in match_sets])
+            c.executemany("""INSERT OR IGNORE INTO temp.clean_stage
+                          VALUES (?, NULL);""",
+                          [(res["id"],) for res in all_res if not res["clean"]])
+
+            # (2) Primaries the clusters already have (a new record matching
+            # a cleaned one): the first one is kept and the others join it
+            c.execute("""SELECT s.cluster, l.primary_rest_id
+                      FROM temp.clean_stage AS s JOIN ri_linked AS l
+                      ON l.original_rest_id = s.rest_id
+                      UNION SELECT s.cluster, l.primary_rest_id
+                      FROM temp.clean_stage AS s JOIN ri_linked AS l
+                      ON l.primary_rest_id = s.rest_id
+                      ORDER BY 1, 2;""")
+            primaries = {}
+            for cluster, primary_rest_id in c.fetchall():
+                if cluster is not None:
+                    primaries.setdefault(cluster, []).append(primary_rest_id)
+            c.executemany("""INSERT OR REPLACE INTO temp.clean_stage
+                          VALUES (?, ?);""",
+                          [(primary_rest_id, cluster)
+                           for cluster, ids in primaries.items()
+                           for primary_rest_id in ids[1:]])
+
+            # (3) Create the primaries of the other clusters. A reused
+            # record is a restaurant of its own, so it joins the cluster
+            assignments = []
+            for n, match_sets in enumerate(clusters):
+                if n in primaries:
+                    assignments.append((n, primaries[n][0], 0))
+                    continue
+                primary_rest_id, created = self.add_primary(match_sets)
+                assignments.append((n, primary_rest_id, int(not created)))
+                stats.counters["primaries"] += 1
+                if not created:
+                    c.execute("""INSERT INTO temp.clean_stage VALUES (?, ?)
+                              ON CONFLICT (rest_id) DO UPDATE SET
+                              cluster = excluded.cluster
+                              WHERE cluster IS NULL;""", [primary_rest_id, n])
+            c.executemany("""INSERT INTO temp.clean_primary
+                          VALUES (?, ?, ?);""", assignments)
+
+            # (4) Link the clusters, move their inspections to the primary
+            # and mark everything clean
+            c.execute("""INSERT INTO ri_linked (primary_rest_id,
+                      original_rest_id) SELECT p.primary_rest_id, s.rest_id
+                      FROM temp.clean_stage AS s JOIN temp.clean_primary AS p
+                      ON p.cluster = s.cluster
+                      WHERE s.rest_id <> p.primary_rest_id OR p.reused
+                      ON CONFLICT DO NOTHING;""")
+            stats.counters["linked"] += c.rowcount
+            # The records linked to a primary that joined another one (2) are
+            # linked to the primary kept, so no link goes through two
+            absorbed = """SELECT s.rest_id FROM temp.clean_stage AS s
+                       JOIN temp.clean_primary AS p ON p.cluster = s.cluster
+                       WHERE s.rest_id <> p.primary_rest_id"""
+            c.execute(f"""UPDATE OR IGNORE ri_linked SET primary_rest_id =
+                      (SELECT p.primary_rest_id FROM temp.clean_stage AS s
+                      JOIN temp.clean_primary AS p ON p.cluster = s.cluster
+                      WHERE s.rest_id = ri_linked.primary_rest_id)
+                      WHERE primary_rest_id IN ({absorbed});""")
+            c.execute(f"""DELETE FROM ri_linked
+                      WHERE primary_rest_id IN ({absorbed});""")
+            c.execute("""UPDATE ri_inspections SET restaurant_id =
+                      (SELECT p.primary_rest_id FROM temp.clean_stage AS s
+                      JOIN temp.clean_primary AS p ON p.cluster = s.cluster
+                      WHERE s.rest_id = ri_inspections.restaurant_id)
+                      WHERE restaurant_id IN (SELECT s.rest_id FROM
+                      temp.clean_stage AS s JOIN temp.clean_primary AS p
+                      ON p.cluster = s.cluster
+                      WHERE s.rest_id <> p.primary_rest_id);""")
+            stats.counters["inspections_moved"] += c.rowcount
+            # Dirty records without a match are clean too, so a second clean
+            # in a row has nothing left to do
+            c.execute("""UPDATE ri_restaurants SET clean = 1 WHERE id IN
+                      (SELECT rest_id FROM temp.clean_stage UNION
+                      SELECT primary_rest_id FROM temp.clean_primary);""")
+            stats.counters["cleaned"] += c.rowcount
+        except Exception:
+            # Nothing of a failed clean is kept
+            self.conn.rollback()
+            raise
+        self.conn.commit()
         return 200
 
+    def add_primary(self, cluster):
+        '''
+        Creates the primary restaurant of a cluster of restaurant ids (or
+        reuses an existing record with the same name and address), from
+        their raw names and addresses. Returns its id, and whether it was
+        created.
+        '''
+        c = self.conn.cursor()
+        marks = ", ".join("?" * len(cluster))
+        c.execute(f"""SELECT name, address FROM ri_restaurants
+                  WHERE id IN ({marks}) ORDER BY id;""", cluster)
+        rows = c.fetchall()
+        temp_list_of_names = [row[0] for row in rows]
+        temp_list_of_addresses = [row[1] for row in rows]
+        # Find longest strings for name and address between first two records
+        # (to compose new primary restaurant record)
+        longest_name = max(temp_list_of_names[0], temp_list_of_names[1])
+        longest_address = max(temp_list_of_addresses)       
+        # Insert primary restaurant record into ri-restaurants table
+        # (an existing record with the same name and address is reused)
+        insert_primary_rest = """INSERT INTO ri_restaurants (name, address,
+                            norm_name, norm_address) VALUES (?1, ?2,
+                            normalize_name(?1), normalize_address(?2))
+                            ON CONFLICT (name, address) DO NOTHING"""
+        c.execute(insert_primary_rest, [longest_name, longest_address])
+        created = c.rowcount == 1
+        if created:
+            primary_rest_id = c.lastrowid # Get primary restaurant record id
+            self.add_block_keys([{"id": primary_rest_id, "name": longest_name,
+                                  "address": longest_address}])
+        else:
+            c.execute("""SELECT id FROM ri_restaurants WHERE name = ? AND
+                      address = ?;""", [longest_name, longest_address])
+            primary_rest_id = c.fetchone()[0]
+        return primary_rest_id, created
+
+
+    def score_block(self, dirty, all_res, threshold=None, weights=WEIGHTS):
+        '''
+        Scores every dirty record against every record of all_res. Yields
+        one row of scores per dirty record, the same find_similarity gives
+        for each pair, so the whole block is never held at once. With a
+        threshold, pairs are stopped as soon as they cannot reach it (their
+        scores are then only bounds under it) and counted in self.rejected.
+        '''
+        return score_rows(dirty, all_res, weights, threshold, self.rejected)
+
+    def score_pairs(self, records, pairs, threshold=None, weights=WEIGHTS):
+        '''
+        Scores the candidate pairs ((i, j) positions in records), like
+        score_block. Returns the scores in the order of pairs.
+        '''
+        return score_pairs(records, pairs, weights, threshold, self.rejected)
 
     def find_similarity(self, dirty_r, r, name_weight=0.45, address_weight=0.4,
                         city_weight=0.09, state_weight=0.06):
@@ -438,8 +1217,7 @@ class DB:
 
         if d_id != a_id: # Don't match a restaurant to itself
             # Get name similarity score 
-            jarowinky = JaroWinkler()
-            name_sim = jarowinky.similarity(d_name, a_name)
+            name_sim = JARO_WINKLER.similarity(d_name, a_name)
             name_score = name_sim * name_weight
             # Get address similarity score
             address_alg = textdistance.algorithms
@@ -504,5 +1282,8 @@ class DB:
         c = self.conn.cursor()
         c.execute(query)
         res =to_json_list(c)
-        self.conn.commit()
+        self.commit()
+        # An arbitrary statement may have changed restaurant ids
+        if self.rest_cache is not None:
+            self.rest_cache.clear()
         return res
\ No newline at end of file
@@ -0,0 +1,163 @@
+import logging  # Logging Library
+import threading
+import time
+import zlib
+from clustering import UnionFind
+from collections import Counter
+from db import DB  # our custom data access layer
+from parallel import TASK_PAIRS, task_scores, worker_pool
+from stats import CleanStats
+
+
+"""
+Background cleans: /clean/start hands the clean to a thread with its own
+connection and answers with a job id right away, so the other endpoints keep
+being served while it runs. /clean/status/<id> reports its progress.
+"""
+
+
+# helper function that counts the blocks whose last candidate pair is among
+# pairs first to last (the pairs of a block are next to each other)
+def blocks_ending(blocks, first, last):
+    return sum(1 for n in range(first, last)
+               if n + 1 == len(blocks) or blocks[n + 1] != blocks[n])
+
+
+class CleanJobs:
+    '''
+    Runs cleans in the background, one at a time. A job finds the candidate
+    pairs of its blocking passes, scores them task by task (see
+    parallel.task_scores), on a pool of workers processes if workers > 1,
+    and checkpoints the matches of every task in ri_clean_matches. A job
+    interrupted by a restart finds its pairs again and is picked up by
+    resume() at its last checkpoint. Once every pair is scored, the
+    clusters are written in one transaction, like /clean. lock is held for
+    as long as a clean runs, so a synchronous /clean is refused meanwhile.
+    '''
+    def __init__(self, connect, workers=0):
+        # Function returning a new connection the job thread can use
+        self.connect = connect
+        self.workers = workers
+        self.lock = threading.Lock()
+        self.thread = None
+        # Stats (as JSON) of the last clean, background or not
+        self.last_stats = None
+
+    def start(self, strategies):
+        '''
+        Starts a clean with the blocking passes in strategies. Returns its
+        job id, or None if a clean is already running.
+        '''
+        if not self.lock.acquire(blocking=False):
+            return None
+        try:
+            db = DB(self.connect())
+            job_id = db.create_clean_job(strategies)
+        except Exception:
+            self.lock.release()
+            raise
+        self.run_in_background(db, job_id)
+        return job_id
+
+    def resume(self):
+        '''
+        Resumes the job a restart interrupted, if any. Returns its id.
+        '''
+        if not self.lock.acquire(blocking=False):
+            return None
+        db = DB(self.connect())
+        running = db.running_clean_jobs()
+        if not running:
+            db.conn.close()
+            self.lock.release()
+            return None
+        # Only one job runs at a time, older leftovers are given up
+        for job_id in running[:-1]:
+            db.finish_clean_job(job_id, "failed", "Superseded by job %s"
+                                % running[-1])
+        logging.info("Resuming clean job %s" % running[-1])
+        self.run_in_background(db, running[-1])
+        return running[-1]
+
+    def run_in_background(self, db, job_id):
+        self.thread = threading.Thread(target=self.run, args=(db, job_id),
+                                       daemon=True, name="clean-job")
+        self.thread.start()
+
+    def run(self, db, job_id):
+        try:
+            self.clean(db, job_id)
+            db.finish_clean_job(job_id, "done")
+        except Exception as e:
+            logging.error("Clean job %s failed %s" % (job_id, e))
+            try:
+                db.rollback()
+                db.finish_clean_job(job_id, "failed", str(e))
+            except Exception as e:
+                logging.error("Clean job %s not recorded as failed %s"
+                              % (job_id, e))
+        finally:
+            db.conn.close()
+            self.lock.release()
+
+    def clean(self, db, job_id):
+        '''
+        Finds the candidate pairs of the job, scores the tasks of pairs not
+        checkpointed yet, then writes the clusters of all its matches. The
+        stats only cover the pairs scored by this run, not those of the
+        checkpoints it resumes from.
+        '''
+        job = db.find_clean_job(job_id)
+        strategies = job["blocking"].split(",")
+        db.stats = stats = CleanStats(strategies, self.workers)
+        rejected = Counter(db.rejected)
+        with stats.phase("load"):
+            records = db.clean_records(strategies, job["max_rest_id"])
+            # Reading the records may have written block keys and temp
+            # candidates; commit them so the job holds no lock on the
+            # database while it blocks and scores
+            db.commit()
+        stats.counters.update(
+            records=len(records),
+            dirty=sum(1 for record in records if not record["clean"]))
+        with worker_pool(self.workers) as pool:
+            # (1) Find the candidate pairs and plan their scoring tasks; the
+            # checkpoints only apply to the same ones
+            with stats.phase("blocking"):
+                pairs, blocks = db.block_pairs(records, strategies, pool=pool)
+            plan = 0
+            for first in range(0, len(pairs), TASK_PAIRS):
+                plan = zlib.crc32(repr([
+                    (records[i]["id"], records[j]["id"])
+                    for i, j in pairs[first:first + TASK_PAIRS]]).encode(),
+                    plan)
+            total = -(-len(pairs) // TASK_PAIRS)
+            done = db.plan_clean_job(job_id, plan, total, len(set(blocks)))
+            logging.info("Clean job %s: %s tasks, %s done"
+                         % (job_id, total, done))
+            # (2) Score the remaining tasks, checkpointing each one
+            start = time.perf_counter()
+            scores = task_scores(records, pairs[done * TASK_PAIRS:],
+                                 rejected=db.rejected, pool=pool)
+            for task, task_scored in enumerate(scores, done):
+                first = task * TASK_PAIRS
+                last = first + len(task_scored)
+                matches = db.count_matches(records, pairs[first:last],
+                                           task_scored,
+                                           blocks=blocks[first:last])
+                now = time.perf_counter()
+                stats.seconds["scoring"] += now - start
+                db.checkpoint_clean_job(job_id, matches,
+                                        blocks_ending(blocks, first, last),
+                                        last - first, now - start)
+                start = now
+        # (3) Cluster and write everything the job matched
+        with stats.phase("clustering"):
+            clusters = UnionFind()
+            for rest_id, other_id in db.clean_job_matches(job_id):
+                clusters.union(rest_id, other_id)
+            clusters = clusters.clusters()
+        with stats.phase("writing"):
+            db.write_clusters(clusters, records)
+        stats.finish(db.rejected - rejected)
+        self.last_stats = stats.log()
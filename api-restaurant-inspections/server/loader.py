@@ -0,0 +1,228 @@
+import argparse  # Used for getting arguments for the loader
+import json
+import logging  # Logging Library
+import sqlite3  # Our DB
+import sys
+import time
+from itertools import islice
+from db import DB, split_inspection, valid_inspection  # our custom data access layer
+from errors import InspError
+
+
+# PRAGMAs for a bulk load. They trade crash safety for speed, so only use
+# the loader for backfills while the server is stopped.
+LOAD_PRAGMAS = {
+    "journal_mode": "MEMORY",
+    "synchronous": "OFF",
+    "cache_size": -262144,  # in KiB
+    "temp_store": "MEMORY",
+}
+
+
+"""
+Offline bulk loader: streams inspection files straight into insp.db through
+the DB layer, without going through the web server. Run it from the server
+directory (like server.py) so the schema scripts are found:
+
+    python3 loader.py ../data/ms3/chiDirty100.json ../data/ms4/chiDirty1k.json
+"""
+
+
+class RecordStream:
+    '''
+    Reads a JSON file in chunks and decodes one value at a time, so the
+    file never has to fit in memory.
+    '''
+    def __init__(self, file_in, chunk_size=1 << 16):
+        self.file_in = file_in
+        self.chunk_size = chunk_size
+        self.decoder = json.JSONDecoder()
+        self.buf = ""
+        self.pos = 0
+
+    def fill(self):
+        '''
+        Reads the next chunk, returns False at the end of the file.
+        '''
+        chunk = self.file_in.read(self.chunk_size)
+        self.buf = self.buf[self.pos:] + chunk
+        self.pos = 0
+        return chunk != ""
+
+    def peek(self):
+        '''
+        Returns the next non-whitespace character without consuming it
+        ("" at the end of the file).
+        '''
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos].isspace():
+                self.pos += 1
+            if self.pos < len(self.buf) or not self.fill():
+                return self.buf[self.pos:self.pos + 1]
+
+    def expect(self, char):
+        if self.peek() != char:
+            raise ValueError("Expected '%s' at '%s'"
+                             % (char, self.buf[self.pos:self.pos + 20]))
+        self.pos += 1
+
+    def value(self):
+        '''
+        Decodes the next JSON value, reading more of the file as needed.
+        '''
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buf, self.pos)
+            except json.JSONDecodeError:
+                if not self.fill():
+                    raise
+                continue
+            # A number may continue in the next chunk
+            if end == len(self.buf) and self.fill():
+                continue
+            self.pos = end
+            return value
+
+    def array(self):
+        '''
+        Yields the elements of the JSON array starting at the current
+        position.
+        '''
+        self.expect("[")
+        if self.peek() == "]":
+            self.pos += 1
+            return
+        while True:
+            yield self.value()
+            if self.peek() == ",":
+                self.pos += 1
+            else:
+                self.expect("]")
+                return
+
+
+def iter_records(file_path):
+    '''
+    Yields the inspection records of a file one at a time. Accepts the
+    client's test file format (an object whose "values" list holds the
+    records, e.g. data/ms3/chiDirty100.json), a bare JSON array, or NDJSON
+    (.ndjson/.jsonl, one record per line).
+    '''
+    with open(file_path, "r") as file_in:
+        if file_path.endswith((".ndjson", ".jsonl")):
+            for line in file_in:
+                if line.strip():
+                    yield json.loads(line)
+            return
+
+        stream = RecordStream(file_in)
+        if stream.peek() == "[":
+            yield from stream.array()
+            return
+        # Walk the keys of the top object until the "values" list
+        stream.expect("{")
+        while stream.peek() != "}":
+            key = stream.value()
+            stream.expect(":")
+            if key == "values":
+                yield from stream.array()
+            else:
+                stream.value()
+            if stream.peek() == ",":
+                stream.pos += 1
+
+
+def batches(records, batch_size):
+    '''
+    Groups an iterator of records into lists of batch_size records.
+    '''
+    records = iter(records)
+    while True:
+        batch = list(islice(records, batch_size))
+        if not batch:
+            return
+        yield batch
+
+
+def load_files(conn, files, batch_size, progress=True):
+    '''
+    Loads every file into the database, one transaction per batch. Returns
+    (records loaded, records skipped as invalid or already loaded).
+    '''
+    db = DB(conn)
+    loaded = 0
+    skipped = 0
+    start = time.perf_counter()
+    for file_path in files:
+        logging.info("Loading %s" % file_path)
+        for batch in batches(iter_records(file_path), batch_size):
+            records = [split_inspection(r) for r in batch
+                       if valid_inspection(r)]
+            skipped += len(batch) - len(records)
+            try:
+                resp = db.add_inspections_batch(records)
+                db.commit()
+            except Exception:
+                db.rollback()
+                raise
+            duplicates = sum(1 for _, status in resp if status == 409)
+            skipped += duplicates
+            loaded += len(records) - duplicates
+            elapsed = time.perf_counter() - start
+            if progress:
+                print("Loaded %s records (%.0f rows/sec)"
+                      % (loaded, loaded / elapsed if elapsed else 0))
+    return loaded, skipped
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("files", nargs="+",
+                        help="Inspection files (client format, JSON array "
+                             "or NDJSON)")
+    parser.add_argument("-d", "--database",
+                        help="Database file (default insp.db)",
+                        default="insp.db")
+    parser.add_argument("-b", "--batch-size",
+                        help="Records per transaction (default 10000)",
+                        default=10000, type=int)
+    parser.add_argument("-c", "--create",
+                        help="Drop and recreate the tables first",
+                        default=False, action="store_true")
+    parser.add_argument("--merge-duplicates",
+                        help="Merge restaurants stored twice under the same "
+                             "name and address so that migration 0002 can "
+                             "run (kept in ri_merged_restaurants)",
+                        default=False, action="store_true")
+    parser.add_argument("-l", "--log",
+                        help="Set the log level (debug,info,warning,error)",
+                        default="warning",
+                        choices=['debug', 'info', 'warning', 'error'])
+    args = parser.parse_args()
+    logging.basicConfig(format='%(levelname)-8s [%(filename)s:%(lineno)d] '
+                               '%(message)s', level=args.log.upper())
+
+    conn = sqlite3.connect(args.database)
+    # Remember the journal mode (e.g. WAL set by the server) to restore it
+    journal_mode = conn.execute("PRAGMA journal_mode;").fetchone()[0]
+    for name, value in LOAD_PRAGMAS.items():
+        conn.execute("PRAGMA %s = %s;" % (name, value))
+    db = DB(conn)
+    try:
+        if args.create:
+            db.create_script()
+        else:
+            db.migrate(args.merge_duplicates)
+    except InspError as e:
+        conn.close()
+        sys.exit(e.message)
+
+    start = time.perf_counter()
+    loaded, skipped = load_files(conn, args.files, args.batch_size)
+    elapsed = time.perf_counter() - start
+    conn.execute("PRAGMA journal_mode = %s;" % journal_mode)
+    conn.close()
+    print("Done: %s records in %.2fs (%.0f rows/sec), %s invalid or "
+          "duplicate skipped"
+          % (loaded, elapsed, loaded / elapsed if elapsed else 0, skipped))
@@ -0,0 +1,75 @@
+import re
+
+
+# Canonical (USPS) forms of the street suffixes and directions of addresses
+ADDRESS_WORDS = {
+    "AVENUE": "AVE", "AV": "AVE", "STREET": "ST", "ROAD": "RD",
+    "BOULEVARD": "BLVD", "DRIVE": "DR", "PLACE": "PL", "PARKWAY": "PKWY",
+    "COURT": "CT", "LANE": "LN", "HIGHWAY": "HWY", "TERRACE": "TER",
+    "SQUARE": "SQ", "PLAZA": "PLZ", "EXPRESSWAY": "EXPY",
+    "NORTH": "N", "SOUTH": "S", "EAST": "E", "WEST": "W",
+}
+
+# Canonical forms of common words of restaurant names
+NAME_WORDS = {
+    "&": "AND", "RESTAURANT": "REST", "COMPANY": "CO",
+    "INCORPORATED": "INC",
+}
+
+# Characters dropped within a word (O'HARE, ST.) and the other punctuation,
+# which separates words
+DROPPED = re.compile(r"['.`]")
+SEPARATORS = re.compile(r"[^A-Z0-9&]+")
+
+
+"""
+Normalized forms of the restaurant attributes the cleaning compares. They
+are computed once, when a restaurant is inserted, and stored next to the raw
+values in ri_restaurants (norm_name, norm_address, norm_city), so cleaning
+and blocking compare ready-made strings and the per pair work is only the
+similarity kernel. The DB registers the functions in SQLite too
+(normalize_name, ...) so inserts and migrations can use them.
+"""
+
+
+# helper function that upper cases text, drops its punctuation and replaces
+# every word found in words by its canonical form (None stays None)
+def canonical(text, words):
+    if text is None:
+        return None
+    text = DROPPED.sub("", text.upper()).replace("&", " & ")
+    tokens = SEPARATORS.sub(" ", text).split()
+    return " ".join(words.get(token, token) for token in tokens)
+
+
+def normalize_name(name):
+    '''
+    Normalized restaurant name, e.g. "Lou's Restaurant & Bar" gives
+    "LOUS REST AND BAR".
+    '''
+    return canonical(name, NAME_WORDS)
+
+
+def normalize_address(address):
+    '''
+    Normalized street address, e.g. "1234 North Clark Street." gives
+    "1234 N CLARK ST".
+    '''
+    return canonical(address, ADDRESS_WORDS)
+
+
+def normalize_city(city):
+    '''
+    Normalized city name (case and punctuation only).
+    '''
+    return canonical(city, {})
+
+
+# helper function that returns a copy of a record (dict) with its name,
+# address and city normalized
+def normalized(record):
+    record = dict(record)
+    record["name"] = normalize_name(record.get("name"))
+    record["address"] = normalize_address(record.get("address"))
+    record["city"] = normalize_city(record.get("city"))
+    return record
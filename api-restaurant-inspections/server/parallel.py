@@ -0,0 +1,166 @@
+import multiprocessing
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
+from blocking import tuned_strategy
+from scoring import THRESHOLD, WEIGHTS, score_pairs
+
+
+# Start method of the worker processes. The server forks them from request
+# threads, and a forked child can inherit a lock another thread held (the
+# logging or SQLite ones) and hang, so they are spawned instead
+MP_CONTEXT = multiprocessing.get_context("spawn")
+
+# Attributes of a record sent to the workers, in tuple order
+FIELDS = ("id", "name", "address", "city", "state", "clean")
+
+# Records per task of units sent to a worker (small blocks are sent together)
+TASK_RECORDS = 2000
+
+# Candidate pairs per scoring task sent to a worker
+TASK_PAIRS = 20000
+
+
+"""
+Parallel cleaning, in two rounds on a pool of worker processes. The units of
+work of the blocking passes (the blocks of a key pass, the chunks of the
+sorted neighbourhood) are independent, so the workers find their candidate
+pairs; the caller keeps the first unit that found each pair, as without
+workers, so a pair found by several passes is scored once. The workers then
+score the candidate pairs, task by task. Clustering and writing the clusters
+stay with the caller.
+"""
+
+
+# helper function that turns the records of a task into the tuples sent to a
+# worker, and back
+def to_rows(records, positions):
+    return [tuple(records[p][f] for f in FIELDS) for p in positions]
+
+def from_rows(rows):
+    return [dict(zip(FIELDS, row)) for row in rows]
+
+
+def find_pairs(units, threshold=THRESHOLD, weights=WEIGHTS):
+    '''
+    Worker side: finds the candidate pairs of each (pass name, record
+    tuples) unit with the threshold and weights. Returns, for every unit,
+    its pairs (positions in its records) and the seconds finding them took.
+    '''
+    found = []
+    for name, rows in units:
+        start = time.perf_counter()
+        records = from_rows(rows)
+        dirty = [not record["clean"] for record in records]
+        pairs = list(tuned_strategy(name, threshold, weights).unit_pairs(
+            records, dirty, list(range(len(records)))))
+        found.append((pairs, time.perf_counter() - start))
+    return found
+
+
+def score_task(rows, pairs, threshold=THRESHOLD, weights=WEIGHTS):
+    '''
+    Worker side: scores the (i, j) pairs of positions in the record tuples
+    like scoring.score_pairs. Returns the scores and the pairs the cascade
+    scorer rejected per attribute.
+    '''
+    rejected = Counter()
+    scores = score_pairs(from_rows(rows), pairs, weights, threshold, rejected)
+    return scores, rejected
+
+
+# helper function that starts a pool of workers processes (MP_CONTEXT), to
+# use in a with statement; with fewer than 2 workers there is no pool (None)
+def worker_pool(workers):
+    if workers < 2:
+        return nullcontext()
+    return ProcessPoolExecutor(max_workers=workers, mp_context=MP_CONTEXT)
+
+
+# helper function that lists the (pass name, unit) units of work of the
+# passes, in order
+def passes_units(records, strategies, threshold, weights):
+    dirty = [not record["clean"] for record in records]
+    units = []
+    for name in strategies:
+        strategy = tuned_strategy(name, threshold, weights)
+        units.extend((name, unit) for unit in strategy.units(records, dirty))
+    return units
+
+
+# helper function that groups units into tasks of about TASK_RECORDS records
+def unit_tasks(units):
+    task = []
+    task_records = 0
+    for name, unit in units:
+        task.append((name, unit))
+        task_records += len(unit)
+        if task_records >= TASK_RECORDS:
+            yield task
+            task = []
+            task_records = 0
+    if task:
+        yield task
+
+
+def unit_pairs(records, strategies, threshold=THRESHOLD, weights=WEIGHTS,
+               pool=None):
+    '''
+    Yields (pass name, unit, candidate pairs, seconds finding them) for
+    every unit of work of the blocking passes in strategies, in order, the
+    pairs being (i, j) positions in records with records[i] dirty. The
+    pairs are found on the workers of pool if one is given.
+    '''
+    units = passes_units(records, strategies, threshold, weights)
+    if pool is None:
+        dirty = [not record["clean"] for record in records]
+        for name, unit in units:
+            start = time.perf_counter()
+            strategy = tuned_strategy(name, threshold, weights)
+            pairs = list(strategy.unit_pairs(records, dirty, unit))
+            yield name, unit, pairs, time.perf_counter() - start
+        return
+    work = list(unit_tasks(units))
+    futures = [pool.submit(find_pairs,
+                           [(name, to_rows(records, unit))
+                            for name, unit in task], threshold, weights)
+               for task in work]
+    for task, future in zip(work, futures):
+        for (name, unit), (pairs, seconds) in zip(task, future.result()):
+            yield name, unit, [(unit[i], unit[j]) for i, j in pairs], seconds
+
+
+# helper function that cuts candidate pairs (positions in records) into
+# tasks of TASK_PAIRS pairs, each with the record tuples its pairs need and
+# its pairs as positions in them
+def pair_tasks(records, pairs):
+    for start in range(0, len(pairs), TASK_PAIRS):
+        local = {}
+        task_pairs = []
+        for i, j in pairs[start:start + TASK_PAIRS]:
+            task_pairs.append((local.setdefault(i, len(local)),
+                               local.setdefault(j, len(local))))
+        yield to_rows(records, local), task_pairs
+
+
+def task_scores(records, pairs, threshold=THRESHOLD, weights=WEIGHTS,
+                rejected=None, pool=None):
+    '''
+    Yields the scores of the candidate pairs (positions in records) task by
+    task, TASK_PAIRS pairs at a time, like scoring.score_pairs, computed on
+    the workers of pool if one is given. The rejections of the cascade
+    scorer are added to rejected (a Counter).
+    '''
+    if pool is None:
+        results = (score_task(rows, task_pairs, threshold, weights)
+                   for rows, task_pairs in pair_tasks(records, pairs))
+    else:
+        futures = [pool.submit(score_task, rows, task_pairs, threshold,
+                               weights)
+                   for rows, task_pairs in pair_tasks(records, pairs)]
+        results = (future.result() for future in futures)
+    for scores, task_rejected in results:
+        if rejected is not None:
+            rejected.update(task_rejected)
+        yield scores
@@ -0,0 +1,94 @@
+import queue
+import socketserver
+import sqlite3  # Our DB
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from werkzeug.serving import BaseWSGIServer
+
+
+# PRAGMAs applied to every pooled connection. In WAL mode synchronous=NORMAL
+# is still crash safe, it only skips the fsync of the log on every commit.
+DEFAULT_PRAGMAS = {
+    "synchronous": "NORMAL",
+    "cache_size": -16000,  # in KiB
+    "temp_store": "MEMORY",
+}
+
+
+"""
+Connections and serving for running the service on several threads.
+"""
+
+
+class ConnectionPool:
+    '''
+    Pool of SQLite connections for a multi-threaded server. A request thread
+    checks out its own read connection (at most `size` are open at once,
+    further threads wait for one to be released), so reads run in parallel
+    under WAL. All writes go through one writer connection that a thread has
+    to lock first, which keeps them serialized and keeps the transaction of
+    /txn, /commit and /abort on a single connection.
+    '''
+    def __init__(self, database, size, busy_timeout_ms=5000, pragmas=None):
+        self.database = database
+        self.size = size
+        self.busy_timeout = busy_timeout_ms / 1000.0
+        self.pragmas = DEFAULT_PRAGMAS if pragmas is None else pragmas
+        self.idle = queue.LifoQueue()
+        self.slots = threading.BoundedSemaphore(size)
+        self.write_lock = threading.RLock()
+        self.writer = self.connect()
+        # The journal mode is stored in the database file, set it once
+        self.writer.execute("PRAGMA journal_mode = WAL;")
+
+    def connect(self):
+        conn = sqlite3.connect(self.database, timeout=self.busy_timeout,
+                               check_same_thread=False)
+        for name, value in self.pragmas.items():
+            conn.execute("PRAGMA %s = %s;" % (name, value))
+        return conn
+
+    def acquire(self):
+        self.slots.acquire()
+        try:
+            return self.idle.get_nowait()
+        except queue.Empty:
+            return self.connect()
+
+    def release(self, conn):
+        self.idle.put(conn)
+        self.slots.release()
+
+    def acquire_writer(self):
+        self.write_lock.acquire()
+        return self.writer
+
+    def release_writer(self):
+        self.write_lock.release()
+
+    def writer_in_transaction(self):
+        '''
+        Whether the writer connection has a transaction open, read under the
+        write lock so a request that is writing finishes (and opens or ends
+        its transaction) first.
+        '''
+        with self.write_lock:
+            return self.writer.in_transaction
+
+
+class PooledWSGIServer(socketserver.ThreadingMixIn, BaseWSGIServer):
+    '''
+    Werkzeug server that handles requests on a fixed number of worker
+    threads instead of one new thread per request.
+    '''
+    # Seen by the app as wsgi.multithread, as with werkzeug's threaded server
+    multithread = True
+
+    def __init__(self, host, port, app, workers):
+        super().__init__(host, port, app)
+        self.executor = ThreadPoolExecutor(workers,
+                                           thread_name_prefix="worker")
+
+    def process_request(self, request, client_address):
+        self.executor.submit(self.process_request_thread, request,
+                             client_address)
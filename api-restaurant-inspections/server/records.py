@@ -0,0 +1,52 @@
+import sys
+
+
+"""
+Compact records for the cleaning. A clean reads up to the whole restaurant
+table, so each restaurant is kept as a Record with slots, holding only the
+attributes blocking and matching use, with their strings interned (the
+cities, states and repeated names of a table share one copy). Records are
+built straight from the cursor rows, without the intermediate dicts of
+to_json_list. They are not streamed: the blocking passes group records from
+all over the table, so a clean holds every record it reads at once, only
+in less memory. The incremental reads (DB.incremental_records) are what keep
+that list small.
+"""
+
+
+# helper function that interns a string (None stays None)
+def intern(text):
+    return sys.intern(text) if isinstance(text, str) else text
+
+
+class Record:
+    '''
+    A restaurant as the cleaning sees it. It reads like the dicts the
+    blocking passes and scorers used to get (record["name"],
+    record.get("zip")).
+    '''
+    __slots__ = ("id", "name", "address", "city", "state", "zip", "clean")
+
+    def __init__(self, id, name, address, city, state, zip, clean):
+        self.id = id
+        self.name = intern(name)
+        self.address = intern(address)
+        self.city = intern(city)
+        self.state = intern(state)
+        self.zip = intern(zip)
+        self.clean = clean
+
+    def __getitem__(self, key):
+        return getattr(self, key)
+
+    def get(self, key, default=None):
+        return getattr(self, key, default)
+
+
+def read_records(cursor):
+    '''
+    Returns the Records of a query selecting id, name, address, city,
+    state, zip and clean, in that order, as a list: one Record per cursor
+    row, all of them held at once.
+    '''
+    return [Record(*row) for row in cursor]
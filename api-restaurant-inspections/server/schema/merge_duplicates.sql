@@ -0,0 +1,63 @@
+-- Merges restaurants stored more than once under the same (name, address)
+-- into the lowest id, so that migration 0002 can build its UNIQUE index
+-- (databases cleaned by an older /clean hold primary records that copy the
+-- name and address of an original). Not a migration: it only runs when the
+-- server or the loader is started with --merge-duplicates. Every merged row
+-- is kept in ri_merged_restaurants, and every inspection it held in
+-- ri_merged_inspections, so a merge can be reviewed and undone. A NULL
+-- address never conflicts in the index, so those rows are left alone.
+CREATE TABLE IF NOT EXISTS ri_merged_restaurants (
+    id int PRIMARY KEY,
+    kept_id int NOT NULL,
+    name varchar(60) NOT NULL,
+    facility_type varchar(30),
+    address varchar(60),
+    city varchar(30),
+    state char(2),
+    zip char(5),
+    latitude real,
+    longitude real,
+    clean boolean,
+    merged_at datetime DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS ri_merged_inspections (
+    inspection_id varchar(16) PRIMARY KEY,
+    restaurant_id int NOT NULL
+);
+
+CREATE TEMP TABLE dup_rest AS
+    SELECT r.id AS id, k.keep_id AS keep_id
+    FROM ri_restaurants AS r JOIN (
+        SELECT name, address, MIN(id) AS keep_id FROM ri_restaurants
+        WHERE address IS NOT NULL GROUP BY name, address HAVING COUNT(*) > 1
+    ) AS k ON r.name = k.name AND r.address = k.address
+    WHERE r.id <> k.keep_id;
+
+INSERT INTO ri_merged_restaurants (id, kept_id, name, facility_type,
+        address, city, state, zip, latitude, longitude, clean)
+    SELECT r.id, d.keep_id, r.name, r.facility_type, r.address, r.city,
+        r.state, r.zip, r.latitude, r.longitude, r.clean
+    FROM ri_restaurants AS r JOIN dup_rest AS d ON r.id = d.id;
+INSERT INTO ri_merged_inspections (inspection_id, restaurant_id)
+    SELECT id, restaurant_id FROM ri_inspections
+    WHERE restaurant_id IN (SELECT id FROM dup_rest);
+
+-- Inspections, tweets and links move to the kept id, so a primary that
+-- copied an original becomes that original, linked to itself
+UPDATE ri_inspections SET restaurant_id =
+    (SELECT keep_id FROM dup_rest WHERE dup_rest.id = restaurant_id)
+    WHERE restaurant_id IN (SELECT id FROM dup_rest);
+UPDATE ri_tweetmatch SET restaurant_id =
+    (SELECT keep_id FROM dup_rest WHERE dup_rest.id = restaurant_id)
+    WHERE restaurant_id IN (SELECT id FROM dup_rest);
+UPDATE OR IGNORE ri_linked SET primary_rest_id =
+    (SELECT keep_id FROM dup_rest WHERE dup_rest.id = primary_rest_id)
+    WHERE primary_rest_id IN (SELECT id FROM dup_rest);
+UPDATE OR IGNORE ri_linked SET original_rest_id =
+    (SELECT keep_id FROM dup_rest WHERE dup_rest.id = original_rest_id)
+    WHERE original_rest_id IN (SELECT id FROM dup_rest);
+DELETE FROM ri_linked WHERE primary_rest_id IN (SELECT id FROM dup_rest)
+    OR original_rest_id IN (SELECT id FROM dup_rest);
+DELETE FROM ri_restaurants WHERE id IN (SELECT id FROM dup_rest);
+DROP TABLE dup_rest;
@@ -0,0 +1,27 @@
+-- The UNIQUE (name, address) index cannot be built over restaurants stored
+-- twice (e.g. primary records an older /clean copied from an original).
+-- DB.migrate refuses this script while there are any and lists them; see
+-- schema/merge_duplicates.sql to merge them first.
+
+-- Restaurant lookups by (name, address) when loading inspections
+CREATE UNIQUE INDEX IF NOT EXISTS ri_restaurants_name_address
+    ON ri_restaurants (name, address);
+-- Blocking on zip when cleaning
+CREATE INDEX IF NOT EXISTS ri_restaurants_zip ON ri_restaurants (zip);
+-- Dirty records picked up by /clean
+CREATE INDEX IF NOT EXISTS ri_restaurants_dirty ON ri_restaurants (id)
+    WHERE clean = 0;
+-- Tweet matching by name and by location
+CREATE INDEX IF NOT EXISTS ri_restaurants_lower_name
+    ON ri_restaurants (LOWER(name));
+CREATE INDEX IF NOT EXISTS ri_restaurants_location
+    ON ri_restaurants (latitude, longitude);
+-- Inspections of a restaurant (find_inspections, re-pointing in clean_up)
+CREATE INDEX IF NOT EXISTS ri_inspections_restaurant_id
+    ON ri_inspections (restaurant_id);
+-- Tweets of a restaurant
+CREATE INDEX IF NOT EXISTS ri_tweetmatch_restaurant_id
+    ON ri_tweetmatch (restaurant_id);
+-- Primary record of a linked restaurant
+CREATE INDEX IF NOT EXISTS ri_linked_original_rest_id
+    ON ri_linked (original_rest_id);
@@ -0,0 +1,16 @@
+-- Blocking keys of every restaurant, one row per blocking pass (see
+-- blocking.block_keys), kept up to date as restaurants are inserted so a
+-- /clean only has to look at the dirty records and the records sharing a
+-- key with them. The keys of the restaurants already in the database are
+-- filled in by the next /clean (DB.index_block_keys).
+CREATE TABLE IF NOT EXISTS ri_block_keys (
+    restaurant_id int NOT NULL,
+    pass varchar(10) NOT NULL,
+    key varchar(60) NOT NULL,
+    PRIMARY KEY (pass, key, restaurant_id),
+    FOREIGN KEY (restaurant_id) REFERENCES ri_restaurants
+);
+
+-- Keys of a restaurant (the dirty ones looked up by /clean)
+CREATE INDEX IF NOT EXISTS ri_block_keys_restaurant_id
+    ON ri_block_keys (restaurant_id);
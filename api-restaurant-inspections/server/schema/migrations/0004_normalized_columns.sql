@@ -0,0 +1,15 @@
+-- Normalized name, address and city of every restaurant (see normalize.py),
+-- which the cleaning and the blocking compare instead of the raw values.
+-- normalize_name, normalize_address and normalize_city are registered on
+-- the connection by the DB.
+ALTER TABLE ri_restaurants ADD COLUMN norm_name varchar(60);
+ALTER TABLE ri_restaurants ADD COLUMN norm_address varchar(60);
+ALTER TABLE ri_restaurants ADD COLUMN norm_city varchar(30);
+
+UPDATE ri_restaurants SET norm_name = normalize_name(name),
+    norm_address = normalize_address(address),
+    norm_city = normalize_city(city);
+
+-- Blocking keys are now computed from the normalized values; the next
+-- /clean rebuilds them
+DELETE FROM ri_block_keys;
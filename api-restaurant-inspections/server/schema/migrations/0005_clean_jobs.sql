@@ -0,0 +1,30 @@
+-- Background cleans (/clean/start). A job matches the restaurants with an
+-- id up to max_rest_id, in tasks of candidate pairs; plan identifies the
+-- tasks so a resumed job knows whether its checkpoints still apply.
+CREATE TABLE IF NOT EXISTS ri_clean_jobs (
+    id integer PRIMARY KEY AUTOINCREMENT,
+    status varchar(10) NOT NULL CHECK( status IN ('running','done','failed')),
+    blocking varchar(60) NOT NULL,
+    max_rest_id int NOT NULL,
+    plan int,
+    tasks_total int,
+    tasks_done int NOT NULL DEFAULT 0,
+    blocks_total int,
+    blocks_done int NOT NULL DEFAULT 0,
+    pairs_scored int NOT NULL DEFAULT 0,
+    seconds real NOT NULL DEFAULT 0,
+    started_at datetime NOT NULL,
+    finished_at datetime,
+    error text
+);
+
+-- Matched pairs of the tasks a job has checkpointed
+CREATE TABLE IF NOT EXISTS ri_clean_matches (
+    job_id int NOT NULL,
+    rest_id int NOT NULL,
+    other_id int NOT NULL,
+    FOREIGN KEY (job_id) REFERENCES ri_clean_jobs
+);
+
+CREATE INDEX IF NOT EXISTS ri_clean_matches_job_id
+    ON ri_clean_matches (job_id);
@@ -6,7 +6,10 @@ INSERT INTO ri_restaurants (
     state,
     zip,
     latitude,
-    longitude
+    longitude,
+    norm_name,
+    norm_address,
+    norm_city
 ) VALUES (
     'DAMEN DINING',
     'Restaurant',
@@ -15,7 +18,10 @@ INSERT INTO ri_restaurants (
     'IL',
     '60613',
     41.94915225433,
-    -87.6544465886
+    -87.6544465886,
+    normalize_name('DAMEN DINING'),
+    normalize_address('1000-1010 W WAVELAND AVE'),
+    normalize_city('CHICAGO')
 );
 
 INSERT INTO ri_inspections (
@@ -0,0 +1,405 @@
+from collections import Counter
+from cache import LRUCache
+
+
+# Attribute weights of the similarity score, as in DB.find_similarity
+WEIGHTS = {"name": 0.45, "address": 0.4, "city": 0.09, "state": 0.06}
+
+# Score from which two records match, as in DB.clean_up
+THRESHOLD = 0.8
+
+# Attributes in the order the cascade scorer compares them, cheapest first
+CASCADE = ["state", "address", "city", "name"]
+
+# Attribute similarities kept between blocks and cleans, keyed on (kernel
+# name, value, value), at most this many
+SIMILARITY_CACHE_SIZE = 200000
+
+# Kernels whose results are cached (Jaccard over prepared character counts
+# costs about as much as a cache lookup)
+CACHED = {"jaro_winkler", "levenshtein"}
+
+# Kernels whose result does not depend on the order of the values, cached
+# once per unordered pair
+SYMMETRIC = {"levenshtein"}
+
+
+"""
+Batch similarity scoring for the cleaning. score_rows scores a whole block
+of records row by row (score_matrix as a list), score_pairs a list of
+candidate pairs. Both give the same scores as DB.find_similarity
+(JaroWinkler for names, character Jaccard for addresses, normalized
+Levenshtein for cities and equality for states), bit for bit.
+
+The values of each attribute are encoded once per block: every distinct
+value gets an integer code, and the per value preparation (e.g. the
+character counts Jaccard needs) is done once per code instead of once per
+pair. Attribute similarities are then computed once per pair of distinct
+codes and looked up for every other record pair sharing them, which in
+dirty data (repeated cities, states and duplicate names) is most of them.
+
+Name and city similarities of distinct values are also kept in
+SIMILARITY_CACHE, a bounded LRU shared by all the blocks and cleans of the
+process, so the values chains and duplicate rows repeat are only compared
+once.
+
+Given a threshold, a CascadeScorer compares the attributes cheapest first and
+stops at the first one after which the pair can no longer reach it, so most
+non matching pairs never get their names compared.
+"""
+
+
+def jaro_winkler(s0, s1, threshold=0.7, jw_coef=0.1):
+    '''
+    Same result as similarity.jarowinkler.JaroWinkler().similarity(s0, s1),
+    including its unbounded common prefix. A missing value (None) counts as
+    empty.
+    '''
+    s0 = s0 or ""
+    s1 = s1 or ""
+    if s0 == s1:
+        return 1.0
+    if len(s0) > len(s1):
+        max_str, min_str = s0, s1
+    else:
+        max_str, min_str = s1, s0
+    len_max = len(max_str)
+    ran = int(max(len_max / 2 - 1, 0))
+    match_flags = [False] * len_max
+    min_matched = []
+    for mi, c1 in enumerate(min_str):
+        # First unmatched c1 of max_str within ran of mi
+        end = mi + ran + 1
+        xi = max_str.find(c1, mi - ran if mi > ran else 0, end)
+        while xi != -1 and match_flags[xi]:
+            xi = max_str.find(c1, xi + 1, end)
+        if xi != -1:
+            match_flags[xi] = True
+            min_matched.append(c1)
+    m = len(min_matched)
+    if m == 0:
+        return 0.0
+    max_matched = [c for c, flag in zip(max_str, match_flags) if flag]
+    transpositions = sum(1 for a, b in zip(min_matched, max_matched)
+                         if a != b) // 2
+    prefix = 0
+    for a, b in zip(s0, s1):
+        if a != b:
+            break
+        prefix += 1
+    j = (m / len(s0) + m / len(s1) + (m - transpositions) / m) / 3
+    if j > threshold:
+        return j + min(jw_coef, 1.0 / len_max) * prefix * (1 - j)
+    return j
+
+
+def jaccard(a, b, count_a, count_b):
+    '''
+    Same result as textdistance.jaccard.normalized_similarity(a, b), given
+    the character counts (Counter) of both strings.
+    '''
+    if a == b:
+        return 1
+    if not a or not b:
+        return 0
+    if len(count_a) > len(count_b):
+        count_a, count_b = count_b, count_a
+    intersection = 0
+    for char, n in count_a.items():
+        other = count_b.get(char)
+        if other:
+            intersection += n if n < other else other
+    union = len(a) + len(b) - intersection
+    return 1 - (1 - intersection / union)
+
+
+def levenshtein(a, b):
+    '''
+    Same result as textdistance.levenshtein.normalized_similarity(a, b). A
+    missing value (None) counts as empty.
+    '''
+    a = a or ""
+    b = b or ""
+    maximum = max(len(a), len(b))
+    if maximum == 0:
+        return 1
+    if a == b:
+        return 1 - 0 / maximum
+    if not a or not b:
+        return 1 - maximum / maximum
+    prev = list(range(len(b) + 1))
+    for r, char_a in enumerate(a, 1):
+        cur = [r]
+        for c, char_b in enumerate(b, 1):
+            cur.append(min(prev[c - 1] + (char_a != char_b), prev[c] + 1,
+                           cur[c - 1] + 1))
+        prev = cur
+    return 1 - prev[-1] / maximum
+
+
+# helper function that returns the lowest similarity of attr with which a pair
+# can still reach threshold (all the other attributes being equal); any
+# similarity does if attr weighs nothing
+def min_similarity(attr, threshold=THRESHOLD, weights=WEIGHTS):
+    if not weights[attr]:
+        return 0.0
+    others = sum(w for a, w in weights.items() if a != attr)
+    return (threshold - others) / weights[attr]
+
+
+# helper function that bounds JaroWinkler from above knowing only the lengths
+# of the two names (all characters matching, none transposed, the shorter
+# name a prefix of the longer one)
+def jaro_winkler_bound(len0, len1):
+    if len0 == 0 or len1 == 0:
+        return 1.0 if len0 == len1 else 0.0
+    shorter, longer = min(len0, len1), max(len0, len1)
+    j = (shorter / len0 + shorter / len1 + 1) / 3
+    return j + min(0.1, 1.0 / longer) * shorter * (1 - j)
+
+
+class Encoding:
+    '''
+    The distinct values of one attribute over a block: values[code] is the
+    value and codes[i] the code of the i-th record.
+    '''
+    def __init__(self, records, attr):
+        index = {}
+        self.values = []
+        self.codes = []
+        for record in records:
+            value = record[attr]
+            code = index.get(value)
+            if code is None:
+                code = index[value] = len(self.values)
+                self.values.append(value)
+            self.codes.append(code)
+
+
+SIMILARITY_CACHE = LRUCache(SIMILARITY_CACHE_SIZE)
+
+
+class PairTable:
+    '''
+    Similarity of pairs of codes of two encodings, computed on first use
+    (or taken from SIMILARITY_CACHE).
+    '''
+    def __init__(self, left, right, sim, prepare=None):
+        self.left = left.values
+        self.right = right.values
+        self.sim = sim
+        self.cached = sim.__name__ in CACHED
+        self.symmetric = sim.__name__ in SYMMETRIC
+        self.prepared_left = None
+        self.prepared_right = None
+        if prepare is not None:
+            self.prepared_left = [prepare(v) for v in self.left]
+            self.prepared_right = (self.prepared_left if right is left
+                                   else [prepare(v) for v in self.right])
+        self.table = {}
+
+    def get(self, i, j):
+        key = (i, j)
+        score = self.table.get(key)
+        if score is None:
+            a = self.left[i]
+            b = self.right[j]
+            # Missing values (None) and equal ones are not worth caching
+            cache_key = None
+            if self.cached and a is not None and b is not None and a != b:
+                if self.symmetric and b < a:
+                    cache_key = (self.sim.__name__, b, a)
+                else:
+                    cache_key = (self.sim.__name__, a, b)
+                score = SIMILARITY_CACHE.get(cache_key)
+            if score is None:
+                if self.prepared_left is None:
+                    score = self.sim(a, b)
+                else:
+                    score = self.sim(a, b, self.prepared_left[i],
+                                     self.prepared_right[j])
+                if cache_key is not None:
+                    SIMILARITY_CACHE.put(cache_key, score)
+            self.table[key] = score
+        return score
+
+
+# helper function that counts the characters of an address (None is kept
+# apart from "", as textdistance does)
+def char_counts(value):
+    return Counter(value) if value else Counter()
+
+
+class BlockScorer:
+    '''
+    Scores records of left against records of right (by position), with
+    the values of both encoded once.
+    '''
+    def __init__(self, left, right, weights=WEIGHTS):
+        encodings = {}
+        for attr in ["name", "address", "city"]:
+            left_codes = Encoding(left, attr)
+            right_codes = (left_codes if right is left
+                           else Encoding(right, attr))
+            encodings[attr] = (left_codes, right_codes)
+        self.names = PairTable(*encodings["name"], jaro_winkler)
+        self.addresses = PairTable(*encodings["address"], jaccard,
+                                   char_counts)
+        self.cities = PairTable(*encodings["city"], levenshtein)
+        self.left_codes = [encodings[attr][0].codes
+                           for attr in ["name", "address", "city"]]
+        self.right_codes = [encodings[attr][1].codes
+                            for attr in ["name", "address", "city"]]
+        self.left_states = [r["state"] for r in left]
+        self.right_states = [r["state"] for r in right]
+        self.left_ids = [r["id"] for r in left]
+        self.right_ids = [r["id"] for r in right]
+        self.weights = weights
+
+    def score(self, d, a):
+        '''
+        Weighted score of left[d] against right[a], None if both are the same
+        restaurant (like find_similarity).
+        '''
+        if self.left_ids[d] == self.right_ids[a]:
+            return None
+        weights = self.weights
+        d_name, d_address, d_city = (codes[d] for codes in self.left_codes)
+        a_name, a_address, a_city = (codes[a] for codes in self.right_codes)
+        name_score = self.names.get(d_name, a_name) * weights["name"]
+        address_score = (self.addresses.get(d_address, a_address)
+                         * weights["address"])
+        city_score = self.cities.get(d_city, a_city) * weights["city"]
+        state_score = (1.0 if self.left_states[d] == self.right_states[a]
+                       else 0.0) * weights["state"]
+        return name_score + address_score + city_score + state_score
+
+    def row(self, d):
+        '''
+        Scores of left[d] against every record of right.
+        '''
+        names = self.names
+        addresses = self.addresses
+        cities = self.cities
+        name_w = self.weights["name"]
+        address_w = self.weights["address"]
+        city_w = self.weights["city"]
+        state_w = self.weights["state"]
+        name_codes, address_codes, city_codes = self.right_codes
+        a_states = self.right_states
+        d_id = self.left_ids[d]
+        d_name, d_address, d_city = (codes[d] for codes in self.left_codes)
+        d_state = self.left_states[d]
+        row = []
+        for a, a_id in enumerate(self.right_ids):
+            if a_id == d_id:  # Don't match a restaurant to itself
+                row.append(None)
+                continue
+            name_score = names.get(d_name, name_codes[a]) * name_w
+            address_score = (addresses.get(d_address, address_codes[a])
+                             * address_w)
+            city_score = cities.get(d_city, city_codes[a]) * city_w
+            state_score = (1.0 if d_state == a_states[a] else 0.0) * state_w
+            row.append(name_score + address_score + city_score + state_score)
+        return row
+
+
+class CascadeScorer(BlockScorer):
+    '''
+    BlockScorer that compares the attributes in CASCADE order, keeping the
+    best score the pair can still reach, and stops as soon as it falls under
+    threshold. Scores that reach threshold are exact, the others are only
+    that bound. rejected counts the pairs stopped after each attribute.
+    '''
+    def __init__(self, left, right, weights=WEIGHTS, threshold=THRESHOLD):
+        super().__init__(left, right, weights)
+        self.threshold = threshold
+        self.rejected = dict.fromkeys(CASCADE, 0)
+
+    def score(self, d, a):
+        if self.left_ids[d] == self.right_ids[a]:
+            return None
+        weights = self.weights
+        threshold = self.threshold - 1e-9
+        d_name, d_address, d_city = (codes[d] for codes in self.left_codes)
+        a_name, a_address, a_city = (codes[a] for codes in self.right_codes)
+        # (1) States, a comparison
+        state_score = (1.0 if self.left_states[d] == self.right_states[a]
+                       else 0.0) * weights["state"]
+        best = (state_score + weights["address"] + weights["city"]
+                + weights["name"])
+        if best < threshold:
+            self.rejected["state"] += 1
+            return best
+        # (2) Addresses, which weigh the most
+        address_score = (self.addresses.get(d_address, a_address)
+                         * weights["address"])
+        best += address_score - weights["address"]
+        if best < threshold:
+            self.rejected["address"] += 1
+            return best
+        # (3) Cities, short and mostly repeated
+        city_score = self.cities.get(d_city, a_city) * weights["city"]
+        best += city_score - weights["city"]
+        if best < threshold:
+            self.rejected["city"] += 1
+            return best
+        # (4) Names, the most expensive
+        name_score = self.names.get(d_name, a_name) * weights["name"]
+        score = name_score + address_score + city_score + state_score
+        if score < threshold:
+            self.rejected["name"] += 1
+        return score
+
+    def row(self, d):
+        return [self.score(d, a) for a in range(len(self.right_ids))]
+
+
+# helper function that returns the scorer of a block: a CascadeScorer if a
+# threshold is given
+def block_scorer(left, right, weights, threshold):
+    if threshold is None:
+        return BlockScorer(left, right, weights)
+    return CascadeScorer(left, right, weights, threshold)
+
+
+# helper function that adds the rejections of a scorer to a Counter
+def count_rejected(scorer, rejected):
+    if rejected is not None and isinstance(scorer, CascadeScorer):
+        rejected.update(scorer.rejected)
+
+
+def score_rows(dirty, records, weights=WEIGHTS, threshold=None,
+               rejected=None):
+    '''
+    Scores every dirty record against every record of the block. Yields one
+    row per dirty record holding the weighted score against each record
+    (None where both are the same restaurant, like find_similarity). With a
+    threshold the scores come from a CascadeScorer, whose rejections per
+    attribute are added to rejected (a Counter) once every row is yielded.
+    '''
+    scorer = block_scorer(dirty, records, weights, threshold)
+    for d in range(len(dirty)):
+        yield scorer.row(d)
+    count_rejected(scorer, rejected)
+
+
+def score_matrix(dirty, records, weights=WEIGHTS, threshold=None,
+                 rejected=None):
+    '''
+    The rows of score_rows, as a list.
+    '''
+    return list(score_rows(dirty, records, weights, threshold, rejected))
+
+
+def score_pairs(records, pairs, weights=WEIGHTS, threshold=None,
+                rejected=None):
+    '''
+    Scores the given (i, j) pairs of positions in records, record i being
+    the dirty one. Returns the scores in the order of pairs. threshold and
+    rejected are as in score_rows.
+    '''
+    scorer = block_scorer(records, records, weights, threshold)
+    scores = [scorer.score(i, j) for i, j in pairs]
+    count_rejected(scorer, rejected)
+    return scores
@@ -4,9 +4,19 @@ import requests  # Used for web/html wrapper
 import argparse  # Used for getting arguments for creating server
 import sqlite3  # Our DB
 import logging  # Logging Library
-from db import DB  # our custom data access layer
-from errors import KeyNotFound, BadRequest, InvalidUsage # Custom Error types
+import sys  # Exit when the database cannot be migrated
+from db import DB, split_inspection, valid_inspection  # our custom data access layer
+from errors import KeyNotFound, BadRequest, InvalidUsage, InspError # Custom Error types
+from cache import RestaurantCache # (name, address) -> restaurant id cache
 import string  # for ngram generation
+from writer import GroupCommitWriter # background group commit
+from pool import ConnectionPool, PooledWSGIServer # multi-threaded serving
+from sessions import SessionManager # per-client transactions
+from blocking import DEFAULT_STRATEGIES, MULTI_PASS_STRATEGIES, parse_strategies # /clean blocking
+from scoring import SIMILARITY_CACHE, THRESHOLD, WEIGHTS # cleaning scores
+from jobs import CleanJobs # background /clean
+from werkzeug.exceptions import BadRequest as MalformedRequest
+from werkzeug.serving import is_running_from_reloader
 
 
 # Configure application
@@ -23,22 +33,162 @@ app.config["TRANS_SIZE"] = 1
 # Counter variable to keep track of the number of times inspection is called
 app.config["INSP_COUNTER"] = 0
 
+# Group commit for /inspections: commit every GROUP_COMMIT records or
+# GROUP_COMMIT_MS milliseconds, whichever comes first (0 disables it)
+app.config["GROUP_COMMIT"] = 0
+app.config["GROUP_COMMIT_MS"] = 50
+
+# Whether requests are served on several threads (through a ConnectionPool)
+app.config["THREADED"] = False
+
+# Connection pool settings used when THREADED
+app.config["DB_POOL_SIZE"] = 8
+app.config["DB_BUSY_TIMEOUT_MS"] = 5000
+
+# Seconds after which an unused transaction session (POST /txn) expires
+app.config["TXN_SESSION_TTL"] = 600
+
+# Maximum number of (name, address) -> restaurant id entries kept in memory
+app.config["REST_CACHE_SIZE"] = 100000
+
+# Blocking passes of /clean when scaling (-s) is on, see blocking.py
+app.config["BLOCKING"] = DEFAULT_STRATEGIES
+
+# Worker processes matching the blocks of /clean (0 to match them in the
+# request thread)
+app.config["CLEAN_WORKERS"] = 0
+
+# Seconds a background clean waits for the write lock before failing (a
+# /txn transaction can hold it for a while)
+app.config["CLEAN_JOB_BUSY_TIMEOUT"] = 60
+
 # Needed to flash messages
 app.secret_key = b'mEw6%7BPK'
 
 # path to database
 DATABASE = 'insp.db'
 
+# Content types accepted as newline-delimited JSON by /inspections/batch
+NDJSON_MIMETYPES = ["application/x-ndjson", "application/jsonl"]
+
 def get_db_conn():
     """ 
-    gets connection to database
+    gets connection to database. When serving on several threads this is
+    the pool's writer connection, locked until the end of the request.
     """
+    if "_pool" in app.config:
+        if "write_conn" not in g:
+            g.write_conn = app.config["_pool"].acquire_writer()
+        return g.write_conn
     if "_database" not in app.config:
         app.config["_database"] = sqlite3.connect(DATABASE)
         return app.config["_database"] 
     else:
         return app.config["_database"] 
 
+
+def get_rest_cache():
+    """
+    gets the restaurant id cache shared between requests
+    """
+    if "_rest_cache" not in app.config:
+        app.config["_rest_cache"] = RestaurantCache(
+            app.config["REST_CACHE_SIZE"])
+    return app.config["_rest_cache"]
+
+
+def get_db():
+    """
+    gets the data access layer over the database connection
+    """
+    return DB(get_db_conn(), get_rest_cache())
+
+
+def get_read_db():
+    """
+    gets the data access layer for requests that only read. When serving on
+    several threads it uses a pooled connection of the request's own, so
+    reads do not wait for writes. While a /txn transaction is open on the
+    writer, reads go through it to see its uncommitted rows, as they would
+    on a single connection.
+    """
+    if ("_pool" not in app.config
+            or app.config["_pool"].writer_in_transaction()):
+        return get_db()
+    if "read_conn" not in g:
+        g.read_conn = app.config["_pool"].acquire()
+    return DB(g.read_conn, get_rest_cache())
+
+
+def get_sessions():
+    """
+    gets the manager of the per-client transaction sessions
+    """
+    if "_sessions" not in app.config:
+        if "_pool" in app.config:
+            connect = app.config["_pool"].connect
+        else:
+            connect = lambda: sqlite3.connect(DATABASE,
+                                              check_same_thread=False)
+        app.config["_sessions"] = SessionManager(
+            connect, app.config["TXN_SESSION_TTL"], get_rest_cache())
+    return app.config["_sessions"]
+
+
+def get_clean_jobs():
+    """
+    gets the runner of the background cleans
+    """
+    if "_clean_jobs" not in app.config:
+        timeout = app.config["CLEAN_JOB_BUSY_TIMEOUT"]
+        connect = lambda: sqlite3.connect(DATABASE, timeout=timeout,
+                                          check_same_thread=False)
+        app.config["_clean_jobs"] = CleanJobs(connect,
+                                              app.config["CLEAN_WORKERS"])
+    return app.config["_clean_jobs"]
+
+
+def find_txn_session(txn_id):
+    """
+    gets an open transaction session, answering 404 when there is none
+    """
+    try:
+        return get_sessions().get(txn_id)
+    except KeyError as e:
+        logging.error(e)
+        raise InvalidUsage(message=str(e), status_code=404)
+
+
+def json_object_body():
+    """
+    gets the JSON object posted as the request body, {} when the request has
+    no body. A body that is not JSON, or not an object, is answered with 400
+    """
+    if not request.get_data(cache=True):
+        return {}
+    try:
+        body = request.get_json(force=True)
+    except MalformedRequest as e:
+        logging.error("Malformed JSON body %s" % e)
+        raise InvalidUsage(message="body must be a JSON object")
+    if not isinstance(body, dict):
+        raise InvalidUsage(message="body must be a JSON object")
+    return body
+
+
+@app.teardown_appcontext
+def release_db_conn(exception):
+    """
+    hands the request's connections back to the pool
+    """
+    if "_pool" not in app.config:
+        return
+    read_conn = g.pop("read_conn", None)
+    if read_conn is not None:
+        app.config["_pool"].release(read_conn)
+    if g.pop("write_conn", None) is not None:
+        app.config["_pool"].release_writer()
+
 # default path
 @app.route('/')
 def home():
@@ -53,13 +203,13 @@ def hello():
 @app.route("/reset", methods=["GET"])
 def create():
     logging.debug("Running Create/Reset")
-    db = DB(get_db_conn())
+    db = get_db()
     db.create_script()
     return {"message": "created"}
 
 @app.route("/seed", methods=["GET"])
 def seed():
-    db = DB(get_db_conn())
+    db = get_db()
     db.seed_data()
     return {"message": "seeded"}
 
@@ -70,7 +220,7 @@ def find_restaurant(restaurant_id):
     Returns a restaurant and all of its associated inspections.
     """
     logging.info('Find restaurant request received')
-    db = DB(get_db_conn())
+    db = get_read_db()
 
     try:
         restaurant = db.find_restaurant(restaurant_id)[0]
@@ -88,7 +238,7 @@ def find_restaurant_by_inspection_id(inspection_id):
     Returns a restaurant associated with a given inspection.
     """
     logging.info('Find restaurant by inspection request received')
-    db = DB(get_db_conn())
+    db = get_read_db()
 
     try:
         res = db.find_rest_by_inspection(inspection_id)
@@ -112,6 +262,30 @@ def load_inspection():
         logging.error("No post body")
         return Response(status=400)
 
+    # Inspection tagged with a transaction session: only stage it there
+    txn_id = request.headers.get("X-Txn-Id") or request.args.get("txn")
+    if txn_id:
+        return stage_inspection(txn_id, postbody)
+
+    # Group commit: hand the record to the writer and answer once its group
+    # has been committed
+    if "_writer" in app.config:
+        # Checked before it is queued, as a record is before it is inserted
+        if not valid_inspection(postbody):
+            logging.info('Bad request with required attributes missing')
+            return Response(status=400)
+        inspection, restaurant = split_inspection(postbody)
+        try:
+            future = app.config["_writer"].submit(inspection, restaurant)
+            resp = future.result()
+            return {"restaurant_id": resp[0]}, resp[1]
+        except Exception as e:
+            logging.info('Inspection rejected %s' % e)
+            return Response(status=400)
+
+    # Get the (locked) connection first so the counter is not raced on
+    db = get_db()
+
     # Increment the inspection counter 
     app.config["INSP_COUNTER"] += 1
 
@@ -120,16 +294,8 @@ def load_inspection():
         logging.info('Bad request with required attributes missing')
         raise BadRequest(message=str(e), status_code=400) 
 
-    rest_keys = ["name", "facility_type", "address", "city", "state", "zip",
-                 "latitude", "longitude", "clean"]
-    restaurant = {key:value for key, value in postbody.items()
-                  if key in rest_keys}
-    insp_keys = ["inspection_id", "risk", "date", "inspection_type",
-                 "results", "violations", "restaurant_id"]
-    inspection = {key:value for key, value in postbody.items()
-                  if key in insp_keys}
+    inspection, restaurant = split_inspection(postbody)
 
-    db = DB(get_db_conn())
     try:
         resp = db.add_inspection_for_restaurant(inspection, restaurant)
         if app.config["INSP_COUNTER"] == app.config["TRANS_SIZE"]:
@@ -142,19 +308,101 @@ def load_inspection():
         return Response(status=400)
 
 
+@app.route("/inspections/batch", methods=["POST"])
+def load_inspections_batch():
+    """
+    Loads a batch of inspections (and possibly new restaurants) in a single
+    transaction. The body is either a JSON array of inspection records or an
+    NDJSON stream with one record per line. Returns the restaurant id and
+    status of every record, in order; invalid records get a 400 status and
+    inspections already loaded (or repeated in the batch) a 409 status, and
+    both are skipped.
+    """
+    try:
+        if request.mimetype in NDJSON_MIMETYPES:
+            postbody = [json.loads(line) for line in request.stream
+                        if line.strip()]
+        else:
+            postbody = request.get_json(silent=True)
+    except ValueError as e:
+        logging.error("Malformed NDJSON body %s" % e)
+        return Response(status=400)
+
+    if not postbody or not isinstance(postbody, list):
+        logging.error("No post body")
+        return Response(status=400)
+
+    # Keep track of where every valid record goes in the response
+    results = [None] * len(postbody)
+    records = []
+    positions = []
+    for pos, record in enumerate(postbody):
+        if not valid_inspection(record):
+            inspection_id = record.get("inspection_id") \
+                if isinstance(record, dict) else None
+            results[pos] = {"inspection_id": inspection_id, "status": 400}
+            continue
+        records.append(split_inspection(record))
+        positions.append(pos)
+
+    db = get_db()
+    try:
+        resp = db.add_inspections_batch(records) if records else []
+        commit_txn()
+        logging.info("Committed batch of %s inspections" % len(records))
+    except Exception as e:
+        abort_txn()
+        logging.info('Batch transaction aborted %s' % e)
+        return Response(status=400)
+
+    for pos, (inspection, _), (rest_id, status) in zip(positions, records,
+                                                        resp):
+        results[pos] = {"inspection_id": inspection["inspection_id"],
+                        "status": status}
+        if rest_id is not None:
+            results[pos]["restaurant_id"] = rest_id
+    return jsonify(results), 200
+
+
+def stage_inspection(txn_id, postbody):
+    """
+    Stages a posted inspection in a transaction session. Nothing is written
+    until the session commits, hence the 202.
+    """
+    txn = find_txn_session(txn_id)
+    if not valid_inspection(postbody):
+        logging.info('Bad request with required attributes missing')
+        return Response(status=400)
+    inspection, restaurant = split_inspection(postbody)
+    try:
+        committed = txn.stage(inspection, restaurant)
+    except Exception as e:
+        logging.info('Transaction %s failed to commit %s' % (txn_id, e))
+        return Response(status=400)
+    resp = {"txn_id": txn.id, "staged": len(txn.staged)}
+    if committed is not None:
+        resp["committed"] = len(committed)
+    return resp, 202
+
+
 @app.route("/txn/<int:txnsize>", methods=["GET"])
 def set_transaction_size(txnsize):
     # TODO milestone 2
     commit_txn()
     app.config["TRANS_SIZE"] = txnsize
+    # With group commit the size bounds the writer's groups instead
+    if "_writer" in app.config:
+        app.config["_writer"].max_records = txnsize
     return "Transaction size set"
 
 
 @app.route("/commit")
 def commit_txn():
     logging.info("Committing active transactions")
-    db = DB(get_db_conn())
-    db.conn.commit()
+    if "_writer" in app.config:
+        app.config["_writer"].flush()
+    db = get_db()
+    db.commit()
     app.config["INSP_COUNTER"] = 0 
     return "Active transactions, if any, committed"
 
@@ -163,16 +411,65 @@ def commit_txn():
 def abort_txn():
     logging.info("Aborting/rolling back active transactions")
     # TODO milestone 2
-    db = DB(get_db_conn())
-    db.conn.rollback()
+    db = get_db()
+    db.rollback()
     app.config["INSP_COUNTER"] = 0 
     return "Active transactions, if any, aborted"
 
 
+@app.route("/txn", methods=["POST"])
+def open_txn_session():
+    """
+    Opens a transaction session for one client and returns its id. Posts to
+    /inspections carrying the id (X-Txn-Id header or ?txn=) are staged in
+    the session; /commit/<txn_id> writes them in one transaction on the
+    session's own connection and /abort/<txn_id> drops them. An optional
+    body {"size": n} makes the session commit every n inspections.
+    """
+    body = json_object_body()
+    size = body.get("size", 0)
+    if not isinstance(size, int) or isinstance(size, bool) or size < 0:
+        raise InvalidUsage(message="size must be a non-negative integer")
+    txn = get_sessions().create(size)
+    logging.info("Opened transaction %s" % txn.id)
+    return {"txn_id": txn.id}, 201
+
+
+@app.route("/commit/<txn_id>")
+def commit_txn_session(txn_id):
+    """
+    Commits the inspections staged in a transaction session.
+    """
+    txn = find_txn_session(txn_id)
+    try:
+        committed = txn.commit()
+    except Exception as e:
+        # The inspections stay staged: commit again or abort
+        logging.info('Transaction %s failed to commit %s' % (txn_id, e))
+        return Response(status=400)
+    logging.info("Committed %s inspections of transaction %s"
+                 % (len(committed), txn_id))
+    return jsonify([{"inspection_id": inspection_id,
+                     "restaurant_id": rest_id, "status": status}
+                    for inspection_id, rest_id, status in committed]), 200
+
+
+@app.route("/abort/<txn_id>")
+def abort_txn_session(txn_id):
+    """
+    Drops the inspections staged in a transaction session.
+    """
+    txn = find_txn_session(txn_id)
+    dropped = txn.abort()
+    logging.info("Aborted %s inspections of transaction %s"
+                 % (dropped, txn_id))
+    return {"txn_id": txn.id, "aborted": dropped}, 200
+
+
 @app.route("/count")
 def count_insp():
     logging.info("Counting Inspections")
-    db = DB(get_db_conn())
+    db = get_read_db()
     res = db.total_inspections()
     return str(res[0]['COUNT (*)']), 200
 
@@ -207,7 +504,7 @@ def tweet():
         logging.error("No post body")
         return Response(status=400)
 
-    db = DB(get_db_conn())
+    db = get_db()
     try:
         res = db.tweet_match(ngs, lat, long, tkey)
         commit_txn()
@@ -222,7 +519,7 @@ def find_restaurant_tweets(restaurant_id):
     """
     Returns a restaurant's associated tweets (tkey and match).
     """
-    db = DB(get_db_conn())
+    db = get_read_db()
     # TODO milestone 2
     try:
         res = db.find_tweets(restaurant_id)
@@ -236,22 +533,164 @@ def find_restaurant_tweets(restaurant_id):
 def clean():
     """
     Cleans up restaurant records and links together restaurants that matched.
+    With scaling on, ?blocking=zip,name picks the blocking passes (default
+    app.config["BLOCKING"]). Returns the timings and counters of the clean
+    (see stats.py).
     """
 
     logging.info("Cleaning Restaurants")
 
-    db = DB(get_db_conn())
+    db = get_db()
     # TODO milestone 3
+    jobs = get_clean_jobs()
+    if not jobs.lock.acquire(blocking=False):
+        raise InvalidUsage(message="A clean job is running", status_code=409)
     try:
         if app.config['scaling'] is True:
-            res_scale = db.block_records(True)
+            strategies = app.config["BLOCKING"]
+            if request.args.get("blocking"):
+                try:
+                    strategies = parse_strategies(request.args["blocking"])
+                except ValueError as e:
+                    raise InvalidUsage(message=str(e))
+            res_scale = db.block_records(True, strategies,
+                                         app.config["CLEAN_WORKERS"])
+            jobs.last_stats = res_scale
             return jsonify(res_scale)
         else:
             res = db.block_records(False)
+            jobs.last_stats = res
             return jsonify(res)   
     except KeyError as e:
         logging.error(e)
         raise InvalidUsage(message=str(e), status_code=404) 
+    finally:
+        jobs.lock.release()
+
+
+@app.route("/clean/start", methods=["GET", "POST"])
+def start_clean_job():
+    """
+    Starts a clean in the background and returns its job id (202). The
+    blocking passes are app.config["BLOCKING"] or ?blocking=zip,name, even
+    without scaling (?blocking=qgram gives the matches of the MS3 clean).
+    """
+    strategies = app.config["BLOCKING"]
+    if request.args.get("blocking"):
+        try:
+            strategies = parse_strategies(request.args["blocking"])
+        except ValueError as e:
+            raise InvalidUsage(message=str(e))
+    job_id = get_clean_jobs().start(strategies)
+    if job_id is None:
+        raise InvalidUsage(message="A clean job is running", status_code=409)
+    logging.info("Started clean job %s" % job_id)
+    return jsonify({"job_id": job_id}), 202
+
+
+@app.route("/clean/status/<int:job_id>")
+def clean_job_status(job_id):
+    """
+    Returns the progress of a background clean: status (running, done or
+    failed), tasks and blocks done out of their totals, pairs scored,
+    seconds spent and eta_seconds.
+    """
+    db = get_read_db()
+    try:
+        return jsonify(db.find_clean_job(job_id))
+    except KeyError as e:
+        logging.error(e)
+        raise InvalidUsage(message=str(e), status_code=404)
+
+
+@app.route("/clean/stats")
+def clean_stats():
+    """
+    Returns the timings and counters of the last clean, /clean or background
+    (404 if none ran since the server started).
+    """
+    stats = get_clean_jobs().last_stats
+    if stats is None:
+        raise InvalidUsage(message="No clean has run yet", status_code=404)
+    return jsonify(stats)
+
+
+# helper function that tells whether a JSON value is a number (not a bool)
+def is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+@app.route("/clean/preview", methods=["POST"])
+def preview_clean():
+    """
+    Dry run of a clean: returns the clusters it would make and its stats,
+    without writing anything. The optional JSON body sets
+        weights     a dict overriding some of the name, address, city and
+                    state weights (default 0.45, 0.4, 0.09, 0.06)
+        threshold   the matching threshold (default 0.8)
+        blocking    the blocking passes, a list or a comma separated string,
+                    null to compare every dirty record to every record
+                    (default as /clean)
+        all         true to treat every record as dirty, e.g. after a clean
+        limit       the number of clusters listed, largest first (default
+                    100; the stats count them all)
+    Cluster members hold the normalized name, address and city compared.
+    """
+    body = json_object_body()
+    weights = dict(WEIGHTS)
+    given = body.get("weights", {})
+    if (not isinstance(given, dict) or set(given) - set(WEIGHTS)
+            or not all(is_number(w) and w >= 0 for w in given.values())):
+        raise InvalidUsage(message="weights must map some of %s to "
+                           "non-negative numbers" % ", ".join(WEIGHTS))
+    weights.update(given)
+    threshold = body.get("threshold", THRESHOLD)
+    if not is_number(threshold) or threshold <= 0:
+        raise InvalidUsage(message="threshold must be a positive number")
+    strategies = app.config["BLOCKING"] if app.config["scaling"] else None
+    if "blocking" in body:
+        strategies = body["blocking"]
+        if isinstance(strategies, list) and all(
+                isinstance(name, str) for name in strategies):
+            strategies = ",".join(strategies)
+        if strategies is not None:
+            if not isinstance(strategies, str):
+                raise InvalidUsage(message="blocking must be a list of "
+                                   "passes, a comma separated string or null")
+            try:
+                strategies = parse_strategies(strategies)
+            except ValueError as e:
+                raise InvalidUsage(message=str(e))
+            if not strategies:
+                raise InvalidUsage(message="blocking needs at least one pass")
+    limit = body.get("limit", 100)
+    if not isinstance(limit, int) or isinstance(limit, bool) or limit < 0:
+        raise InvalidUsage(message="limit must be a non-negative integer")
+
+    logging.info("Previewing a clean")
+    db = get_read_db()
+    clusters, stats = db.preview_clean(strategies, weights, threshold,
+                                       body.get("all") is True)
+    return jsonify({
+        "weights": weights,
+        "threshold": threshold,
+        "blocking": strategies,
+        "all": body.get("all") is True,
+        "clusters": [[{"id": record.id, "name": record.name,
+                       "address": record.address, "city": record.city,
+                       "state": record.state} for record in cluster]
+                     for cluster in clusters[:limit]],
+        "stats": stats,
+    })
+
+
+@app.route("/clean/cache")
+def clean_cache():
+    """
+    Returns the size and hit/miss counters of the similarity cache the
+    cleaning shares between runs.
+    """
+    return jsonify(SIMILARITY_CACHE.stats())
 
 
 @app.route("/restaurants/all-by-inspection/<inspection_id>", methods=["GET"])
@@ -261,7 +700,7 @@ def find_all_restaurants_by_inspection_id(inspection_id):
     with it.
     """
     logging.info("Getting linked restaurants by inspection")
-    db = DB(get_db_conn())
+    db = get_read_db()
     try:
         restaurant, linked, matched_ids = db.find_all_rest_by_insp(inspection_id)
         return {"primary": restaurant, "linked": linked, "ids": matched_ids}, 200
@@ -286,7 +725,7 @@ def query():
         # Ensure query was submitted
 
         # get DB class with new connection
-        db = DB(get_db_conn())
+        db = get_db()
 
         # note DO NOT EVER DO THIS NORMALLY (run SQL from a client/web directly)
         # https://xkcd.com/327/
@@ -421,6 +860,50 @@ if __name__ == "__main__":
         default=False,
         action="store_true"
     )
+    parser.add_argument(
+        "-b", "--blocking",
+        help="Blocking passes of the large scale cleaning, comma separated "
+             "from zip,name,street,sorted,qgram,lsh,lsh:BxR (B bands of R "
+             "rows) (default %s, the zip blocking of MS4; %s for multi-pass "
+             "blocking)"
+             % (",".join(DEFAULT_STRATEGIES),
+                ",".join(MULTI_PASS_STRATEGIES)),
+        default=",".join(DEFAULT_STRATEGIES)
+    )
+    parser.add_argument(
+        "-w", "--clean-workers",
+        help="Match the blocks of the large scale cleaning on N worker "
+             "processes (default 0, in the request thread)",
+        default=0,
+        type=int
+    )
+    parser.add_argument(
+        "-t", "--threads",
+        help="Production mode: serve on N worker threads with a connection "
+             "pool and WAL (default 0, single-threaded debug server)",
+        default=0,
+        type=int
+    )
+    parser.add_argument(
+        "-g", "--group-commit",
+        help="Commit /inspections from a background writer every N records "
+             "(default 0, disabled)",
+        default=0,
+        type=int
+    )
+    parser.add_argument(
+        "--group-commit-ms",
+        help="Maximum time in ms a record waits for its group (default 50)",
+        default=50,
+        type=int
+    )
+    parser.add_argument(
+        "--merge-duplicates",
+        help="Merge restaurants stored twice under the same name and address "
+             "so that migration 0002 can run (kept in ri_merged_restaurants)",
+        default=False,
+        action="store_true"
+    )
     parser.add_argument(
         "-l", "--log",
         help="Set the log level (debug,info,warning,error)",
@@ -467,5 +950,56 @@ if __name__ == "__main__":
     else:
         app.config['scaling'] = False
     logging.info("Scaling set to %s" % app.config['scaling'])
+    try:
+        app.config["BLOCKING"] = parse_strategies(args.blocking)
+    except ValueError as e:
+        parser.error(str(e))
+    app.config["CLEAN_WORKERS"] = args.clean_workers
+
+    # Bring an existing database up to the current schema without wiping it.
+    # Requests are served on another thread, so use a connection of our own.
+    migrate_conn = sqlite3.connect(DATABASE)
+    try:
+        version = DB(migrate_conn).migrate(args.merge_duplicates)
+    except InspError as e:
+        logging.error(e.message)
+        sys.exit(e.message)
+    finally:
+        migrate_conn.close()
+    logging.info("Database schema at version %s" % version)
+
+    # set multi-threaded serving. Group commit needs it too, since requests
+    # wait on the writer.
+    if args.threads > 0 or args.group_commit > 0:
+        app.config["THREADED"] = True
+        if args.threads > 0:
+            app.config["DB_POOL_SIZE"] = args.threads
+        app.config["_pool"] = ConnectionPool(
+            DATABASE, app.config["DB_POOL_SIZE"],
+            app.config["DB_BUSY_TIMEOUT_MS"])
+        logging.info("Connection pool of %s connections"
+                     % app.config["DB_POOL_SIZE"])
+
+    # set group commit
+    if args.group_commit > 0:
+        app.config["GROUP_COMMIT"] = args.group_commit
+        app.config["GROUP_COMMIT_MS"] = args.group_commit_ms
+        app.config["_writer"] = GroupCommitWriter(
+            app.config["_pool"].connect, args.group_commit,
+            args.group_commit_ms, get_rest_cache()).start()
+        logging.info("Group commit every %s records or %s ms"
+                     % (args.group_commit, args.group_commit_ms))
+
+    # Resume a background clean a restart interrupted. The debug server runs
+    # this script twice (reloader), only its serving process resumes.
+    if args.threads > 0 or is_running_from_reloader():
+        get_clean_jobs().resume()
+
     logging.info("Starting Inspection Service")
-    app.run(host=args.host, port=args.port, threaded=False, debug=True)
+    if args.threads > 0:
+        logging.info("Serving on %s worker threads" % args.threads)
+        PooledWSGIServer(args.host, args.port, app,
+                         args.threads).serve_forever()
+    else:
+        app.run(host=args.host, port=args.port,
+                threaded=app.config["THREADED"], debug=True)
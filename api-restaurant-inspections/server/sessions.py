@@ -0,0 +1,131 @@
+import logging  # Logging Library
+import threading
+import time
+import uuid
+from db import DB  # our custom data access layer
+
+
+"""
+Per-client transactions for loaders running side by side.
+"""
+
+
+class TxnSession:
+    '''
+    A transaction owned by one client. Posted inspections are staged in
+    memory and written by commit() in one transaction on the session's own
+    connection, so sessions never see or undo each other's work and do not
+    hold SQLite's write lock between requests. When size is set, the
+    session commits on its own every size staged inspections (like
+    /txn/<size> does for the shared transaction).
+    '''
+    def __init__(self, connect, size=0, rest_cache=None):
+        self.id = uuid.uuid4().hex
+        self.connect = connect
+        self.size = size
+        self.rest_cache = rest_cache
+        self.conn = None
+        self.staged = []
+        self.lock = threading.Lock()
+        self.last_used = time.monotonic()
+
+    def stage(self, inspection, restaurant):
+        '''
+        Stages an inspection. Returns the results of the commit it triggered
+        when the session reached its size, otherwise None.
+        '''
+        with self.lock:
+            self.last_used = time.monotonic()
+            self.staged.append((inspection, restaurant))
+            if self.size and len(self.staged) >= self.size:
+                return self.write_staged()
+        return None
+
+    def commit(self):
+        '''
+        Writes the staged inspections. Returns (inspection_id, restaurant_id,
+        status) for each of them. If the commit fails they stay staged.
+        '''
+        with self.lock:
+            self.last_used = time.monotonic()
+            return self.write_staged()
+
+    def abort(self):
+        '''
+        Drops the staged inspections. Returns how many were dropped.
+        '''
+        with self.lock:
+            self.last_used = time.monotonic()
+            dropped = len(self.staged)
+            self.staged = []
+            return dropped
+
+    def write_staged(self):
+        # The staged inspections are only dropped once they are committed: a
+        # failed commit is rolled back and keeps them, to be committed again
+        # or aborted
+        records = self.staged
+        if not records:
+            return []
+        if self.conn is None:
+            self.conn = self.connect()
+        db = DB(self.conn, self.rest_cache)
+        try:
+            resp = db.add_inspections_batch(records)
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        self.staged = []
+        return [(inspection["inspection_id"], rest_id, status)
+                for (inspection, _), (rest_id, status) in zip(records, resp)]
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+
+class SessionManager:
+    '''
+    Keeps the open transaction sessions. A session unused for ttl seconds is
+    closed and its staged inspections are dropped.
+    '''
+    def __init__(self, connect, ttl, rest_cache=None):
+        self.connect = connect
+        self.ttl = ttl
+        self.rest_cache = rest_cache
+        self.sessions = {}
+        self.lock = threading.Lock()
+
+    def create(self, size=0):
+        self.expire()
+        txn = TxnSession(self.connect, size, self.rest_cache)
+        with self.lock:
+            self.sessions[txn.id] = txn
+        return txn
+
+    def get(self, txn_id):
+        '''
+        Returns the session with the given id. Raises KeyError if there is no
+        such (live) session.
+        '''
+        self.expire()
+        with self.lock:
+            txn = self.sessions.get(txn_id)
+        if txn is None:
+            raise KeyError(f"Transaction {txn_id} was not found.")
+        return txn
+
+    def expire(self):
+        now = time.monotonic()
+        with self.lock:
+            expired = [txn for txn in self.sessions.values()
+                       if now - txn.last_used > self.ttl]
+            for txn in expired:
+                del self.sessions[txn.id]
+        for txn in expired:
+            dropped = txn.abort()
+            txn.close()
+            logging.warning("Transaction %s expired, %s staged inspections "
+                            "dropped" % (txn.id, dropped))
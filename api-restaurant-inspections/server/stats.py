@@ -0,0 +1,175 @@
+import logging  # Logging Library
+import time
+from collections import Counter
+from contextlib import contextmanager
+from scoring import SIMILARITY_CACHE
+
+
+# Phases of a clean timed by CleanStats, in order
+PHASES = ["load", "blocking", "scoring", "clustering", "writing"]
+
+# Counters of a clean, always reported even when nothing was counted.
+# pairs_scored counts the (dirty record, other record) pairs scored and
+# matches the distinct pairs of records matched, whichever the order of the
+# pair or the pass that found it (see CleanStats.count_pairs)
+COUNTERS = ["records", "dirty", "pairs_scored", "matches", "clusters",
+            "primaries", "linked", "inspections_moved", "cleaned"]
+
+# Blocks listed by pairs scored in the stats of a clean
+TOP_BLOCKS = 10
+
+
+"""
+Structured timings and counters of a clean, so the blocking can be tuned to
+the data: how long every phase took, how many records and pairs went
+through it, what the cascade scorer rejected, and the blocks that dominate
+(largest ones by pairs scored). DB.block_records fills one per run, logs it
+and /clean returns it; /clean/stats returns the last one.
+"""
+
+
+# helper function that returns the power of 2 bucket of a block size, e.g.
+# "5-8" for 7
+def size_bucket(size):
+    if size <= 2:
+        return str(size)
+    upper = 2
+    while upper < size:
+        upper *= 2
+    return "%s-%s" % (upper // 2 + 1, upper)
+
+
+# helper function that returns a pair of ids in one order, (a, b) and (b, a)
+# being the same pair
+def pair_key(rest_id, other_id):
+    if rest_id < other_id:
+        return rest_id, other_id
+    return other_id, rest_id
+
+
+class CleanStats:
+    '''
+    Timings (seconds per phase), counters (records, dirty, pairs_scored,
+    matches, clusters, ...) and blocks (pass, records, pairs scored,
+    matches, seconds) of one clean.
+    '''
+    def __init__(self, blocking, workers=0):
+        # Names of the blocking passes, None for the MS3 clean
+        self.blocking = blocking
+        self.workers = workers
+        self.started = time.perf_counter()
+        self.seconds = dict.fromkeys(PHASES, 0.0)
+        self.counters = Counter(dict.fromkeys(COUNTERS, 0))
+        self.rejected = Counter()
+        self.blocks = []
+        # Distinct pairs of ids matched (pair_key)
+        self.matched = set()
+        self.cache = {}
+        self.total = None
+        self.cache_start = (SIMILARITY_CACHE.hits, SIMILARITY_CACHE.misses)
+
+    @contextmanager
+    def phase(self, name):
+        '''
+        Adds the time spent in the with block to the phase name.
+        '''
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.seconds[name] += time.perf_counter() - start
+
+    def add_block(self, name, records, pairs, matches, seconds):
+        '''
+        Adds a block (unit of work) of the pass name. Returns its index in
+        blocks, so its matches can be counted once it is scored.
+        '''
+        self.blocks.append([name, records, pairs, matches, seconds])
+        return len(self.blocks) - 1
+
+    def count_pairs(self, scored, matches=(), block=None):
+        '''
+        Counts scored pairs scored and the matched pairs of ids in matches,
+        the only place pairs_scored and matches are counted, so every way
+        of cleaning reports them alike. A pair matched in both orders, or
+        by several passes, is one match, added to the block (index in
+        blocks) if given. Returns the matches not counted before.
+        '''
+        self.counters["pairs_scored"] += scored
+        new = {pair_key(*pair) for pair in matches} - self.matched
+        self.matched |= new
+        self.counters["matches"] += len(new)
+        if block is not None:
+            self.blocks[block][3] += len(new)
+        return new
+
+    def finish(self, rejected):
+        '''
+        Ends the clean: records its total time, the pairs the cascade scorer
+        rejected (a Counter) and the similarity cache hits and misses.
+        '''
+        self.total = time.perf_counter() - self.started
+        self.rejected = Counter(rejected)
+        hits, misses = self.cache_start
+        self.cache = {"hits": SIMILARITY_CACHE.hits - hits,
+                      "misses": SIMILARITY_CACHE.misses - misses}
+
+    def to_dict(self, top=TOP_BLOCKS):
+        '''
+        The stats as JSON: totals, then per pass the number of blocks, their
+        records, pairs, matches and seconds, the histogram of block sizes
+        and the top blocks by pairs scored.
+        '''
+        passes = {}
+        sizes = {}
+        for name, records, pairs, matches, seconds in self.blocks:
+            totals = passes.setdefault(name, {
+                "blocks": 0, "records": 0, "largest": 0, "pairs": 0,
+                "matches": 0, "seconds": 0.0})
+            totals["blocks"] += 1
+            totals["records"] += records
+            totals["largest"] = max(totals["largest"], records)
+            totals["pairs"] += pairs
+            totals["matches"] += matches
+            totals["seconds"] += seconds
+            histogram = sizes.setdefault(name, Counter())
+            histogram[size_bucket(records)] += 1
+        top_blocks = sorted(self.blocks, key=lambda b: (-b[2], -b[1]))[:top]
+        seconds = dict(self.seconds)
+        seconds["total"] = (self.total if self.total is not None
+                            else time.perf_counter() - self.started)
+        return {
+            "blocking": self.blocking,
+            "workers": self.workers,
+            "seconds": {k: round(v, 4) for k, v in seconds.items()},
+            **self.counters,
+            "rejected": dict(self.rejected),
+            "cache": self.cache,
+            "passes": {name: dict(totals, seconds=round(totals["seconds"], 4))
+                       for name, totals in passes.items()},
+            "block_sizes": {name: dict(sorted(
+                                histogram.items(),
+                                key=lambda item: int(item[0].split("-")[0])))
+                            for name, histogram in sizes.items()},
+            "top_blocks": [{"pass": name, "records": records, "pairs": pairs,
+                            "matches": matches, "seconds": round(seconds, 4)}
+                           for name, records, pairs, matches, seconds
+                           in top_blocks],
+        }
+
+    def log(self):
+        '''
+        Logs the totals and the top blocks of the clean.
+        '''
+        stats = self.to_dict()
+        logging.info("Clean stats: blocking %s, %s, seconds %s, rejected %s"
+                     % (stats["blocking"],
+                        ", ".join("%s %s" % item
+                                  for item in self.counters.items()),
+                        stats["seconds"], stats["rejected"]))
+        for name, totals in stats["passes"].items():
+            logging.info("Clean stats: pass %s %s, block sizes %s"
+                         % (name, totals, stats["block_sizes"][name]))
+        for block in stats["top_blocks"]:
+            logging.info("Clean stats: top block %s" % block)
+        return stats
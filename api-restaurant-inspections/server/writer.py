@@ -0,0 +1,123 @@
+import logging  # Logging Library
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from db import DB  # our custom data access layer
+
+
+# Queue marker asking the writer to commit what it holds right away
+FLUSH = "flush"
+
+
+"""
+Group commit for /inspections: a single background thread owns a write
+connection and commits the queued inspections in groups.
+"""
+
+
+class GroupCommitWriter:
+    '''
+    Applies queued inspections on its own connection and commits them as a
+    group once max_records records are pending or max_delay_ms milliseconds
+    have passed since the first one, whichever comes first. submit() returns
+    a Future that resolves to (restaurant_id, status) only after the group
+    holding the record has been committed.
+    '''
+    def __init__(self, connect, max_records, max_delay_ms, rest_cache=None):
+        # Function returning a new connection (e.g. ConnectionPool.connect)
+        self.connect = connect
+        self.max_records = max_records
+        self.max_delay = max_delay_ms / 1000.0
+        self.rest_cache = rest_cache
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self.run, daemon=True,
+                                       name="group-commit-writer")
+        # Counters for logging
+        self.groups = 0
+        self.records = 0
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def submit(self, inspection, restaurant):
+        future = Future()
+        self.queue.put((inspection, restaurant, future))
+        return future
+
+    def flush(self):
+        '''
+        Commits the records queued so far and waits until that is done.
+        '''
+        future = Future()
+        self.queue.put((FLUSH, None, future))
+        return future.result()
+
+    def run(self):
+        db = DB(self.connect(), self.rest_cache)
+        while True:
+            # (1) Block until there is work, then gather a group until it is
+            # full, the delay runs out or a flush is requested
+            group = [self.queue.get()]
+            deadline = time.monotonic() + self.max_delay
+            while group[-1][0] != FLUSH and len(group) < self.max_records:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    group.append(self.queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+            # (2) Apply and commit the group
+            self.write_group(db, group)
+
+    def write_group(self, db, group):
+        '''
+        Applies every record of the group inside one transaction. A record
+        that fails is rolled back on its own (savepoint) and its Future gets
+        the error, the rest of the group is still committed. If the group
+        itself fails, every record gets the error, a flush still resolves.
+        '''
+        c = db.conn.cursor()
+        results = []
+        try:
+            c.execute("BEGIN;")
+            for inspection, restaurant, future in group:
+                if inspection == FLUSH:
+                    results.append((future, None, None))
+                    continue
+                c.execute("SAVEPOINT record;")
+                if db.rest_cache is not None:
+                    cached = db.rest_cache.savepoint(db.conn)
+                try:
+                    resp = db.add_inspection_for_restaurant(inspection,
+                                                            restaurant)
+                    results.append((future, resp, None))
+                except Exception as e:
+                    c.execute("ROLLBACK TO record;")
+                    # The record may have cached the id of a restaurant that
+                    # was just rolled back, forget the ids it added
+                    if db.rest_cache is not None:
+                        db.rest_cache.rollback_to(db.conn, cached)
+                    results.append((future, None, e))
+                c.execute("RELEASE record;")
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            logging.error("Group commit failed %s" % e)
+            # A flush only asked for a commit, the records failed
+            results = [(future, None, None if inspection == FLUSH else e)
+                       for inspection, _, future in group]
+
+        records = len([r for r in group if r[0] != FLUSH])
+        self.groups += 1
+        self.records += records
+        logging.debug("Committed group %s of %s records"
+                      % (self.groups, records))
+        # (3) Only now that the group is durable answer the waiting requests
+        for future, resp, error in results:
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(resp)
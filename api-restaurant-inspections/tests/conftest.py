@@ -0,0 +1,100 @@
+import shutil
+import sqlite3
+import sys
+from os import path
+import pytest
+
+
+# The server modules import each other by name and read their schema
+# scripts relative to the server directory, as when server.py runs there
+SERVER_DIR = path.join(path.dirname(path.dirname(path.abspath(__file__))),
+                       "server")
+DATA_DIR = path.join(path.dirname(SERVER_DIR), "data")
+CLIENT_DIR = path.join(path.dirname(SERVER_DIR), "client")
+sys.path.insert(0, SERVER_DIR)
+sys.path.insert(1, CLIENT_DIR)
+sys.path.insert(2, DATA_DIR)
+
+from db import CLEAN_COLUMNS, DB  # noqa: E402
+from loader import load_files  # noqa: E402
+from records import read_records  # noqa: E402
+
+
+@pytest.fixture(autouse=True)
+def server_dir(monkeypatch):
+    monkeypatch.chdir(SERVER_DIR)
+
+
+@pytest.fixture
+def db_file(tmp_path):
+    '''
+    Path of a new database with the current schema.
+    '''
+    file_path = str(tmp_path / "insp.db")
+    conn = sqlite3.connect(file_path)
+    DB(conn).create_script()
+    conn.close()
+    return file_path
+
+
+@pytest.fixture(scope="session")
+def dirty100(tmp_path_factory):
+    '''
+    Path of a database holding chiDirty100, not cleaned yet. Tests copy it
+    (see copy_db) rather than change it.
+    '''
+    file_path = str(tmp_path_factory.mktemp("dirty100") / "insp.db")
+    conn = sqlite3.connect(file_path)
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        monkeypatch.chdir(SERVER_DIR)
+        DB(conn).create_script()
+    load_files(conn, [path.join(DATA_DIR, "ms3", "chiDirty100.json")],
+               10000, progress=False)
+    conn.close()
+    return file_path
+
+
+@pytest.fixture(scope="session")
+def dirty100_records(dirty100):
+    '''
+    The records of chiDirty100 as a clean reads them (all dirty).
+    '''
+    conn = sqlite3.connect(dirty100)
+    DB(conn)  # registers the normalization functions CLEAN_COLUMNS uses
+    c = conn.cursor()
+    c.execute(f"SELECT {CLEAN_COLUMNS} FROM ri_restaurants ORDER BY id;")
+    records = read_records(c)
+    conn.close()
+    return records
+
+
+# helper function that copies a database file into tmp_path, returning the
+# path of the copy
+def copy_db(file_path, tmp_path, name="copy.db"):
+    copy = str(tmp_path / name)
+    shutil.copyfile(file_path, copy)
+    return copy
+
+
+# helper function that returns every link of ri_linked, sorted
+def links(conn):
+    c = conn.cursor()
+    c.execute("""SELECT primary_rest_id, original_rest_id FROM ri_linked
+              ORDER BY 1, 2;""")
+    return c.fetchall()
+
+
+@pytest.fixture
+def client(db_file, monkeypatch):
+    '''
+    Flask test client of the server, on a database of its own.
+    '''
+    import server
+    monkeypatch.setattr(server, "DATABASE", db_file)
+    monkeypatch.setitem(server.app.config, "scaling", False)
+    yield server.app.test_client()
+    # Drop the connections and helpers the requests created
+    for key in [key for key in server.app.config if key.startswith("_")]:
+        resource = server.app.config.pop(key)
+        if isinstance(resource, sqlite3.Connection):
+            resource.close()
@@ -0,0 +1,107 @@
+import pytest
+from blocking import (LSH_MAX_HASHES, MinHashLSH, QGramIndex, all_pairs,
+                      parse_strategies, strategy)
+from records import Record
+from scoring import THRESHOLD, WEIGHTS, score_pairs
+
+
+# Small records with the cases the index filters on: near and far
+# addresses, missing addresses and names, and repeated characters
+FIXTURE = [
+    Record(1, "JOES PIZZA", "1 MAIN ST", "CHICAGO", "IL", "60601", 0),
+    Record(2, "JOES PIZZ", "1 MAIN ST", "CHICAGO", "IL", "60601", 1),
+    Record(3, "JOE PIZZA", "1 MAIN STREET", "CHICAGO", "IL", "60601", 0),
+    Record(4, "TACO HUT", "99 ELM AVE", "CHICAGO", "IL", "60602", 0),
+    Record(5, "TACO HUT", "9 ELM AVE", "CHICAGO", "IL", "60602", 1),
+    Record(6, "TACO HUT", None, "CHICAGO", "IL", None, 0),
+    Record(7, "TACO HUTT", None, "CHICAGO", "IL", None, 0),
+    Record(8, None, "1 MAIN ST", "CHICAGO", "IL", "60601", 0),
+    Record(9, "AAAA", "AAAAAA", "CHICAGO", "IL", "60601", 0),
+    Record(10, "AAAA", "AAAAA", "CHICAGO", "IL", "60601", 1),
+]
+
+
+# helper function that returns the pairs of an exhaustive comparison that
+# reach threshold, record i being dirty
+def matching_pairs(records, dirty, threshold, weights):
+    pairs = list(all_pairs(range(len(records)), dirty))
+    scores = score_pairs(records, pairs, weights)
+    return {pair for pair, score in zip(pairs, scores) if score >= threshold}
+
+
+@pytest.mark.parametrize("threshold, weights", [
+    (THRESHOLD, WEIGHTS),
+    (0.7, WEIGHTS),
+    (0.9, WEIGHTS),
+    (THRESHOLD, {"name": 0.3, "address": 0.6, "city": 0.05, "state": 0.05}),
+    # The address alone cannot filter: every pair is a candidate
+    (THRESHOLD, {"name": 0.6, "address": 0.2, "city": 0.1, "state": 0.1}),
+])
+def test_qgram_finds_every_match_of_exhaustive_pairs(dirty100_records,
+                                                     threshold, weights):
+    for records, dirty in [
+            (FIXTURE, [not record.clean for record in FIXTURE]),
+            (dirty100_records, [i % 3 != 0
+                                for i in range(len(dirty100_records))])]:
+        pairs = list(QGramIndex(threshold, weights).candidate_pairs(records,
+                                                                   dirty))
+        # Each candidate is found once, its first record being dirty
+        assert len(pairs) == len(set(pairs))
+        assert all(dirty[i] and i != j for i, j in pairs)
+        assert matching_pairs(records, dirty, threshold, weights) <= set(pairs)
+
+
+def test_qgram_prunes_pairs(dirty100_records):
+    records = dirty100_records
+    dirty = [True] * len(records)
+    pairs = list(QGramIndex().candidate_pairs(records, dirty))
+    assert len(pairs) < len(records) * (len(records) - 1) / 10
+
+
+# helper function that returns the candidate pairs of a blocking pass
+def pass_pairs(blocking, records, dirty):
+    return {pair for unit in blocking.units(records, dirty)
+            for pair in blocking.unit_pairs(records, dirty, unit)}
+
+
+def test_lsh_collides_duplicates(dirty100_records):
+    records = list(dirty100_records) + [
+        Record(1000 + n, r.name, r.address, r.city, r.state, r.zip, 0)
+        for n, r in enumerate(dirty100_records[:10])]
+    dirty = [not record.clean for record in records]
+    pairs = pass_pairs(strategy("lsh"), records, dirty)
+    # Exact copies share every band
+    for n in range(10):
+        assert (len(dirty100_records) + n, n) in pairs
+    assert all(dirty[i] and i != j for i, j in pairs)
+    # Most matches are found, from far fewer pairs than all of them
+    matches = matching_pairs(records, dirty, THRESHOLD, WEIGHTS)
+    assert len(matches & pairs) >= 0.9 * len(matches)
+    assert len(pairs) < len(records) * (len(records) - 1) / 10
+
+
+def test_lsh_bands_and_rows_tune_the_pairs(dirty100_records):
+    records = dirty100_records
+    dirty = [True] * len(records)
+    # The hashes of 16x5 are the first of 20x5, so its buckets are kept
+    pairs = pass_pairs(MinHashLSH(16, 5), records, dirty)
+    assert pass_pairs(strategy("lsh:16x5"), records, dirty) == pairs
+    assert pairs <= pass_pairs(MinHashLSH(20, 5), records, dirty)
+    # More rows per band make the buckets narrower
+    assert len(pass_pairs(MinHashLSH(16, 6), records, dirty)) < \
+        len(pass_pairs(MinHashLSH(16, 4), records, dirty))
+
+
+def test_lsh_shingle_cache_keeps_keys(dirty100_records):
+    lsh = MinHashLSH()
+    cache = {}
+    for record in dirty100_records:
+        assert lsh.keys(record, cache) == lsh.keys(record)
+    assert lsh.keys(Record(1, None, None, None, None, None, 0)) == []
+
+
+@pytest.mark.parametrize("name", ["lsh:", "lsh:16", "lsh:0x5", "lsh:axb",
+                                  "lsh:%sx2" % LSH_MAX_HASHES, "minhash"])
+def test_lsh_parameters_are_checked(name):
+    with pytest.raises(ValueError):
+        parse_strategies("zip,%s" % name)
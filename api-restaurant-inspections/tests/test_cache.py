@@ -0,0 +1,105 @@
+import pytest
+import scoring
+import server
+from cache import LRUCache, RestaurantCache
+from scoring import score_matrix
+
+
+def test_lru_evicts_the_least_recently_used():
+    cache = LRUCache(3)
+    for n in range(3):
+        cache.put(n, str(n))
+    # Reading 0 makes 1 the least recently used
+    assert cache.get(0) == "0"
+    cache.put(3, "3")
+    assert len(cache) == 3
+    assert cache.get(1) is None
+    assert [cache.get(n) for n in [0, 2, 3]] == ["0", "2", "3"]
+    # Writing an existing key refreshes it without growing the cache
+    cache.put(0, "zero")
+    cache.put(4, "4")
+    assert len(cache) == 3
+    assert cache.get(2) is None
+    assert cache.get(0) == "zero"
+
+
+def test_lru_counts_hits_and_misses():
+    cache = LRUCache(10)
+    assert cache.get("a", "default") == "default"
+    cache.put("a", 1)
+    assert cache.get("a") == 1
+    assert cache.get("a") == 1
+    assert cache.stats() == {"size": 1, "maxsize": 10, "hits": 2,
+                             "misses": 1}
+    # Clearing drops the entries, not the counters
+    cache.clear()
+    assert cache.stats() == {"size": 0, "maxsize": 10, "hits": 2,
+                             "misses": 1}
+
+
+def test_restaurant_ids_are_shared_once_committed():
+    cache = RestaurantCache(10)
+    cache.add(("CAFE", "1 MAIN ST"), 1, "writer")
+    assert cache.lookup(("CAFE", "1 MAIN ST"), "writer") == 1
+    assert cache.lookup(("CAFE", "1 MAIN ST"), "other") is None
+    cache.commit("writer")
+    assert cache.lookup(("CAFE", "1 MAIN ST"), "other") == 1
+    cache.add(("BAR", "2 MAIN ST"), 2, "writer")
+    cache.rollback("writer")
+    assert cache.lookup(("BAR", "2 MAIN ST"), "writer") is None
+
+
+@pytest.fixture
+def similarity_cache(monkeypatch):
+    '''
+    An empty similarity cache in place of the one shared by the cleans.
+    '''
+    cache = LRUCache(scoring.SIMILARITY_CACHE_SIZE)
+    monkeypatch.setattr(scoring, "SIMILARITY_CACHE", cache)
+    monkeypatch.setattr(server, "SIMILARITY_CACHE", cache)
+    return cache
+
+
+def test_scoring_reuses_cached_similarities(dirty100_records,
+                                            similarity_cache):
+    records = dirty100_records[:40]
+    first = score_matrix(records, records)
+    stats = similarity_cache.stats()
+    assert stats["misses"] > 0
+    assert stats["size"] == stats["misses"]
+    # The same block scored again only hits the cache
+    assert score_matrix(records, records) == first
+    again = similarity_cache.stats()
+    assert again["misses"] == stats["misses"]
+    assert again["hits"] == 2 * stats["hits"] + stats["misses"]
+
+
+def test_scoring_with_a_full_cache(dirty100_records, monkeypatch):
+    records = dirty100_records[:40]
+    cache = LRUCache(5)
+    monkeypatch.setattr(scoring, "SIMILARITY_CACHE", cache)
+    scores = score_matrix(records, records)
+    assert len(cache) == 5
+    monkeypatch.setattr(scoring, "SIMILARITY_CACHE", LRUCache(100000))
+    assert score_matrix(records, records) == scores
+
+
+def test_clean_cache_reports_the_counters(client, similarity_cache):
+    response = client.get("/clean/cache")
+    assert response.get_json() == {
+        "size": 0, "maxsize": scoring.SIMILARITY_CACHE_SIZE, "hits": 0,
+        "misses": 0}
+    body = [{"inspection_id": str(n), "name": name, "address": address,
+             "city": "CHICAGO", "state": "IL", "zip": "60601",
+             "facility_type": None, "latitude": None, "longitude": None,
+             "risk": None, "date": "01/02/2020", "inspection_type": None,
+             "results": None, "violations": None}
+            for n, (name, address) in enumerate([
+                ("JOES PIZZA", "1 MAIN ST"), ("JOES PIZZERIA", "1 MAIN ST"),
+                ("CAFE ROMA", "12 STATE ST")])]
+    assert client.post("/inspections/batch", json=body).status_code == 200
+    assert client.get("/clean").status_code == 200
+    stats = client.get("/clean/cache").get_json()
+    assert stats == similarity_cache.stats()
+    assert stats["misses"] > 0
+    assert stats["size"] == stats["misses"]
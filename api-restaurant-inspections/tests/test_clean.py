@@ -0,0 +1,69 @@
+import sqlite3
+import pytest
+from conftest import links
+from db import DB
+
+
+# helper function that adds dirty restaurants (id, name, address) with one
+# inspection each to a database
+def add_restaurants(conn, restaurants):
+    for rest_id, name, address in restaurants:
+        conn.execute("""INSERT INTO ri_restaurants (id, name, address, city,
+                     state, zip, norm_name, norm_address, norm_city)
+                     VALUES (?1, ?2, ?3, 'Chicago', 'IL', '60601',
+                     normalize_name(?2), normalize_address(?3),
+                     normalize_city('Chicago'))""", (rest_id, name, address))
+        conn.execute("""INSERT INTO ri_inspections (id, restaurant_id)
+                     VALUES (?, ?)""", ("i%s" % rest_id, rest_id))
+    conn.commit()
+
+
+# helper function that returns the state a clean leaves: the restaurants
+# with their clean flag, the links and the inspections
+def snapshot(conn):
+    c = conn.cursor()
+    c.execute("SELECT id, name, address, clean FROM ri_restaurants ORDER BY id")
+    restaurants = c.fetchall()
+    c.execute("SELECT id, restaurant_id FROM ri_inspections ORDER BY id")
+    return restaurants, links(conn), c.fetchall()
+
+
+@pytest.mark.parametrize("blocking", [False, True])
+def test_primary_reuses_an_original(db_file, blocking):
+    conn = sqlite3.connect(db_file)
+    db = DB(conn)
+    # The primary of [1, 2] takes the longest name and address, those of 1
+    add_restaurants(conn, [(1, "JOES PIZZA", "1 MAIN ST"),
+                           (2, "JOES PIZZ", "1 MAIN ST"),
+                           (3, "TACO HUT", "99 ELM AVE")])
+    stats = db.block_records(blocking)
+    assert (stats["clusters"], stats["primaries"]) == (1, 1)
+    restaurants, linked, inspections = snapshot(conn)
+    # No new record: 1 is the primary, linked to itself and to 2
+    assert [r[0] for r in restaurants] == [1, 2, 3]
+    assert all(r[3] for r in restaurants)
+    assert linked == [(1, 1), (1, 2)]
+    assert inspections == [("i1", 1), ("i2", 1), ("i3", 3)]
+    # A second clean has nothing to do
+    stats = db.block_records(blocking)
+    assert (stats["clusters"], stats["linked"], stats["cleaned"]) == (0, 0, 0)
+    assert snapshot(conn) == (restaurants, linked, inspections)
+
+
+def test_absorbed_primaries_are_relinked(db_file):
+    conn = sqlite3.connect(db_file)
+    db = DB(conn)
+    add_restaurants(conn, [(1, "A", "1 MAIN ST"), (2, "B", "2 MAIN ST"),
+                           (3, "C", "3 MAIN ST"), (4, "D", "4 MAIN ST"),
+                           (5, "E", "5 MAIN ST")])
+    records = [{"id": rest_id, "clean": 0} for rest_id in range(1, 6)]
+    db.write_clusters([[1, 2], [3, 4]], records[:4])
+    # add_primary picks the name and address of 2 and 4, which are reused
+    assert links(conn) == [(2, 1), (2, 2), (4, 3), (4, 4)]
+    # A new record matches a member of each cluster: primary 2 is kept, and
+    # 4 and the records linked to it join it
+    db.write_clusters([[1, 3, 5]], records[4:])
+    restaurants, linked, inspections = snapshot(conn)
+    assert linked == [(2, rest_id) for rest_id in range(1, 6)]
+    assert {rest_id for _, rest_id in inspections} == {2}
+    assert all(r[3] for r in restaurants)
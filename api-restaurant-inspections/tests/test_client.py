@@ -0,0 +1,90 @@
+import json
+from collections import defaultdict
+import pytest
+import requests
+import client
+from client import (bench_requests, percentile, print_bench_report,
+                    timed_request)
+
+
+def test_percentile_is_nearest_rank():
+    values = list(range(1, 101))
+    assert percentile(values, 50) == 50
+    assert percentile(values, 95) == 95
+    assert percentile(values, 99) == 99
+    assert percentile(values, 100) == 100
+    assert percentile(values, 0) == 1
+    assert percentile([0.5], 99) == 0.5
+    assert percentile([], 50) == 0.0
+    assert percentile([1, 2, 3], 50) == 2
+
+
+class Session:
+    '''
+    Stands in for the keep-alive session of a bench thread: answers every
+    request with status, or raises error.
+    '''
+    def __init__(self, status=200, error=None):
+        self.status = status
+        self.error = error
+
+    def post(self, url, json=None):
+        return self.get(url)
+
+    def get(self, url):
+        if self.error is not None:
+            raise self.error
+        response = requests.Response()
+        response.status_code = self.status
+        return response
+
+
+@pytest.mark.parametrize("error", [
+    requests.exceptions.ConnectionError(), requests.exceptions.ReadTimeout(),
+    requests.exceptions.ChunkedEncodingError()])
+def test_request_errors_are_counted(monkeypatch, error):
+    monkeypatch.setattr(client, "bench_session", lambda: Session(error=error))
+    endpoint, latency, ok = timed_request("GET", "GET /count", "url", None,
+                                          [200])
+    assert (endpoint, ok) == ("GET /count", False)
+    assert latency >= 0
+
+
+def test_unexpected_status_is_an_error(monkeypatch):
+    monkeypatch.setattr(client, "bench_session", lambda: Session(status=400))
+    assert not timed_request("POST", "POST /x", "url", {}, [200, 201])[2]
+    monkeypatch.setattr(client, "bench_session", lambda: Session(status=201))
+    assert timed_request("POST", "POST /x", "url", {}, [200, 201])[2]
+
+
+def test_bench_requests(tmp_path):
+    post_file = tmp_path / "post.json"
+    post_file.write_text(json.dumps({"post_path": "inspections",
+                                     "response": [200, 201],
+                                     "values": [{"a": 1}, {"a": 2}]}))
+    get_file = tmp_path / "get.json"
+    get_file.write_text(json.dumps({"get_path": "restaurants",
+                                    "response": 200,
+                                    "tests": [{"inputs": 4}, {}]}))
+    server = "http://localhost:30235/"
+    assert bench_requests(server, str(post_file)) == [
+        ("POST", "POST /inspections", server + "inspections", {"a": 1},
+         [200, 201]),
+        ("POST", "POST /inspections", server + "inspections", {"a": 2},
+         [200, 201])]
+    assert bench_requests(server, str(get_file)) == [
+        ("GET", "GET /restaurants", server + "restaurants/4", None, [200]),
+        ("GET", "GET /restaurants", server + "restaurants", None, [200])]
+
+
+def test_bench_report(capsys):
+    latencies = defaultdict(list, {"GET /count": [0.001 * n
+                                                  for n in range(100, 0, -1)]})
+    errors = defaultdict(int, {"GET /count": 3})
+    print_bench_report(latencies, errors, {"GET /count": 2.0})
+    header, row = capsys.readouterr().out.splitlines()
+    assert header.split() == ["endpoint", "count", "errors", "req/s",
+                              "p50", "ms", "p95", "ms", "p99", "ms", "max",
+                              "ms"]
+    assert row.split() == ["GET", "/count", "100", "3", "50.0", "50.00",
+                           "95.00", "99.00", "100.00"]
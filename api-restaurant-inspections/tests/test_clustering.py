@@ -0,0 +1,89 @@
+import random
+from clustering import UnionFind
+
+
+def test_union_is_transitive():
+    sets = UnionFind()
+    sets.union(1, 2)
+    sets.union(3, 4)
+    assert sets.find(1) == sets.find(2)
+    assert sets.find(1) != sets.find(3)
+    sets.union(2, 3)
+    assert len({sets.find(x) for x in [1, 2, 3, 4]}) == 1
+    # Already together
+    assert sets.union(4, 1) == sets.find(1)
+
+
+def test_find_adds_a_new_id():
+    sets = UnionFind()
+    assert sets.find(7) == 7
+    assert sets.clusters(min_size=1) == [[7]]
+    assert sets.clusters() == []
+
+
+def test_smaller_set_joins_the_larger():
+    sets = UnionFind()
+    for x in [2, 3, 4]:
+        sets.union(1, x)
+    # A single id merged into the set of 4 takes its representative,
+    # whichever side it is passed on
+    root = sets.find(1)
+    assert sets.union(5, 4) == root
+    assert sets.size[root] == 5
+    assert sets.parent[5] == root
+
+
+def test_find_halves_the_path():
+    sets = UnionFind()
+    # A chain 4 -> 3 -> 2 -> 1, which union by size never builds
+    sets.parent = {1: 1, 2: 1, 3: 2, 4: 3}
+    sets.size = {1: 4, 2: 1, 3: 1, 4: 1}
+    assert sets.find(4) == 1
+    # Every other node on the path now points to its grandparent
+    assert sets.parent == {1: 1, 2: 1, 3: 2, 4: 2}
+    assert sets.find(4) == 1
+    assert sets.parent[4] == 1
+
+
+def test_clusters_are_sorted():
+    sets = UnionFind()
+    for x, y in [(9, 3), (8, 3), (5, 1), (6, 7)]:
+        sets.union(x, y)
+    sets.find(2)
+    assert sets.clusters() == [[1, 5], [3, 8, 9], [6, 7]]
+    assert sets.clusters(min_size=3) == [[3, 8, 9]]
+    assert sets.clusters(min_size=1) == [[1, 5], [2], [3, 8, 9], [6, 7]]
+
+
+def test_clusters_match_connected_components():
+    rng = random.Random(7)
+    pairs = [(rng.randrange(200), rng.randrange(200)) for _ in range(150)]
+    sets = UnionFind()
+    for x, y in pairs:
+        sets.union(x, y)
+    # Reference: grow the component of every id over the pairs
+    edges = {}
+    for x, y in pairs:
+        edges.setdefault(x, set()).add(y)
+        edges.setdefault(y, set()).add(x)
+    components = []
+    seen = set()
+    for start in sorted(edges):
+        if start in seen:
+            continue
+        component, todo = set(), [start]
+        while todo:
+            x = todo.pop()
+            if x not in component:
+                component.add(x)
+                todo.extend(edges[x])
+        seen |= component
+        components.append(sorted(component))
+    assert sets.clusters(min_size=1) == components
+    # Union by size keeps the trees shallow
+    for x in sets.parent:
+        depth = 0
+        while sets.parent[x] != x:
+            x = sets.parent[x]
+            depth += 1
+        assert depth <= 8
@@ -0,0 +1,91 @@
+import csv
+import json
+import random
+from os import path
+import pytest
+from conftest import DATA_DIR
+from generate import Generator, generate, load_base
+
+
+BASE = load_base([path.join(DATA_DIR, "ms3", "chiDirty100.json")])
+
+
+# helper function that returns a Generator over chiDirty100 with the given
+# rates (the defaults of generate.py otherwise)
+def generator(seed=30235, dup_rate=0.3, typo_rate=0.3, abbrev_rate=0.3,
+              missing_zip_rate=0.05, chain_rate=0.05):
+    return Generator(BASE, random.Random(seed), dup_rate, typo_rate,
+                     abbrev_rate, missing_zip_rate, chain_rate, False)
+
+
+# helper function that generates count records into tmp_path, returning
+# the records and the (inspection_id, cluster_id) rows of the truth file
+def run(gen, count, tmp_path, name="synth"):
+    out_path = str(tmp_path / ("%s.json" % name))
+    truth_path = str(tmp_path / ("%s.truth.csv" % name))
+    generate(gen, count, out_path, truth_path)
+    with open(out_path) as out:
+        script = json.load(out)
+    with open(truth_path, newline="") as tf:
+        truth = list(csv.reader(tf))
+    assert truth[0] == ["inspection_id", "cluster_id"]
+    return script["values"], truth[1:]
+
+
+def test_same_seed_same_output(tmp_path):
+    first = run(generator(seed=7), 500, tmp_path, "first")
+    second = run(generator(seed=7), 500, tmp_path, "second")
+    assert first == second
+    assert run(generator(seed=8), 500, tmp_path, "other") != first
+
+
+def test_truth_matches_the_records(tmp_path):
+    gen = generator()
+    records, truth = run(gen, 1000, tmp_path)
+    assert [row[0] for row in truth] == \
+        [record["inspection_id"] for record in records]
+    assert len(set(row[0] for row in truth)) == 1000
+    clusters = [int(row[1]) for row in truth]
+    assert set(clusters) == set(range(len(gen.entities)))
+    # The first record of a cluster is its entity, as is
+    seen = set()
+    for record, cluster in zip(records, clusters):
+        if cluster not in seen:
+            seen.add(cluster)
+            entity = gen.entities[cluster]
+            assert {k: record[k] for k in entity} == entity
+
+
+def test_duplicate_rate(tmp_path):
+    records, truth = run(generator(dup_rate=0.3), 4000, tmp_path)
+    duplicates = len(truth) - len(set(row[1] for row in truth))
+    assert duplicates / len(truth) == pytest.approx(0.3, abs=0.03)
+
+
+@pytest.mark.parametrize("rates, changed", [
+    ({"typo_rate": 0, "abbrev_rate": 0, "missing_zip_rate": 0}, set()),
+    ({"typo_rate": 1, "abbrev_rate": 0, "missing_zip_rate": 0},
+     {"name", "address"}),
+    ({"typo_rate": 0, "abbrev_rate": 0, "missing_zip_rate": 1}, {"zip"})])
+def test_variant_rates(tmp_path, rates, changed):
+    gen = generator(dup_rate=0.5, **rates)
+    records, truth = run(gen, 2000, tmp_path)
+    seen = set()
+    duplicates = 0
+    differ = {attr: 0 for attr in ["name", "address", "zip"]}
+    for record, (_, cluster) in zip(records, truth):
+        if cluster not in seen:
+            seen.add(cluster)
+            continue
+        duplicates += 1
+        entity = gen.entities[int(cluster)]
+        for attr in differ:
+            differ[attr] += record[attr] != entity[attr]
+    assert duplicates > 800
+    for attr, count in differ.items():
+        if attr in changed:
+            # A typo can leave the text as is (e.g. two equal letters
+            # transposed)
+            assert count / duplicates > 0.9, attr
+        else:
+            assert count == 0, attr
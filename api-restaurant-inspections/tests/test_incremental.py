@@ -0,0 +1,82 @@
+import json
+import sqlite3
+from os import path
+import pytest
+from conftest import DATA_DIR, links
+from db import CLEAN_COLUMNS, DB
+from loader import iter_records, load_files
+from records import read_records
+
+
+# Records of chiDirty100 loaded before the first clean, the rest trickle in
+# after it
+FIRST_LOAD = 60
+
+
+# helper function that writes the records of chiDirty100 in two NDJSON
+# files, the ones loaded before and after the first clean
+@pytest.fixture(scope="module")
+def trickle(tmp_path_factory):
+    records = list(iter_records(path.join(DATA_DIR, "ms3",
+                                          "chiDirty100.json")))
+    files = []
+    for n, part in enumerate([records[:FIRST_LOAD], records[FIRST_LOAD:]]):
+        file_path = str(tmp_path_factory.mktemp("trickle") / ("%s.ndjson" % n))
+        with open(file_path, "w") as file_out:
+            file_out.writelines(json.dumps(record) + "\n" for record in part)
+        files.append(file_path)
+    return files
+
+
+# helper function that reads every restaurant with an id up to max_id,
+# standing in for the incremental read in a full clean
+def full_records(db, strategies, max_id):
+    c = db.conn.cursor()
+    c.execute(f"""SELECT {CLEAN_COLUMNS} FROM ri_restaurants WHERE id <= ?
+              ORDER BY id;""", [max_id])
+    return read_records(c)
+
+
+# helper function that loads the two parts of chiDirty100, cleaning after
+# each, and returns the links and inspections the cleans leave
+def clean_twice(file_path, trickle, strategies):
+    conn = sqlite3.connect(file_path)
+    db = DB(conn)
+    for part in trickle:
+        load_files(conn, [part], 10000, progress=False)
+        db.block_records(True, strategies)
+    c = conn.cursor()
+    c.execute("SELECT id, restaurant_id FROM ri_inspections ORDER BY id;")
+    return links(conn), c.fetchall()
+
+
+@pytest.mark.parametrize("strategies", [["zip"], ["name", "street"]])
+def test_incremental_clean_matches_full_clean(db_file, tmp_path, trickle,
+                                              monkeypatch, strategies):
+    incremental = clean_twice(db_file, trickle, strategies)
+    assert incremental[0]
+    full_db = str(tmp_path / "full.db")
+    DB(sqlite3.connect(full_db)).create_script()
+    monkeypatch.setattr(DB, "incremental_records", full_records)
+    assert clean_twice(full_db, trickle, strategies) == incremental
+
+
+def test_incremental_read_only_touches_new_records(db_file, trickle):
+    conn = sqlite3.connect(db_file)
+    db = DB(conn)
+    load_files(conn, trickle[:1], 10000, progress=False)
+    db.block_records(True, ["zip"])
+    # Nothing new, nothing to read
+    assert db.clean_records(["zip"]) == []
+    load_files(conn, trickle[1:], 10000, progress=False)
+    c = conn.cursor()
+    c.execute("SELECT id, zip FROM ri_restaurants WHERE clean = 0;")
+    dirty = dict(c.fetchall())
+    records = db.clean_records(["zip"])
+    # The new records and the others of their zips
+    c.execute("SELECT COUNT(*) FROM ri_restaurants WHERE zip IN (%s);"
+              % ", ".join("?" * len(dirty)), list(dirty.values()))
+    assert len(records) == c.fetchone()[0]
+    assert {r.id for r in records if not r.clean} == set(dirty)
+    c.execute("SELECT COUNT(*) FROM ri_restaurants;")
+    assert len(records) < c.fetchone()[0]
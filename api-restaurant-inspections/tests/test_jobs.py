@@ -0,0 +1,122 @@
+import sqlite3
+import pytest
+import jobs
+import parallel
+from conftest import copy_db, links
+from db import DB
+from jobs import CleanJobs
+
+
+STRATEGIES = ["name", "street", "sorted"]
+
+# Candidate pairs per scoring task, so chiDirty100 is scored in several
+TASK_PAIRS = 500
+
+
+class Interrupted(Exception):
+    pass
+
+
+@pytest.fixture
+def small_tasks(monkeypatch):
+    monkeypatch.setattr(jobs, "TASK_PAIRS", TASK_PAIRS)
+    monkeypatch.setattr(parallel, "TASK_PAIRS", TASK_PAIRS)
+
+
+# helper function that returns a CleanJobs on a database file
+def clean_jobs(file_path):
+    return CleanJobs(lambda: sqlite3.connect(file_path,
+                                             check_same_thread=False))
+
+
+def test_resumes_at_last_checkpoint(dirty100, tmp_path, monkeypatch,
+                                    small_tasks):
+    expected_db = sqlite3.connect(copy_db(dirty100, tmp_path, "clean.db"))
+    expected = DB(expected_db).block_records(True, STRATEGIES)
+    job_db = copy_db(dirty100, tmp_path, "job.db")
+
+    # (1) A restart interrupts the job after its third checkpoint
+    checkpoint = DB.checkpoint_clean_job
+    def interrupt(db, job_id, *args):
+        if db.find_clean_job(job_id)["tasks_done"] == 3:
+            raise Interrupted()
+        checkpoint(db, job_id, *args)
+    db = DB(sqlite3.connect(job_db))
+    job_id = db.create_clean_job(STRATEGIES)
+    with monkeypatch.context() as m:
+        m.setattr(DB, "checkpoint_clean_job", interrupt)
+        with pytest.raises(Interrupted):
+            clean_jobs(job_db).clean(db, job_id)
+    job = db.find_clean_job(job_id)
+    total = -(-expected["pairs_scored"] // TASK_PAIRS)
+    assert (job["status"], job["tasks_done"], job["tasks_total"]) == \
+        ("running", 3, total)
+    assert job["pairs_scored"] == 3 * TASK_PAIRS
+    assert job["eta_seconds"] is not None
+    assert links(db.conn) == []
+
+    # (2) After the restart it is resumed, and only scores what is left
+    resumed = clean_jobs(job_db)
+    assert resumed.resume() == job_id
+    resumed.thread.join()
+    job = db.find_clean_job(job_id)
+    assert (job["status"], job["tasks_done"]) == ("done", total)
+    assert job["pairs_scored"] == expected["pairs_scored"]
+    assert resumed.last_stats["pairs_scored"] == \
+        expected["pairs_scored"] - 3 * TASK_PAIRS
+    assert links(db.conn) == links(expected_db)
+    assert not db.conn.execute("SELECT * FROM ri_clean_matches").fetchall()
+    # Nothing left to resume
+    assert clean_jobs(job_db).resume() is None
+
+
+def test_failed_job_is_recorded_and_not_resumed(dirty100, tmp_path,
+                                                monkeypatch):
+    job_db = copy_db(dirty100, tmp_path, "job.db")
+    def fail(*args):
+        raise sqlite3.OperationalError("disk I/O error")
+    monkeypatch.setattr(DB, "write_clusters", fail)
+    cleans = clean_jobs(job_db)
+    job_id = cleans.start(STRATEGIES)
+    cleans.thread.join()
+    db = DB(sqlite3.connect(job_db))
+    job = db.find_clean_job(job_id)
+    assert (job["status"], job["error"]) == ("failed", "disk I/O error")
+    assert not cleans.lock.locked()
+    assert clean_jobs(job_db).resume() is None
+
+
+def test_blocking_does_not_lock_writers(dirty100, tmp_path, monkeypatch):
+    # In the default rollback journal mode, not WAL, where a transaction
+    # left open by the job would keep every other writer out
+    job_db = copy_db(dirty100, tmp_path, "job.db")
+    written = []
+    block_pairs = DB.block_pairs
+    def write_meanwhile(db, *args, **kwargs):
+        assert not db.conn.in_transaction
+        other = sqlite3.connect(job_db, timeout=0.1)
+        other.execute("""INSERT INTO ri_restaurants (name, address, clean)
+                      VALUES ('WHILE BLOCKING', '1 N STATE ST', 0);""")
+        other.commit()
+        other.close()
+        written.append(True)
+        return block_pairs(db, *args, **kwargs)
+    monkeypatch.setattr(DB, "block_pairs", write_meanwhile)
+    cleans = clean_jobs(job_db)
+    job_id = cleans.start(STRATEGIES)
+    cleans.thread.join()
+    db = DB(sqlite3.connect(job_db))
+    assert db.find_clean_job(job_id)["status"] == "done"
+    assert written == [True]
+
+
+def test_one_job_at_a_time(dirty100, tmp_path):
+    cleans = clean_jobs(copy_db(dirty100, tmp_path, "job.db"))
+    cleans.lock.acquire()
+    assert cleans.start(STRATEGIES) is None
+    cleans.lock.release()
+    job_id = cleans.start(STRATEGIES)
+    cleans.thread.join()
+    assert cleans.last_stats["clusters"] > 0
+    assert cleans.start(STRATEGIES) == job_id + 1
+    cleans.thread.join()
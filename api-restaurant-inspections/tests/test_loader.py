@@ -0,0 +1,75 @@
+import io
+import json
+import sqlite3
+from os import path
+import pytest
+from conftest import DATA_DIR
+from loader import RecordStream, batches, iter_records, load_files
+
+
+DIRTY100 = path.join(DATA_DIR, "ms3", "chiDirty100.json")
+
+
+# helper function that returns the records of chiDirty100, read at once
+def dirty100_values():
+    with open(DIRTY100, "r") as file_in:
+        return json.load(file_in)["values"]
+
+
+# helper function that writes records to a file in tmp_path, as a JSON array
+# or NDJSON (by extension)
+def write_records(tmp_path, name, records):
+    file_path = str(tmp_path / name)
+    with open(file_path, "w") as file_out:
+        if name.endswith(".ndjson"):
+            file_out.writelines(json.dumps(record) + "\n"
+                                for record in records)
+        else:
+            json.dump(records, file_out)
+    return file_path
+
+
+def test_reads_every_format(tmp_path):
+    values = dirty100_values()
+    assert list(iter_records(DIRTY100)) == values
+    assert list(iter_records(write_records(tmp_path, "a.json",
+                                           values))) == values
+    assert list(iter_records(write_records(tmp_path, "a.ndjson",
+                                           values))) == values
+    assert list(iter_records(write_records(tmp_path, "e.json", []))) == []
+
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 7, 64])
+def test_stream_decodes_across_chunks(chunk_size):
+    # Values, numbers included, are cut at every chunk boundary
+    text = ' [ {"a": 12345, "b": [1, 2.5e3]}, 678, "x,]", true , null ] '
+    stream = RecordStream(io.StringIO(text), chunk_size)
+    assert list(stream.array()) == json.loads(text)
+
+
+def test_batches():
+    assert list(batches(range(5), 2)) == [[0, 1], [2, 3], [4]]
+    assert list(batches([], 2)) == []
+
+
+def test_loads_like_the_server_and_skips_duplicates(db_file, tmp_path):
+    values = dirty100_values()
+    invalid = [{"inspection_id": "x1", "name": "NO DATE", "address": "1 ST"},
+               {"inspection_id": "x2", "name": "BAD DATE", "address": "1 ST",
+                "date": "2015-10-22"}, 42]
+    file_path = write_records(tmp_path, "load.ndjson", values + invalid)
+    conn = sqlite3.connect(db_file)
+    # Batches smaller than the file, so several transactions are written
+    assert load_files(conn, [file_path], 30, progress=False) == \
+        (len(values), len(invalid))
+    c = conn.cursor()
+    c.execute("SELECT COUNT(*) FROM ri_inspections;")
+    assert c.fetchone()[0] == len(values)
+    c.execute("SELECT COUNT(DISTINCT name || address) FROM ri_restaurants;")
+    restaurants = c.fetchone()[0]
+    assert restaurants == len({(v["name"], v["address"]) for v in values})
+    # Loading the same file again only skips
+    assert load_files(conn, [file_path], 30, progress=False) == \
+        (0, len(values) + len(invalid))
+    c.execute("SELECT COUNT(*) FROM ri_restaurants;")
+    assert c.fetchone()[0] == restaurants
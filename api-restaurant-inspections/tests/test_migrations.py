@@ -0,0 +1,86 @@
+import sqlite3
+import pytest
+from db import DB, migration_scripts
+from errors import InspError
+from normalize import normalize_name
+
+
+# helper function that creates a database as the server made it before the
+# migrations: the base tables and no schema version (user_version 0), with
+# the given restaurants and one inspection for each
+def unversioned_db(tmp_path, restaurants):
+    conn = sqlite3.connect(str(tmp_path / "old.db"))
+    with open(migration_scripts()[0][1], "r") as script:
+        conn.executescript(script.read())
+    for rest_id, name, address in restaurants:
+        conn.execute("""INSERT INTO ri_restaurants (id, name, address, city,
+                     state, zip) VALUES (?, ?, ?, 'Chicago', 'IL', '60601')""",
+                     (rest_id, name, address))
+        conn.execute("""INSERT INTO ri_inspections (id, restaurant_id)
+                     VALUES (?, ?)""", ("i%s" % rest_id, rest_id))
+    conn.commit()
+    return conn
+
+
+# helper function that returns the rows of a query
+def rows(conn, query):
+    return conn.execute(query).fetchall()
+
+
+def test_upgrades_unversioned_database(tmp_path):
+    conn = unversioned_db(tmp_path, [(1, "A", "1 MAIN ST"),
+                                     (2, "B", "2 MAIN ST")])
+    db = DB(conn)
+    assert db.schema_version() == 0
+    latest = migration_scripts()[-1][0]
+    assert db.migrate() == latest
+    assert db.schema_version() == latest
+    assert db.migrate() == latest
+    # 0004 filled in the normalized columns of the rows already stored
+    assert rows(conn, """SELECT id, norm_name FROM ri_restaurants
+                ORDER BY id""") == [(1, normalize_name("A")),
+                                    (2, normalize_name("B"))]
+    assert rows(conn, """SELECT name FROM sqlite_master WHERE type = 'index'
+                AND name = 'ri_restaurants_name_address'""")
+
+
+def test_refuses_duplicates_without_changing_them(tmp_path):
+    conn = unversioned_db(tmp_path, [(1, "A", "1 MAIN ST"),
+                                     (2, "B", "2 MAIN ST"),
+                                     (3, "A", "1 MAIN ST"),
+                                     (4, "C", None), (5, "C", None)])
+    db = DB(conn)
+    with pytest.raises(InspError) as error:
+        db.migrate()
+    assert "1 restaurants sharing a name and address" in error.value.message
+    assert "('A', '1 MAIN ST', '1,3')" in error.value.message
+    assert "--merge-duplicates" in error.value.message
+    # 0001 is applied, 0002 and later are not
+    assert db.schema_version() == 1
+    assert rows(conn, "SELECT id FROM ri_restaurants ORDER BY id") == \
+        [(1,), (2,), (3,), (4,), (5,)]
+
+
+def test_merges_duplicates_on_request(tmp_path):
+    conn = unversioned_db(tmp_path, [(1, "A", "1 MAIN ST"),
+                                     (2, "B", "2 MAIN ST"),
+                                     (3, "A", "1 MAIN ST"),
+                                     (4, "C", None), (5, "C", None)])
+    # An older /clean linked the copy (3) as the primary of the original (1)
+    conn.execute("INSERT INTO ri_linked VALUES (3, 1), (3, 3);")
+    conn.commit()
+    db = DB(conn)
+    assert db.migrate(merge_duplicates=True) == migration_scripts()[-1][0]
+    assert rows(conn, "SELECT id FROM ri_restaurants ORDER BY id") == \
+        [(1,), (2,), (4,), (5,)]
+    assert rows(conn, """SELECT id, restaurant_id FROM ri_inspections
+                ORDER BY id""") == [("i1", 1), ("i2", 2), ("i3", 1),
+                                    ("i4", 4), ("i5", 5)]
+    assert rows(conn, "SELECT * FROM ri_linked") == [(1, 1)]
+    # The merged row and its inspections are kept
+    assert rows(conn, """SELECT id, kept_id, name, address
+                FROM ri_merged_restaurants""") == [(3, 1, "A", "1 MAIN ST")]
+    assert rows(conn, "SELECT * FROM ri_merged_inspections") == [("i3", 3)]
+    # Nothing left to merge
+    assert db.merge_duplicates() == 0
+
@@ -0,0 +1,132 @@
+import sqlite3
+import pytest
+from db import CLEAN_COLUMNS, DB, migration_scripts, split_inspection
+from normalize import (normalize_address, normalize_city, normalize_name,
+                       normalized)
+from records import read_records
+
+
+# Raw (name, address, city) values with the cases the rules handle: case,
+# dropped and separating punctuation, suffixes, directions, name words and
+# missing values
+RAW = [("Lou's Restaurant & Bar", "1234 North Clark Street.", "Chicago"),
+       ("LOUS REST AND BAR", "1234 N CLARK ST", "CHICAGO"),
+       ("st. john's  grill", "5-7 w. division st", " chicago. "),
+       ("A&W", "100 E Grand Avenue", "O'Hare"),
+       ("Acme Company, Incorporated", None, None)]
+
+
+def test_case_and_punctuation():
+    assert normalize_city(" chicago. ") == "CHICAGO"
+    assert normalize_city("O'Hare") == "OHARE"
+    # Apostrophes and periods are dropped within a word, the other
+    # punctuation separates words
+    assert normalize_name("st. john's  grill") == "ST JOHNS GRILL"
+    assert normalize_address("5-7 w. division st") == "5 7 W DIVISION ST"
+    assert normalize_name("Pizza/Pasta,  Inc") == "PIZZA PASTA INC"
+    assert normalize_name("") == ""
+    assert normalize_name("?!") == ""
+
+
+def test_address_words():
+    assert normalize_address("1234 North Clark Street.") == "1234 N CLARK ST"
+    assert normalize_address("1 SOUTH MICHIGAN AV") == "1 S MICHIGAN AVE"
+    assert normalize_address("9 West Lake Shore Drive") == \
+        "9 W LAKE SHORE DR"
+    # Only whole words are rewritten
+    assert normalize_address("10 NORTHWEST HWY") == "10 NORTHWEST HWY"
+    assert normalize_address("2 STREETER DR") == "2 STREETER DR"
+
+
+def test_name_words():
+    assert normalize_name("Lou's Restaurant & Bar") == "LOUS REST AND BAR"
+    assert normalize_name("A&W") == "A AND W"
+    assert normalize_name("Acme Company, Incorporated") == "ACME CO INC"
+    # Address words are left alone in names
+    assert normalize_name("Main Street Cafe") == "MAIN STREET CAFE"
+
+
+def test_missing_values():
+    assert normalize_name(None) is None
+    assert normalize_address(None) is None
+    assert normalize_city(None) is None
+    record = {"id": 1, "name": "Lou's", "address": None, "zip": "60601"}
+    assert normalized(record) == {"id": 1, "name": "LOUS", "address": None,
+                                  "city": None, "zip": "60601"}
+    assert record["name"] == "Lou's"
+
+
+def test_variants_normalize_alike():
+    assert len({(normalize_name(n), normalize_address(a), normalize_city(c))
+                for n, a, c in RAW[:2]}) == 1
+
+
+# helper function that returns, for every restaurant, its stored normalized
+# values and those normalize computes from its raw values
+def stored_and_computed(conn):
+    c = conn.execute("""SELECT name, address, city, norm_name, norm_address,
+                     norm_city FROM ri_restaurants ORDER BY id;""")
+    rows = c.fetchall()
+    return ([tuple(row[3:]) for row in rows],
+            [(normalize_name(row[0]), normalize_address(row[1]),
+              normalize_city(row[2])) for row in rows])
+
+
+def test_migration_backfills_normalized_values(tmp_path):
+    conn = sqlite3.connect(str(tmp_path / "old.db"))
+    with open(migration_scripts()[0][1], "r") as script:
+        conn.executescript(script.read())
+    conn.executemany("""INSERT INTO ri_restaurants (name, address, city)
+                     VALUES (?, ?, ?);""", RAW)
+    conn.commit()
+    DB(conn).migrate()
+    stored, computed = stored_and_computed(conn)
+    assert stored == computed
+    assert stored[-1] == ("ACME CO INC", None, None)
+
+
+# helper function that returns an inspection record with a raw name,
+# address and city
+def inspection(n, name, address, city):
+    return {"inspection_id": str(n), "name": name, "address": address,
+            "city": city, "state": "IL", "zip": "60601",
+            "facility_type": None, "latitude": None, "longitude": None,
+            "risk": None, "date": "01/02/2020", "inspection_type": None,
+            "results": None, "violations": None}
+
+
+@pytest.mark.parametrize("batch", [False, True])
+def test_inserts_store_normalized_values(db_file, batch):
+    db = DB(sqlite3.connect(db_file))
+    records = [split_inspection(inspection(n, *raw))
+               for n, raw in enumerate(RAW)]
+    if batch:
+        db.add_inspections_batch(records)
+    else:
+        for record in records:
+            db.add_inspection_for_restaurant(*record)
+    db.commit()
+    stored, computed = stored_and_computed(db.conn)
+    assert len(stored) == len(RAW)
+    assert stored == computed
+
+
+def test_seed_stores_normalized_values(db_file):
+    db = DB(sqlite3.connect(db_file))
+    db.seed_data()
+    stored, computed = stored_and_computed(db.conn)
+    assert stored
+    assert stored == computed
+
+
+def test_clean_reads_normalize_rows_without_values(db_file):
+    # Rows inserted by raw SQL (e.g. /web/query) have no normalized values,
+    # the cleaning computes them as it reads
+    db = DB(sqlite3.connect(db_file))
+    db.conn.executemany("""INSERT INTO ri_restaurants (name, address, city,
+                        clean) VALUES (?, ?, ?, 0);""", RAW)
+    records = read_records(db.conn.execute(
+        f"SELECT {CLEAN_COLUMNS} FROM ri_restaurants ORDER BY id;"))
+    assert [(r["name"], r["address"], r["city"]) for r in records] == \
+        [(normalize_name(n), normalize_address(a), normalize_city(c))
+         for n, a, c in RAW]
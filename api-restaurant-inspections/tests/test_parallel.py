@@ -0,0 +1,59 @@
+import sqlite3
+import pytest
+from conftest import copy_db, links
+from db import DB
+from jobs import CleanJobs
+from stats import COUNTERS
+
+
+# helper function that returns the counters and the passes of clean stats,
+# without their timings
+def counted(stats):
+    passes = {name: {k: v for k, v in totals.items() if k != "seconds"}
+              for name, totals in stats["passes"].items()}
+    return {name: stats[name] for name in COUNTERS}, passes
+
+
+# helper function that cleans a copy of a database with the blocking passes
+# on workers processes, returning the counted stats and the links
+def clean(template, tmp_path, strategies, workers):
+    conn = sqlite3.connect(copy_db(template, tmp_path, "w%s.db" % workers))
+    stats = DB(conn).block_records(True, strategies, workers)
+    return counted(stats), links(conn)
+
+
+@pytest.mark.parametrize("strategies", [["zip"], ["name", "street", "sorted"],
+                                        ["zip", "qgram", "lsh"]])
+def test_workers_count_and_cluster_like_serial(dirty100, tmp_path,
+                                               strategies):
+    serial = clean(dirty100, tmp_path, strategies, 0)
+    assert clean(dirty100, tmp_path, strategies, 2) == serial
+    (counters, passes), linked = serial
+    assert linked
+    # Every pair is scored once, by the first block that found it
+    assert counters["pairs_scored"] == sum(p["pairs"] for p in passes.values())
+    assert counters["matches"] == sum(p["matches"] for p in passes.values())
+
+
+def test_matches_are_distinct_pairs(dirty100, tmp_path):
+    # Both orders of a pair of dirty records are scored, one match is counted
+    (counters, _), _ = clean(dirty100, tmp_path, ["qgram"], 0)
+    conn = sqlite3.connect(copy_db(dirty100, tmp_path, "ms3.db"))
+    ms3 = DB(conn).block_records(False)
+    assert ms3["matches"] == counters["matches"]
+    assert counters["matches"] < counters["pairs_scored"]
+
+
+@pytest.mark.parametrize("workers", [0, 2])
+def test_job_counts_and_clusters_like_clean(dirty100, tmp_path, workers):
+    strategies = ["name", "street", "sorted"]
+    expected = clean(dirty100, tmp_path, strategies, 0)
+    job_db = copy_db(dirty100, tmp_path, "job.db")
+    jobs = CleanJobs(lambda: sqlite3.connect(job_db,
+                                             check_same_thread=False),
+                     workers)
+    job_id = jobs.start(strategies)
+    jobs.thread.join()
+    conn = sqlite3.connect(job_db)
+    assert DB(conn).find_clean_job(job_id)["status"] == "done"
+    assert (counted(jobs.last_stats), links(conn)) == expected
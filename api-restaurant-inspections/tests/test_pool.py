@@ -0,0 +1,102 @@
+import sqlite3
+import threading
+from pool import ConnectionPool, PooledWSGIServer
+
+
+def test_connections_use_wal_and_pragmas(db_file):
+    pool = ConnectionPool(db_file, 2)
+    conn = pool.acquire()
+    assert conn.execute("PRAGMA journal_mode;").fetchone()[0] == "wal"
+    assert conn.execute("PRAGMA synchronous;").fetchone()[0] == 1  # NORMAL
+    assert conn.execute("PRAGMA temp_store;").fetchone()[0] == 2  # MEMORY
+    pool.release(conn)
+    # The journal mode is kept in the file
+    other = sqlite3.connect(db_file)
+    assert other.execute("PRAGMA journal_mode;").fetchone()[0] == "wal"
+    other.close()
+
+
+def test_at_most_size_connections_are_checked_out(db_file):
+    pool = ConnectionPool(db_file, 2)
+    first, second = pool.acquire(), pool.acquire()
+    assert first is not second
+    waiting = []
+    waiter = threading.Thread(target=lambda: waiting.append(pool.acquire()))
+    waiter.start()
+    waiter.join(0.2)
+    # The third thread waits for a connection to be released, then gets it
+    assert waiter.is_alive() and not waiting
+    pool.release(second)
+    waiter.join(5)
+    assert waiting == [second]
+
+
+def test_reads_are_not_blocked_by_a_write(db_file):
+    pool = ConnectionPool(db_file, 2)
+    writer = pool.acquire_writer()
+    writer.execute("""INSERT INTO ri_restaurants (name, address)
+                   VALUES ('A', '1 MAIN ST');""")
+    writer.commit()
+    writer.execute("""INSERT INTO ri_restaurants (name, address)
+                   VALUES ('B', '2 MAIN ST');""")
+    # While the write is open, a reader sees the last committed state
+    reader = pool.acquire()
+    assert reader.execute("SELECT name FROM ri_restaurants;").fetchall() == \
+        [("A",)]
+    writer.commit()
+    assert reader.execute("SELECT COUNT(*) FROM ri_restaurants;").fetchone() \
+        == (2,)
+    pool.release(reader)
+    pool.release_writer()
+
+
+def test_writes_are_serialized(db_file):
+    pool = ConnectionPool(db_file, 2)
+    pool.acquire_writer()
+    acquired = threading.Event()
+    def write():
+        pool.acquire_writer()
+        acquired.set()
+        pool.release_writer()
+    other = threading.Thread(target=write)
+    other.start()
+    assert not acquired.wait(0.2)
+    pool.release_writer()
+    assert acquired.wait(5)
+    other.join()
+
+
+def test_transaction_state_is_read_under_the_write_lock(db_file):
+    pool = ConnectionPool(db_file, 2)
+    writer = pool.acquire_writer()
+    writer.execute("""INSERT INTO ri_restaurants (name, address)
+                   VALUES ('A', '1 MAIN ST');""")
+    answers = []
+    other = threading.Thread(
+        target=lambda: answers.append(pool.writer_in_transaction()))
+    other.start()
+    # The request that is writing decides, here by committing, before the
+    # state is read
+    other.join(0.2)
+    assert other.is_alive() and not answers
+    writer.commit()
+    pool.release_writer()
+    other.join(5)
+    assert answers == [False]
+    # The thread holding the lock reads it too
+    pool.acquire_writer()
+    writer.execute("""INSERT INTO ri_restaurants (name, address)
+                   VALUES ('B', '2 MAIN ST');""")
+    assert pool.writer_in_transaction()
+    writer.rollback()
+    pool.release_writer()
+
+
+def test_server_reports_multithread():
+    server = PooledWSGIServer("127.0.0.1", 0, lambda environ, start: [], 2)
+    try:
+        assert server.multithread
+        assert not server.multiprocess
+    finally:
+        server.server_close()
+        server.executor.shutdown()
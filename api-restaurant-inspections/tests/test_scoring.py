@@ -0,0 +1,68 @@
+import random
+import sqlite3
+import textdistance
+from similarity.jarowinkler import JaroWinkler
+from db import DB
+from scoring import (THRESHOLD, char_counts, jaccard, jaro_winkler,
+                     levenshtein, score_matrix, score_pairs)
+
+
+# Values where the kernels have edge cases: empty strings, equal strings,
+# one character, common prefixes longer than 4, repeated characters
+EDGE_VALUES = ["", "A", "AB", "BA", "AAAA", "ABCDEFGH", "ABCDEFGX",
+               "JOES PIZZA", "JOE'S PIZZA", "JOES PIZZ", "PIZZA JOES",
+               "1 MAIN ST", "1 MAIN STREET", "CHICAGO", "CHICAGOO", "CHCAGO"]
+
+
+# helper function that returns pairs of random strings over a small
+# alphabet, so they share characters
+def random_pairs(n, seed=0):
+    rng = random.Random(seed)
+    alphabet = "ABCDE "
+    return [("".join(rng.choice(alphabet) for _ in range(rng.randint(0, 12))),
+             "".join(rng.choice(alphabet) for _ in range(rng.randint(0, 12))))
+            for _ in range(n)]
+
+
+VALUE_PAIRS = ([(a, b) for a in EDGE_VALUES for b in EDGE_VALUES]
+               + random_pairs(2000))
+
+
+def test_jaro_winkler_matches_strsim():
+    reference = JaroWinkler()
+    for a, b in VALUE_PAIRS:
+        assert jaro_winkler(a, b) == reference.similarity(a, b), (a, b)
+
+
+def test_jaccard_matches_textdistance():
+    for a, b in VALUE_PAIRS:
+        assert (jaccard(a, b, char_counts(a), char_counts(b))
+                == textdistance.jaccard.normalized_similarity(a, b)), (a, b)
+
+
+def test_levenshtein_matches_textdistance():
+    for a, b in VALUE_PAIRS:
+        assert (levenshtein(a, b)
+                == textdistance.levenshtein.normalized_similarity(a, b)), (a, b)
+
+
+def test_scores_match_find_similarity(dirty100_records):
+    records = dirty100_records
+    db = DB(sqlite3.connect(":memory:"))
+    rows = score_matrix(records, records)
+    for i, row in enumerate(rows):
+        for j, score in enumerate(row):
+            assert score == db.find_similarity(records[i], records[j])
+
+
+def test_cascade_keeps_exact_scores_of_matches(dirty100_records):
+    records = dirty100_records
+    pairs = [(i, j) for i in range(len(records))
+             for j in range(len(records)) if i != j]
+    exact = score_pairs(records, pairs)
+    cascade = score_pairs(records, pairs, threshold=THRESHOLD)
+    for (i, j), score, bounded in zip(pairs, exact, cascade):
+        if score >= THRESHOLD:
+            assert bounded == score
+        else:
+            assert bounded < THRESHOLD
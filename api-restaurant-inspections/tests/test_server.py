@@ -0,0 +1,125 @@
+import sqlite3
+import pytest
+from db import DB
+from writer import GroupCommitWriter
+
+
+@pytest.mark.parametrize("body", [b"garbage", b"[1]", b'"x"', b"{"])
+@pytest.mark.parametrize("url", ["/txn", "/clean/preview"])
+def test_malformed_body_is_rejected(client, url, body):
+    response = client.post(url, data=body,
+                           content_type="application/json")
+    assert response.status_code == 400
+    assert response.get_json()["message"] == "body must be a JSON object"
+
+
+def test_garbage_body_without_json_type_is_rejected(client):
+    response = client.post("/txn", data=b"garbage",
+                           content_type="text/plain")
+    assert response.status_code == 400
+
+
+def test_txn_without_body(client):
+    response = client.post("/txn")
+    assert response.status_code == 201
+    assert response.get_json()["txn_id"]
+
+
+def test_txn_size(client):
+    assert client.post("/txn", json={"size": 2}).status_code == 201
+    for size in [-1, True, "2"]:
+        assert client.post("/txn", json={"size": size}).status_code == 400
+
+
+def test_preview_without_body(client):
+    response = client.post("/clean/preview")
+    assert response.status_code == 200
+    assert response.get_json()["clusters"] == []
+
+
+# helper function that returns an inspection record to post
+def inspection(inspection_id, name="CAFE", address="1 MAIN ST"):
+    return {"inspection_id": inspection_id, "name": name, "address": address,
+            "city": "CHICAGO", "state": "IL", "zip": "60601",
+            "facility_type": "Restaurant", "latitude": None,
+            "longitude": None, "risk": "Risk 1 (High)", "date": "01/02/2020",
+            "inspection_type": "Canvass", "results": "Pass",
+            "violations": None}
+
+
+# helper function that counts the rows of a table through the server's
+# connection
+def count(table):
+    import server
+    c = server.app.config["_database"].cursor()
+    c.execute("SELECT COUNT(*) FROM %s;" % table)
+    return c.fetchone()[0]
+
+
+def test_batch_reports_repeated_inspections(client):
+    response = client.post("/inspections/batch", json=[
+        inspection("1"), inspection("2", "DINER", "2 MAIN ST"),
+        inspection(1, "BAR", "3 MAIN ST"), {"name": "NO ID"}])
+    assert response.status_code == 200
+    results = response.get_json()
+    assert [r["status"] for r in results] == [201, 201, 409, 400]
+    assert "restaurant_id" not in results[2]
+    # The repeated inspection creates no restaurant
+    assert count("ri_restaurants") == 2
+    assert count("ri_inspections") == 2
+
+
+def test_batch_reports_inspections_already_loaded(client):
+    client.post("/inspections/batch", json=[inspection("1")])
+    response = client.post("/inspections/batch", json=[
+        inspection("1", "BAR", "3 MAIN ST"), inspection("2")])
+    assert [r["status"] for r in response.get_json()] == [409, 200]
+    assert count("ri_restaurants") == 1
+    assert count("ri_inspections") == 2
+
+
+def test_group_commit_failure_is_answered_400(client, db_file, monkeypatch):
+    import server
+    writer = GroupCommitWriter(
+        lambda: sqlite3.connect(db_file, check_same_thread=False), 1, 50)
+    monkeypatch.setitem(server.app.config, "_writer", writer.start())
+    assert client.post("/inspections",
+                       json=inspection("1")).status_code == 201
+    # A group whose commit fails answers every record in it with 400
+    def fail(db):
+        raise sqlite3.OperationalError("disk I/O error")
+    monkeypatch.setattr(DB, "commit", fail)
+    assert client.post("/inspections",
+                       json=inspection("2", "DINER")).status_code == 400
+    # And an invalid record is refused before it is queued
+    assert client.post("/inspections",
+                       json=dict(inspection("3"), date=None)).status_code == 400
+
+
+def test_inspection_already_loaded_is_rejected(client):
+    assert client.post("/inspections",
+                       json=inspection("1")).status_code == 201
+    client.get("/commit")
+    response = client.post("/inspections",
+                           json=inspection("1", "BAR", "3 MAIN ST"))
+    assert response.status_code == 400
+    # The transaction is aborted, with the restaurant made for the record
+    assert count("ri_restaurants") == 1
+    assert count("ri_inspections") == 1
+
+
+def test_group_commit_rejects_an_inspection_already_loaded(client, db_file,
+                                                           monkeypatch):
+    import server
+    writer = GroupCommitWriter(
+        lambda: sqlite3.connect(db_file, check_same_thread=False), 1, 50)
+    monkeypatch.setitem(server.app.config, "_writer", writer.start())
+    assert client.post("/inspections",
+                       json=inspection("1")).status_code == 201
+    assert client.post("/inspections", json=inspection(
+        "1", "BAR", "3 MAIN ST")).status_code == 400
+    conn = sqlite3.connect(db_file)
+    for table in ["ri_restaurants", "ri_inspections"]:
+        c = conn.execute("SELECT COUNT(*) FROM %s;" % table)
+        assert c.fetchone()[0] == 1
+    conn.close()
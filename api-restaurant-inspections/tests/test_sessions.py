@@ -0,0 +1,97 @@
+import sqlite3
+from db import DB, split_inspection
+from sessions import SessionManager
+from test_server import inspection
+
+
+# helper function that counts the inspections committed to a database file
+def committed(file_path):
+    conn = sqlite3.connect(file_path)
+    n = conn.execute("SELECT COUNT(*) FROM ri_inspections;").fetchone()[0]
+    conn.close()
+    return n
+
+
+# helper function that opens a session, returning its id
+def open_session(client, **body):
+    response = client.post("/txn", json=body)
+    assert response.status_code == 201
+    return response.get_json()["txn_id"]
+
+
+# helper function that posts an inspection to a session
+def stage(client, txn_id, record):
+    return client.post("/inspections", json=record,
+                       headers={"X-Txn-Id": txn_id})
+
+
+def test_commit_writes_only_its_session(client, db_file):
+    first, second = open_session(client), open_session(client)
+    assert stage(client, first, inspection("1")).status_code == 202
+    response = stage(client, first, inspection("2", "DINER", "2 MAIN ST"))
+    assert response.get_json() == {"txn_id": first, "staged": 2}
+    assert client.post("/inspections?txn=%s" % second,
+                       json=inspection("3", "BAR")).status_code == 202
+    assert stage(client, first, {"name": "NO ID"}).status_code == 400
+    # Nothing is written before the commit
+    assert committed(db_file) == 0
+    response = client.get("/commit/%s" % first)
+    assert response.status_code == 200
+    assert [(r["inspection_id"], r["status"])
+            for r in response.get_json()] == [("1", 201), ("2", 201)]
+    assert committed(db_file) == 2
+    # The other session still holds its inspection, until it aborts
+    assert client.get("/abort/%s" % second).get_json() == \
+        {"txn_id": second, "aborted": 1}
+    assert client.get("/commit/%s" % second).get_json() == []
+    assert committed(db_file) == 2
+
+
+def test_abort_drops_staged_inspections(client, db_file):
+    txn_id = open_session(client)
+    stage(client, txn_id, inspection("1"))
+    assert client.get("/abort/%s" % txn_id).get_json()["aborted"] == 1
+    assert client.get("/commit/%s" % txn_id).get_json() == []
+    assert committed(db_file) == 0
+
+
+def test_failed_commit_keeps_staged_inspections(client, db_file,
+                                                monkeypatch):
+    txn_id = open_session(client)
+    stage(client, txn_id, inspection("1"))
+    add = DB.add_inspections_batch
+    def fail(db, records):
+        add(db, records)
+        raise sqlite3.OperationalError("database is locked")
+    monkeypatch.setattr(DB, "add_inspections_batch", fail)
+    assert client.get("/commit/%s" % txn_id).status_code == 400
+    assert committed(db_file) == 0
+    monkeypatch.setattr(DB, "add_inspections_batch", add)
+    response = client.get("/commit/%s" % txn_id)
+    assert [r["status"] for r in response.get_json()] == [201]
+    assert committed(db_file) == 1
+
+
+def test_session_commits_every_size_inspections(client, db_file):
+    txn_id = open_session(client, size=2)
+    assert "committed" not in stage(client, txn_id,
+                                    inspection("1")).get_json()
+    response = stage(client, txn_id, inspection("2", "DINER", "2 MAIN ST"))
+    assert response.get_json() == {"txn_id": txn_id, "staged": 0,
+                                   "committed": 2}
+    assert committed(db_file) == 2
+
+
+def test_unknown_session(client):
+    assert client.get("/commit/nope").status_code == 404
+    assert client.get("/abort/nope").status_code == 404
+    assert stage(client, "nope", inspection("1")).status_code == 404
+
+
+def test_unused_sessions_expire(db_file):
+    sessions = SessionManager(lambda: sqlite3.connect(db_file), ttl=-1)
+    txn = sessions.create()
+    txn.stage(*split_inspection(inspection("1")))
+    sessions.expire()
+    assert sessions.sessions == {}
+    assert txn.staged == []
@@ -0,0 +1,43 @@
+import sqlite3
+from conftest import copy_db
+from db import DB
+from stats import CleanStats, size_bucket
+
+
+def test_count_pairs_counts_distinct_matches():
+    stats = CleanStats(["zip"])
+    block = stats.add_block("zip", 3, 4, 0, 0.0)
+    assert stats.count_pairs(4, [(1, 2), (2, 1), (3, 1)], block) == {
+        (1, 2), (1, 3)}
+    # A pair a later pass matches again is not a new match
+    later = stats.add_block("name", 2, 1, 0, 0.0)
+    assert stats.count_pairs(1, [(2, 1)], later) == set()
+    assert stats.counters["pairs_scored"] == 5
+    assert stats.counters["matches"] == 2
+    assert [block[3] for block in stats.blocks] == [2, 0]
+
+
+def test_size_bucket():
+    assert [size_bucket(n) for n in [1, 2, 3, 4, 7, 9]] == [
+        "1", "2", "3-4", "3-4", "5-8", "9-16"]
+
+
+def test_modes_report_comparable_stats(dirty100, tmp_path):
+    # The MS3 clean, the qgram pass (its matches) and their previews
+    # count the same matches and clusters
+    results = []
+    for blocking in [None, ["qgram"]]:
+        conn = sqlite3.connect(copy_db(dirty100, tmp_path))
+        db = DB(conn)
+        _, preview = db.preview_clean(blocking)
+        stats = db.block_records(blocking is not None, blocking)
+        results.append(stats)
+        for name in ["dirty", "pairs_scored", "matches", "clusters"]:
+            assert preview[name] == stats[name]
+        conn.close()
+    ms3, qgram = results
+    assert ms3["matches"] == qgram["matches"] > 0
+    assert ms3["clusters"] == qgram["clusters"]
+    # MS3 scores every dirty record against every other record
+    assert ms3["pairs_scored"] == ms3["dirty"] * (ms3["records"] - 1)
+    assert qgram["pairs_scored"] < ms3["pairs_scored"]
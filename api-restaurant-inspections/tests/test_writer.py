@@ -0,0 +1,120 @@
+import sqlite3
+import time
+import pytest
+from cache import RestaurantCache
+from db import DB, split_inspection
+from writer import GroupCommitWriter
+
+
+# helper function that returns the (inspection, restaurant) of a record
+def record(n, date="10/22/2015"):
+    return split_inspection({
+        "inspection_id": "g%s" % n, "name": "REST %s" % n,
+        "address": "%s MAIN ST" % n, "city": "CHICAGO", "state": "IL",
+        "zip": "60601", "date": date, "risk": None, "facility_type": None,
+        "inspection_type": None, "results": None, "violations": None,
+        "latitude": None, "longitude": None})
+
+
+# helper function that counts the rows of a table
+def count(file_path, table):
+    conn = sqlite3.connect(file_path)
+    n = conn.execute("SELECT COUNT(*) FROM %s;" % table).fetchone()[0]
+    conn.close()
+    return n
+
+
+# helper function that starts a writer on a database file
+def start_writer(file_path, max_records, max_delay_ms=10000,
+                 rest_cache=None):
+    return GroupCommitWriter(
+        lambda: sqlite3.connect(file_path, check_same_thread=False),
+        max_records, max_delay_ms, rest_cache).start()
+
+
+def test_commits_full_groups(db_file):
+    writer = start_writer(db_file, 3)
+    futures = [writer.submit(*record(n)) for n in range(3)]
+    assert [future.result(5)[1] for future in futures] == [201] * 3
+    assert (writer.groups, writer.records) == (1, 3)
+    assert count(db_file, "ri_inspections") == 3
+
+
+def test_commits_after_the_delay(db_file):
+    writer = start_writer(db_file, 100, max_delay_ms=50)
+    start = time.monotonic()
+    assert writer.submit(*record(1)).result(5)[1] == 201
+    assert time.monotonic() - start < 5
+    assert count(db_file, "ri_inspections") == 1
+
+
+def test_flush_commits_right_away(db_file):
+    writer = start_writer(db_file, 100)
+    future = writer.submit(*record(1))
+    writer.flush()
+    assert future.done()
+    assert count(db_file, "ri_inspections") == 1
+
+
+def test_failed_record_is_rolled_back_alone(db_file):
+    writer = start_writer(db_file, 3)
+    futures = [writer.submit(*record(1)),
+               writer.submit(*record(2, date="2015-10-22")),
+               writer.submit(*record(3))]
+    assert futures[0].result(5)[1] == 201
+    with pytest.raises(ValueError):
+        futures[1].result(5)
+    assert futures[2].result(5)[1] == 201
+    # Nothing of the failed record is kept, not even its restaurant
+    assert count(db_file, "ri_inspections") == 2
+    assert count(db_file, "ri_restaurants") == 2
+
+
+def test_failed_record_keeps_the_cached_ids_of_the_group(db_file):
+    cache = RestaurantCache(100)
+    writer = start_writer(db_file, 3, rest_cache=cache)
+    futures = [writer.submit(*record(1)),
+               writer.submit(*record(2, date="2015-10-22")),
+               writer.submit(*record(3))]
+    ids = {n: futures[n - 1].result(5)[0] for n in [1, 3]}
+    with pytest.raises(ValueError):
+        futures[1].result(5)
+    # The restaurants of the committed records are cached, not the other
+    for n in [1, 3]:
+        assert cache.get(("REST %s" % n, "%s MAIN ST" % n)) == ids[n]
+    assert cache.get(("REST 2", "2 MAIN ST")) is None
+    assert len(cache) == 2
+
+
+def test_failed_commit_fails_the_whole_group(db_file, monkeypatch):
+    commit = DB.commit
+    def fail_once(db):
+        monkeypatch.setattr(DB, "commit", commit)
+        raise sqlite3.OperationalError("database is locked")
+    monkeypatch.setattr(DB, "commit", fail_once)
+    writer = start_writer(db_file, 2)
+    futures = [writer.submit(*record(n)) for n in range(2)]
+    for future in futures:
+        with pytest.raises(sqlite3.OperationalError):
+            future.result(5)
+    assert count(db_file, "ri_inspections") == 0
+    assert count(db_file, "ri_restaurants") == 0
+    # The writer keeps going with the next group
+    futures = [writer.submit(*record(n)) for n in range(2)]
+    assert [future.result(5)[1] for future in futures] == [201] * 2
+    assert count(db_file, "ri_inspections") == 2
+
+
+def test_failed_commit_still_answers_a_flush(db_file, monkeypatch):
+    commit = DB.commit
+    def fail_once(db):
+        monkeypatch.setattr(DB, "commit", commit)
+        raise sqlite3.OperationalError("database is locked")
+    monkeypatch.setattr(DB, "commit", fail_once)
+    writer = start_writer(db_file, 100)
+    future = writer.submit(*record(1))
+    # The flush did not write the failed record, it only waits for it
+    assert writer.flush() is None
+    with pytest.raises(sqlite3.OperationalError):
+        future.result(5)
+    assert count(db_file, "ri_inspections") == 0